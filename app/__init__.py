@@ -1,15 +1,16 @@
-from flask import Flask
+from flask import Flask, Response, g, has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from flask_apscheduler import APScheduler
 from flask_cors import CORS
 from config import Config
+from sqlalchemy import event
 import logging
+import os
 import sys
+import time
 
 db = SQLAlchemy()
 migrate = Migrate()
-scheduler = APScheduler()
 
 def setup_logging(app):
     """Configure logging for the application"""
@@ -23,35 +24,193 @@ def setup_logging(app):
     
     app.logger.addHandler(file_handler)
     app.logger.setLevel(logging.INFO)
-    app.logger.info('Podcast service startup')
+    app.logger.info(f"Podcast service startup ({app.config['APP_ROLE']})")
 
-def create_app(config_class=Config):
+def setup_query_counter(app):
+    """Count the SQL statements issued while handling each request.
+
+    The count is kept in ``g.query_count`` and, with QUERY_COUNT_HEADER
+    set, returned in an ``X-Query-Count`` response header so tests can
+    assert that a route issues a constant number of statements.
+    """
+    def count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+    
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_query)
+    
+    # g outlives the request when an app context was already pushed
+    @app.before_request
+    def reset_query_count():
+        g.query_count = 0
+    
+    if app.config['QUERY_COUNT_HEADER']:
+        @app.after_request
+        def add_query_count(response):
+            response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+            return response
+
+def setup_metrics(app):
+    """Collect request and commit latencies and serve all metrics at /metrics.
+
+    Metrics are kept per process in the Prometheus text format; job workers
+    serve their own on JOB_METRICS_PORT.
+    """
+    if not app.config['METRICS_ENABLED']:
+        return
+    
+    from app.services.metrics import CONTENT_TYPE, http_request_seconds, registry, time_commits
+    time_commits()
+    
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+    
+    @app.after_request
+    def record_request_time(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            http_request_seconds.observe(
+                time.perf_counter() - started,
+                endpoint=request.endpoint or 'unknown',
+                method=request.method,
+                status=response.status_code
+            )
+        return response
+    
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+def setup_profiler(app):
+    """Profile requests sent with an ``X-Profile: 1`` header.
+
+    Only active with PROFILER_ENABLED. The response body is replaced by the
+    plain-text profile and the original status code is kept.
+    """
+    if not app.config['PROFILER_ENABLED']:
+        return
+    
+    from app.services.profiling import RequestProfiler
+    
+    @app.before_request
+    def start_profiler():
+        if request.headers.get('X-Profile') == '1':
+            g.profiler = RequestProfiler(app.config['PROFILER_INTERVAL'])
+            g.profiler.start()
+    
+    @app.after_request
+    def attach_profile(response):
+        profiler = g.pop('profiler', None)
+        if profiler is None:
+            return response
+        response.set_data(profiler.report())
+        response.content_type = 'text/plain; charset=utf-8'
+        response.headers['X-Profile-Engine'] = profiler.engine
+        return response
+    
+    @app.teardown_request
+    def stop_profiler(exc):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+
+# What create_app builds for each APP_ROLE
+APP_ROLES = ('api', 'worker', 'cli')
+
+# Global flask CLI options that take a value, e.g. ``flask --app x db upgrade``
+FLASK_OPTIONS_WITH_VALUE = ('--app', '-A', '--env-file', '-e')
+
+def command_role(args):
+    """The role a flask command line needs, from its arguments after ``flask``.
+
+    ``run`` serves the API and ``jobs work`` runs a job worker; every other
+    command (``db upgrade``, ``jobs enqueue``, ...) needs neither the web
+    stack nor the model.
+    """
+    words = []
+    args = iter(args)
+    for arg in args:
+        if arg in FLASK_OPTIONS_WITH_VALUE:
+            next(args, None)
+        elif not arg.startswith('-'):
+            words.append(arg)
+    if words[:1] == ['run']:
+        return 'api'
+    if words[:2] == ['jobs', 'work']:
+        return 'worker'
+    return 'cli'
+
+def launch_role():
+    """The role for a process started by the ``flask`` CLI without APP_ROLE,
+    picked from its command; None otherwise (e.g. under Gunicorn)"""
+    program = os.path.normpath(sys.argv[0])
+    if 'APP_ROLE' in os.environ or (os.path.basename(program) != 'flask'
+                                    and not program.endswith(os.path.join('flask', '__main__.py'))):
+        return None
+    return command_role(sys.argv[1:])
+
+def preload_model(app):
+    """Load the embedding model up front so the first embedding is fast"""
+    from app.services.embedding_service import warm_up
+    with app.app_context():
+        try:
+            warm_up()
+        except Exception as e:
+            app.logger.error(f"Embedding model warm-up failed: {str(e)}")
+
+def create_app(config_class=Config, role=None):
+    """Build the app for a process role (default: APP_ROLE, or the one the
+    command needs when started by the ``flask`` CLI without APP_ROLE).
+
+    - ``api``: the web interface and API, metrics and profiler; the model is
+      preloaded unless EMBEDDING_PRELOAD or SEARCH_TEXT_QUERIES is off.
+    - ``worker``: job queue processes; the model is preloaded with
+      EMBEDDING_PRELOAD, since every new episode is embedded.
+    - ``cli``: extensions and commands only, for migrations and one-off
+      commands. Never loads the model.
+
+    torch and transformers are imported only when the model is loaded.
+    """
     app = Flask(__name__)
     app.config.from_object(config_class)
+    role = role or launch_role() or app.config['APP_ROLE']
+    if role not in APP_ROLES:
+        raise ValueError(f"APP_ROLE must be one of: {', '.join(APP_ROLES)}")
+    app.config['APP_ROLE'] = role
 
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
-    CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}})
     
     # Setup logging
     setup_logging(app)
     
-    # Register blueprints
-    from app.api import bp as api_bp
-    app.register_blueprint(api_bp, url_prefix='/api')
+    # Ingestion runs in job workers (`flask jobs work`), not in web processes
+    from app.services.job_queue import jobs_cli
+    app.cli.add_command(jobs_cli)
+    from app.services.segment_index import index_cli
+    app.cli.add_command(index_cli)
     
-    from app.main import bp as main_bp
-    app.register_blueprint(main_bp)
-    
-    # Initialize scheduler
-    scheduler.init_app(app)
-    scheduler.start()
-    
-    # Schedule podcast updates
-    from app.services.podcast_service import schedule_podcast_updates
-    with app.app_context():
-        schedule_podcast_updates()
+    if role == 'api':
+        CORS(app, resources={r"/api/*": {"origins": app.config['CORS_ORIGINS']}})
+        setup_query_counter(app)
+        setup_metrics(app)
+        setup_profiler(app)
+        
+        # Register blueprints
+        from app.api import bp as api_bp
+        app.register_blueprint(api_bp, url_prefix='/api')
+        
+        from app.main import bp as main_bp
+        app.register_blueprint(main_bp)
+        
+        # Search-only processes serve stored vectors and never need the model
+        if app.config['EMBEDDING_PRELOAD'] and app.config['SEARCH_TEXT_QUERIES']:
+            preload_model(app)
+    elif role == 'worker' and app.config['EMBEDDING_PRELOAD']:
+        preload_model(app)
     
     return app
 
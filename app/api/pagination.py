@@ -0,0 +1,75 @@
+from flask import Response, current_app, request, stream_with_context
+from app import db
+import base64
+import json
+
+def encode_cursor(values):
+    """Opaque cursor token for the sort key of the last row on a page"""
+    raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(token):
+    """Sort key list from a cursor token; raises ValueError if malformed"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('invalid cursor')
+    if not isinstance(values, list):
+        raise ValueError('invalid cursor')
+    return values
+
+def page_args(parse_cursor):
+    """``(cursor, limit, stream)`` from the request's query string.
+
+    ``parse_cursor`` turns the decoded cursor values into the route's sort
+    key. Raises ValueError with a client-facing message on bad input.
+    """
+    cursor = None
+    token = request.args.get('cursor')
+    if token:
+        try:
+            cursor = parse_cursor(decode_cursor(token))
+        except (ValueError, TypeError, IndexError):
+            raise ValueError('invalid cursor')
+
+    limit = request.args.get('limit', current_app.config['API_PAGE_SIZE'])
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer')
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    limit = min(limit, current_app.config['API_MAX_PAGE_SIZE'])
+
+    return cursor, limit, request.args.get('format') == 'ndjson'
+
+def fetch_page(statements, limit):
+    """Up to ``limit`` rows from keyset-ordered statements, run in turn.
+
+    Each statement continues where the previous one ends, so a listing can
+    be split into parts (e.g. dated then undated rows). Returns the rows
+    and whether more follow.
+    """
+    rows = []
+    for statement in statements:
+        rows.extend(db.session.execute(statement.limit(limit + 1 - len(rows))).all())
+        if len(rows) > limit:
+            break
+    return rows[:limit], len(rows) > limit
+
+def ndjson_response(statements, serialize):
+    """Stream rows as newline-delimited JSON from a server-side cursor.
+
+    Rows are fetched in batches of API_STREAM_BATCH_SIZE, so memory stays
+    flat regardless of how many rows the statements return.
+    """
+    batch_size = current_app.config['API_STREAM_BATCH_SIZE']
+
+    def generate():
+        for statement in statements:
+            result = db.session.execute(statement.execution_options(yield_per=batch_size))
+            for row in result:
+                yield json.dumps(serialize(row)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
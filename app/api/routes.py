@@ -1,12 +1,24 @@
 from flask import jsonify, request, current_app
 from app import db
 from app.api import bp
-from app.models import Show, Episode, Segment, APIToken
-from app.services.embedding_service import create_embedding, find_similar_segments
-from datetime import datetime
+from app.api.pagination import encode_cursor, fetch_page, ndjson_response, page_args
+from app.models import Show, Episode, Segment
+from app.services.embedding_service import (
+    embed_queries, embed_query, find_hybrid_segments, find_similar_segments,
+    find_similar_segments_batch
+)
+from app.services.metrics import request_phase
+from app.services.segment_index import SegmentFilter, segment_index
+from app.services.token_service import token_cache, usage_recorder
+from datetime import date, datetime, timedelta
+import math
 import numpy as np
 from functools import wraps
 
+SEARCH_MODES = ('exact', 'ann', 'hybrid')
+# Returned when SEARCH_TEXT_QUERIES is off and a query has no embedding
+TEXT_QUERIES_DISABLED = 'Text queries are disabled on this server; send an embedding'
+
 def require_api_token(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -14,112 +26,371 @@ def require_api_token(f):
         if not token:
             return jsonify({'error': 'API token is required'}), 401
         
-        api_token = APIToken.query.filter_by(token=token, is_active=True).first()
-        if not api_token:
+        with request_phase('auth'):
+            token_id = token_cache.lookup(token)
+            if token_id is not None:
+                # Usage is counted in memory and written back in the background
+                usage_recorder.record(token_id)
+        if token_id is None:
             return jsonify({'error': 'Invalid or inactive API token'}), 401
         
-        # Update token usage
-        api_token.last_used = datetime.utcnow()
-        api_token.requests_count += 1
-        db.session.commit()
-        
         return f(*args, **kwargs)
     return decorated_function
 
+def search_mode(data):
+    """Search mode from a request body, or None if it is invalid"""
+    # 'exact' scans every segment; 'ann' uses the approximate IVF index;
+    # 'hybrid' mixes vector similarity with BM25 keyword scores
+    mode = data.get('mode') or ('exact' if data.get('exact', True) else 'ann')
+    return mode if mode in SEARCH_MODES else None
+
+def default_threshold(mode):
+    # Hybrid scores are a blend, so no default cut-off applies to them
+    return 0.0 if mode == 'hybrid' else 0.7
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def query_error(data, dimension=None):
+    """Validation error for a single search query, if any.
+
+    With ``dimension``, an embedding must have that many values, the length
+    of the indexed vectors.
+    """
+    if not isinstance(data, dict) or ('embedding' not in data and 'query' not in data):
+        return 'embedding or query is required'
+    if 'query' in data and (not isinstance(data['query'], str) or not data['query'].strip()):
+        return 'query must be a non-empty string'
+    if 'embedding' in data and (not isinstance(data['embedding'], list) or not data['embedding']
+                                or not all(is_number(value) for value in data['embedding'])):
+        return 'embedding must be a non-empty list of numbers'
+    if 'embedding' in data and dimension is not None and len(data['embedding']) != dimension:
+        return f"embedding must have {dimension} values"
+    if data.get('mode') == 'hybrid' and 'query' not in data:
+        return 'hybrid search requires a query'
+    return None
+
+def param_error(data):
+    """Validation error for the optional limit, threshold, nprobe and alpha fields, if any"""
+    if 'limit' in data and (not isinstance(data['limit'], int) or isinstance(data['limit'], bool)
+                            or data['limit'] < 0):
+        return 'limit must be a non-negative integer'
+    if 'threshold' in data and not is_number(data['threshold']):
+        return 'threshold must be a number'
+    # nprobe and alpha may be null to use the server default
+    nprobe = data.get('nprobe')
+    if nprobe is not None and (not isinstance(nprobe, int) or isinstance(nprobe, bool) or nprobe < 1):
+        return 'nprobe must be a positive integer'
+    alpha = data.get('alpha')
+    if alpha is not None and not (is_number(alpha) and 0 <= alpha <= 1):
+        return 'alpha must be a number between 0 and 1'
+    return None
+
+def is_date_only(value):
+    try:
+        date.fromisoformat(value)
+    except ValueError:
+        return False
+    return True
+
+def search_filters(data):
+    """``(SegmentFilter, error)`` from a request body's filter fields.
+
+    Shows and episodes are given by their Listen Notes ids, which are
+    resolved to database ids here; unknown ids simply match nothing.
+    """
+    ids = {}
+    for name, model in (('show_ids', Show), ('episode_ids', Episode)):
+        values = data.get(name)
+        if values is None:
+            continue
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            return None, f"{name} must be a list of ids"
+        ids[name] = [row_id for (row_id,) in
+                     db.session.query(model.id).filter(model.listennotes_id.in_(values))]
+    
+    dates = {}
+    for name in ('published_after', 'published_before'):
+        value = data.get(name)
+        if value is None:
+            continue
+        try:
+            dates[name] = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None, f"{name} must be an ISO 8601 date"
+        if name == 'published_before' and is_date_only(value):
+            # A bare date includes the whole day, up to its last microsecond
+            dates[name] += timedelta(days=1, microseconds=-1)
+    
+    filters = SegmentFilter(**ids, **dates)
+    return (filters if filters else None), None
+
+def segment_result(segment, similarity):
+    episode = segment.episode
+    show = episode.show
+    return {
+        'similarity': float(similarity),
+        'segment': {
+            'text': segment.text,
+            'start_time': segment.start_time,
+            'end_time': segment.end_time
+        },
+        'episode': {
+            'id': episode.listennotes_id,
+            'title': episode.title,
+            'audio_url': episode.audio_url,
+            'published_at': episode.published_at.isoformat() if episode.published_at else None
+        },
+        'show': {
+            'id': show.listennotes_id,
+            'title': show.title
+        }
+    }
+
 @bp.route('/search', methods=['POST'])
 @require_api_token
 def search():
-    """Search for similar podcast segments using an embedding"""
+    """Search for similar podcast segments using an embedding or a text query"""
     if not request.is_json:
         return jsonify({'error': 'Content-Type must be application/json'}), 400
     
     data = request.get_json()
-    if 'embedding' not in data:
-        return jsonify({'error': 'embedding is required'}), 400
+    error = query_error(data, segment_index.dimension()) or param_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    mode = search_mode(data)
+    if mode is None:
+        return jsonify({'error': f"mode must be one of: {', '.join(SEARCH_MODES)}"}), 400
+    filters, error = search_filters(data)
+    if error:
+        return jsonify({'error': error}), 400
     
     try:
-        query_embedding = np.array(data['embedding'])
-        threshold = data.get('threshold', 0.7)
+        if 'embedding' in data:
+            query_embedding = np.array(data['embedding'])
+        elif not current_app.config['SEARCH_TEXT_QUERIES']:
+            return jsonify({'error': TEXT_QUERIES_DISABLED}), 503
+        else:
+            with request_phase('embed'):
+                query_embedding = embed_query(data['query'])
+            if query_embedding is None:
+                return jsonify({'error': 'Embedding model unavailable'}), 503
+        threshold = data.get('threshold', default_threshold(mode))
         limit = data.get('limit', 5)
         
-        similar_segments = find_similar_segments(query_embedding, threshold, limit)
+        if mode == 'hybrid':
+            similar_segments = find_hybrid_segments(
+                [data['query']], [query_embedding], [threshold], [limit],
+                alpha=data.get('alpha'),
+                filters=filters
+            )[0]
+        else:
+            similar_segments = find_similar_segments(
+                query_embedding, threshold, limit,
+                exact=mode == 'exact',
+                nprobe=data.get('nprobe'),
+                filters=filters
+            )
         
-        results = []
-        for segment, similarity in similar_segments:
-            episode = segment.episode
-            show = episode.show
-            results.append({
-                'similarity': float(similarity),
-                'segment': {
-                    'text': segment.text,
-                    'start_time': segment.start_time,
-                    'end_time': segment.end_time
-                },
-                'episode': {
-                    'id': episode.listennotes_id,
-                    'title': episode.title,
-                    'audio_url': episode.audio_url,
-                    'published_at': episode.published_at.isoformat() if episode.published_at else None
-                },
-                'show': {
-                    'id': show.listennotes_id,
-                    'title': show.title
-                }
-            })
-        
-        return jsonify({'results': results})
+        with request_phase('serialization'):
+            results = [segment_result(segment, similarity) for segment, similarity in similar_segments]
+            return jsonify({'results': results})
     
     except Exception as e:
         current_app.logger.error(f"Search error: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
 
-@bp.route('/shows', methods=['GET'])
+@bp.route('/search/batch', methods=['POST'])
 @require_api_token
-def get_shows():
-    """Get all shows"""
-    shows = Show.query.all()
+def search_batch():
+    """Run many searches in one request, returning results in input order"""
+    if not request.is_json:
+        return jsonify({'error': 'Content-Type must be application/json'}), 400
+    
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({'error': 'request body must be a JSON object'}), 400
+    error = param_error(data)
+    if error:
+        return jsonify({'error': error}), 400
+    queries = data.get('queries')
+    if not isinstance(queries, list) or not queries:
+        return jsonify({'error': 'queries must be a non-empty list'}), 400
+    max_queries = current_app.config['SEARCH_BATCH_MAX_QUERIES']
+    if len(queries) > max_queries:
+        return jsonify({'error': f"at most {max_queries} queries per request"}), 400
+    mode = search_mode(data)
+    if mode is None:
+        return jsonify({'error': f"mode must be one of: {', '.join(SEARCH_MODES)}"}), 400
+    # Embeddings are stacked into one matrix, so they must all have the
+    # indexed length (or, while the index is empty, the first one's)
+    dimension = segment_index.dimension()
+    for i, item in enumerate(queries):
+        error = query_error(item, dimension) or param_error(item)
+        if not error and mode == 'hybrid' and 'query' not in item:
+            error = 'hybrid search requires a query'
+        if error:
+            return jsonify({'error': f"queries[{i}]: {error}"}), 400
+        if dimension is None and 'embedding' in item:
+            dimension = len(item['embedding'])
+    filters, error = search_filters(data)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    try:
+        # Embed all text queries in one model call
+        texts = [item['query'] for item in queries if 'embedding' not in item]
+        text_embeddings = []
+        if texts and not current_app.config['SEARCH_TEXT_QUERIES']:
+            return jsonify({'error': TEXT_QUERIES_DISABLED}), 503
+        if texts:
+            with request_phase('embed'):
+                text_embeddings = embed_queries(texts)
+        if text_embeddings is None:
+            return jsonify({'error': 'Embedding model unavailable'}), 503
+        text_embeddings = iter(text_embeddings)
+        query_embeddings = np.vstack([
+            np.asarray(item['embedding'], dtype=np.float32) if 'embedding' in item else next(text_embeddings)
+            for item in queries
+        ])
+        thresholds = [item.get('threshold', data.get('threshold', default_threshold(mode)))
+                      for item in queries]
+        limits = [item.get('limit', data.get('limit', 5)) for item in queries]
+        
+        if mode == 'hybrid':
+            matches = find_hybrid_segments(
+                [item['query'] for item in queries], query_embeddings, thresholds, limits,
+                alpha=data.get('alpha'),
+                filters=filters
+            )
+        else:
+            matches = find_similar_segments_batch(
+                query_embeddings, thresholds, limits,
+                exact=mode == 'exact',
+                nprobe=data.get('nprobe'),
+                filters=filters
+            )
+        
+        with request_phase('serialization'):
+            return jsonify({'results': [
+                {'results': [segment_result(segment, similarity) for segment, similarity in similar_segments]}
+                for similar_segments in matches
+            ]})
+    
+    except Exception as e:
+        current_app.logger.error(f"Batch search error: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def serialize_show(show):
+    return {
+        'id': show.listennotes_id,
+        'title': show.title,
+        'description': show.description,
+        'publisher': show.publisher,
+        'website': show.website,
+        'last_updated': show.last_updated.isoformat() if show.last_updated else None
+    }
+
+def serialize_episode(episode):
+    return {
+        'id': episode.listennotes_id,
+        'title': episode.title,
+        'description': episode.description,
+        'audio_url': episode.audio_url,
+        'published_at': episode.published_at.isoformat() if episode.published_at else None,
+        'duration': episode.duration,
+        'transcript_status': episode.transcript_status
+    }
+
+def serialize_segment(segment):
+    return {
+        'id': segment.id,
+        'start_time': segment.start_time,
+        'end_time': segment.end_time,
+        'text': segment.text
+    }
+
+def listing_response(key, statements, serialize, limit, stream, cursor_for):
+    """Keyset page of rows as JSON (with ``next_cursor``), or all rows as NDJSON"""
+    if stream:
+        return ndjson_response(statements, serialize)
+    rows, has_more = fetch_page(statements, limit)
     return jsonify({
-        'shows': [{
-            'id': show.listennotes_id,
-            'title': show.title,
-            'description': show.description,
-            'publisher': show.publisher,
-            'website': show.website,
-            'last_updated': show.last_updated.isoformat() if show.last_updated else None
-        } for show in shows]
+        key: [serialize(row) for row in rows],
+        'next_cursor': encode_cursor(cursor_for(rows[-1])) if has_more else None
     })
 
+@bp.route('/shows', methods=['GET'])
+@require_api_token
+def get_shows():
+    """Get all shows, paginated by id"""
+    try:
+        last_id, limit, stream = page_args(lambda values: int(values[0]))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    statement = db.select(
+        Show.id, Show.listennotes_id, Show.title, Show.description, Show.publisher,
+        Show.website, Show.last_updated
+    ).where(Show.id > (last_id or 0)).order_by(Show.id)
+    
+    return listing_response('shows', [statement], serialize_show, limit, stream,
+                            lambda show: [show.id])
+
 @bp.route('/shows/<show_id>/episodes', methods=['GET'])
 @require_api_token
 def get_show_episodes(show_id):
-    """Get episodes for a specific show"""
-    show = Show.query.filter_by(listennotes_id=show_id).first_or_404()
-    episodes = Episode.query.filter_by(show_id=show.id).all()
+    """Get episodes for a specific show, newest first"""
+    try:
+        cursor, limit, stream = page_args(lambda values: (
+            datetime.fromisoformat(values[0]) if values[0] is not None else None, int(values[1])
+        ))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'episodes': [{
-            'id': episode.listennotes_id,
-            'title': episode.title,
-            'description': episode.description,
-            'audio_url': episode.audio_url,
-            'published_at': episode.published_at.isoformat() if episode.published_at else None,
-            'duration': episode.duration,
-            'transcript_status': episode.transcript_status
-        } for episode in episodes]
-    })
+    show_pk = db.first_or_404(db.select(Show.id).filter_by(listennotes_id=show_id))
+    columns = db.select(
+        Episode.id, Episode.listennotes_id, Episode.title, Episode.description, Episode.audio_url,
+        Episode.published_at, Episode.duration, Episode.transcript_status
+    ).where(Episode.show_id == show_pk)
+    
+    # Dated episodes first, then undated ones; both walk ix_episode_show_published
+    dated = columns.where(Episode.published_at.isnot(None)) \
+        .order_by(Episode.published_at.desc(), Episode.id.desc())
+    undated = columns.where(Episode.published_at.is_(None)).order_by(Episode.id.desc())
+    if cursor is None:
+        statements = [dated, undated]
+    elif cursor[0] is None:
+        statements = [undated.where(Episode.id < cursor[1])]
+    else:
+        published, last_id = cursor
+        statements = [
+            dated.where(db.or_(
+                Episode.published_at < published,
+                db.and_(Episode.published_at == published, Episode.id < last_id)
+            )),
+            undated
+        ]
+    
+    return listing_response(
+        'episodes', statements, serialize_episode, limit, stream,
+        lambda episode: [episode.published_at.isoformat() if episode.published_at else None, episode.id]
+    )
 
 @bp.route('/episodes/<episode_id>/segments', methods=['GET'])
 @require_api_token
 def get_episode_segments(episode_id):
-    """Get segments for a specific episode"""
-    episode = Episode.query.filter_by(listennotes_id=episode_id).first_or_404()
-    segments = Segment.query.filter_by(episode_id=episode.id).all()
+    """Get segments for a specific episode, in order"""
+    try:
+        last_id, limit, stream = page_args(lambda values: int(values[0]))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify({
-        'segments': [{
-            'id': segment.id,
-            'start_time': segment.start_time,
-            'end_time': segment.end_time,
-            'text': segment.text
-        } for segment in segments]
-    })
+    episode_pk = db.first_or_404(db.select(Episode.id).filter_by(listennotes_id=episode_id))
+    statement = db.select(
+        Segment.id, Segment.start_time, Segment.end_time, Segment.text
+    ).where(Segment.episode_id == episode_pk, Segment.id > (last_id or 0)).order_by(Segment.id)
+    
+    return listing_response('segments', [statement], serialize_segment, limit, stream,
+                            lambda segment: [segment.id])
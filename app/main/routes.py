@@ -1,8 +1,11 @@
 from flask import render_template, flash, redirect, url_for, request
+from sqlalchemy.orm import joinedload
 from app import db
 from app.main import bp
-from app.models import Show, Episode, APIToken
-from app.services.podcast_service import ListenNotesAPI, update_show_episodes
+from app.models import Show, Episode, APIToken, Job
+from app.services.job_queue import PRIORITY_NEW_SHOW, enqueue_show_update, latest_jobs_by_show
+from app.services.podcast_service import ListenNotesAPI
+from app.services.token_service import token_cache, usage_recorder
 import secrets
 from datetime import datetime
 
@@ -10,8 +13,11 @@ from datetime import datetime
 def index():
     """Show dashboard with shows and API tokens"""
     shows = Show.query.all()
+    usage_recorder.flush()  # show up-to-date request counts
     tokens = APIToken.query.all()
-    return render_template('index.html', shows=shows, tokens=tokens)
+    show_jobs = latest_jobs_by_show([show.id for show in shows])
+    jobs = Job.query.options(joinedload(Job.show)).order_by(Job.id.desc()).limit(10).all()
+    return render_template('index.html', shows=shows, tokens=tokens, show_jobs=show_jobs, jobs=jobs)
 
 @bp.route('/shows/add', methods=['GET', 'POST'])
 def add_show():
@@ -45,10 +51,10 @@ def add_show():
                 db.session.add(show)
                 db.session.commit()
                 
-                # Start processing episodes
-                update_show_episodes(show)
+                # Episodes are fetched and embedded by a job worker
+                enqueue_show_update(show.id, PRIORITY_NEW_SHOW)
                 
-                flash('Show added successfully', 'success')
+                flash('Show added; its episodes are being processed in the background', 'success')
                 return redirect(url_for('main.index'))
             else:
                 flash('Could not fetch show details', 'error')
@@ -92,6 +98,7 @@ def toggle_token(token_id):
     token = APIToken.query.get_or_404(token_id)
     token.is_active = not token.is_active
     db.session.commit()
+    token_cache.invalidate(token.token)
     
     status = 'activated' if token.is_active else 'deactivated'
     flash(f'Token {status} successfully', 'success')
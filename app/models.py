@@ -1,8 +1,17 @@
 from datetime import datetime
 from app import db
 import numpy as np
+import hashlib
+import struct
 import json
 
+# Binary embedding layout: 8-byte header (magic, dtype code, dimension)
+# followed by the raw little-endian vector.
+EMBEDDING_MAGIC = b'EV'
+EMBEDDING_HEADER = struct.Struct('<2sBxI')
+EMBEDDING_DTYPES = {1: np.dtype('<f4'), 2: np.dtype('<f2')}
+EMBEDDING_DTYPE_CODES = {dtype: code for code, dtype in EMBEDDING_DTYPES.items()}
+
 class Show(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     listennotes_id = db.Column(db.String(64), unique=True, nullable=False)
@@ -27,9 +36,13 @@ class Episode(db.Model):
     published_at = db.Column(db.DateTime)
     duration = db.Column(db.Integer)  # in seconds
     transcript_status = db.Column(db.String(20), default='pending')  # pending, processing, completed, failed
+    transcript_checksum = db.Column(db.String(64))  # checksum of the last processed transcript
     last_updated = db.Column(db.DateTime, default=datetime.utcnow)
     segments = db.relationship('Segment', backref='episode', lazy='dynamic')
 
+    # Serves a show's episode listing, newest first, without sorting
+    __table_args__ = (db.Index('ix_episode_show_published', 'show_id', 'published_at', 'id'),)
+
     def __repr__(self):
         return f'<Episode {self.title}>'
 
@@ -39,23 +52,69 @@ class Segment(db.Model):
     start_time = db.Column(db.Integer)  # in seconds
     end_time = db.Column(db.Integer)    # in seconds
     text = db.Column(db.Text, nullable=False)
-    embedding = db.Column(db.Text)  # JSON string of embedding vector
+    text_hash = db.Column(db.String(64))  # sha256 of text, see text_hash()
+    embedding = db.Column(db.LargeBinary)  # see encode_embedding()
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (db.Index('ix_segment_episode', 'episode_id', 'id'),)
+
     def set_embedding(self, embedding_array):
-        """Store numpy array as JSON string"""
+        """Store numpy array as float32 bytes"""
         if embedding_array is not None:
-            self.embedding = json.dumps(embedding_array.tolist())
+            self.embedding = encode_embedding(embedding_array)
 
     def get_embedding(self):
-        """Retrieve embedding as numpy array"""
-        if self.embedding:
-            return np.array(json.loads(self.embedding))
-        return None
+        """Retrieve embedding as a read-only numpy view of the stored bytes"""
+        return decode_embedding(self.embedding)
 
     def __repr__(self):
         return f'<Segment {self.id} ({self.start_time}s - {self.end_time}s)>'
 
+def text_hash(text):
+    """Hex sha256 of a segment's text, used to match segments across runs"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def encode_embedding(embedding_array, dtype=np.float32):
+    """Pack an embedding vector into the binary column format"""
+    vector = np.ascontiguousarray(embedding_array, dtype=np.dtype(dtype).newbyteorder('<')).ravel()
+    header = EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_DTYPE_CODES[vector.dtype], vector.shape[0])
+    return header + vector.tobytes()
+
+def decode_embedding(value):
+    """Decode a stored embedding column value into a numpy array"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        # Legacy JSON text from before the binary format
+        return np.array(json.loads(value), dtype=np.float32)
+    magic, dtype_code, dimension = EMBEDDING_HEADER.unpack_from(value)
+    if magic != EMBEDDING_MAGIC or dtype_code not in EMBEDDING_DTYPES:
+        raise ValueError('Unrecognized embedding format')
+    return np.frombuffer(value, dtype=EMBEDDING_DTYPES[dtype_code],
+                         count=dimension, offset=EMBEDDING_HEADER.size)
+
+class SegmentIndexState(db.Model):
+    """Single row that processes without index snapshots poll for changes.
+
+    Every segment write updates it before inserting (which also orders
+    concurrent writers' new ids by commit), and ``changes`` goes up whenever
+    indexed segments are deleted or their episode's show or publish time
+    changes, which appending new ids can't pick up.
+    """
+    __tablename__ = 'segment_index_state'
+    id = db.Column(db.Integer, primary_key=True)
+    changes = db.Column(db.Integer, nullable=False, default=0)
+
+def record_index_change(changed=True):
+    """Count a change (or with ``changed=False`` only lock the row) in the current transaction"""
+    updated = db.session.execute(
+        db.update(SegmentIndexState).where(SegmentIndexState.id == 1)
+        .values(changes=SegmentIndexState.changes + (1 if changed else 0))
+    ).rowcount
+    if not updated:
+        db.session.add(SegmentIndexState(id=1, changes=1 if changed else 0))
+        db.session.flush()
+
 class APIToken(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     token = db.Column(db.String(64), unique=True, nullable=False)
@@ -67,3 +126,32 @@ class APIToken(db.Model):
 
     def __repr__(self):
         return f'<APIToken {self.name}>'
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)  # update_show
+    show_id = db.Column(db.Integer, db.ForeignKey('show.id'))
+    priority = db.Column(db.Integer, nullable=False, default=0)  # higher runs first
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(100))  # host:pid of the worker that last claimed it
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # refreshed by the worker while the job runs
+    finished_at = db.Column(db.DateTime)
+    run_after = db.Column(db.DateTime)  # a retried job is not claimed before this
+    show = db.relationship('Show')
+
+    # Claiming takes the best queued job; deduplication looks up a show's pending
+    # jobs, and the partial unique index keeps concurrent enqueues from adding two
+    __table_args__ = (
+        db.Index('ix_job_queue', 'status', 'priority', 'id'),
+        db.Index('ix_job_show', 'show_id', 'status'),
+        db.Index('ix_job_pending_show', 'show_id', unique=True,
+                 postgresql_where=db.text("status IN ('queued', 'running')"),
+                 sqlite_where=db.text("status IN ('queued', 'running')")),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} ({self.status})>'
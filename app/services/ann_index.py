@@ -0,0 +1,191 @@
+import os
+import threading
+import uuid
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Rows appended since the cell order was last sorted are checked directly
+# until there are more than this many (or an eighth of the rows)
+TAIL_REBUILD_MIN = 4096
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index for cosine search.
+
+    Vectors (already L2-normalized) are bucketed by their nearest centroid
+    from a spherical k-means over a training sample. A query only scores the
+    ``nprobe`` buckets whose centroids are closest to it, trading recall for
+    latency: raising ``nprobe`` towards ``nlist`` approaches exact search.
+
+    The index holds no vectors. It records the cell of each row of the
+    caller's matrix (``ids`` and ``cells`` line up with its rows) and returns
+    the row positions in the probed cells, which the caller scores against
+    its own, possibly quantized or memory-mapped, matrix.
+    """
+
+    def __init__(self, centroids):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.trained_size = 0
+        self.version = uuid.uuid4().hex  # identifies the training, not the row assignments
+        self.database = None  # fingerprint of the database the vectors came from
+        self.ids = np.empty(0, dtype=np.int64)
+        self.cells = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self._order = np.empty(0, dtype=np.int64)
+        self._offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        self._sorted = 0
+        self._lock = threading.RLock()
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return self._size
+
+    @classmethod
+    def train(cls, vectors, nlist, iterations=10, points_per_cell=40, seed=0):
+        """Fit centroids with spherical k-means on a sample of ``vectors``.
+
+        The sample has ``points_per_cell`` vectors per cell, so it grows with
+        ``nlist`` instead of thinning out on large corpora.
+        """
+        rng = np.random.default_rng(seed)
+        nlist = max(1, min(nlist, len(vectors)))
+        sample_size = nlist * points_per_cell
+        if len(vectors) > sample_size:
+            sample = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        else:
+            sample = vectors
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _nearest(sample, centroids)
+            order = np.argsort(assignments, kind='stable')
+            cells, starts = np.unique(assignments[order], return_index=True)
+            sums = np.zeros_like(centroids)
+            sums[cells] = np.add.reduceat(sample[order], starts, axis=0)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty cells from random sample points
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        index = cls(centroids)
+        index.trained_size = len(vectors)
+        return index
+
+    def assign(self, vectors):
+        """Cell of each of ``vectors``"""
+        return _nearest(np.asarray(vectors, dtype=np.float32), self.centroids).astype(np.int32)
+
+    def bind(self, ids, cells):
+        """Replace the rows: row ``i`` is segment ``ids[i]`` in cell ``cells[i]``"""
+        with self._lock:
+            self.ids = np.array(ids, dtype=np.int64)
+            self.cells = np.array(cells, dtype=np.int32)
+            self._size = len(self.ids)
+            self._sort()
+
+    def append(self, ids, cells):
+        """Add rows after the existing ones"""
+        if not len(ids):
+            return
+        with self._lock:
+            needed = self._size + len(ids)
+            if needed > len(self.ids):
+                capacity = max(needed, 2 * len(self.ids), 1024)
+                self.ids = _grow(self.ids, self._size, capacity)
+                self.cells = _grow(self.cells, self._size, capacity)
+            self.ids[self._size:needed] = ids
+            self.cells[self._size:needed] = cells
+            self._size = needed
+            if needed - self._sorted > max(TAIL_REBUILD_MIN, needed // 8):
+                self._sort()
+
+    def keep(self, mask):
+        """Drop the rows where ``mask`` is False, as the caller's matrix did"""
+        with self._lock:
+            self.bind(self.ids[:self._size][mask], self.cells[:self._size][mask])
+
+    def cells_of(self, ids):
+        """Recorded cell of each segment in ``ids``, -1 for unknown ones"""
+        with self._lock:
+            known, cells = self.ids[:self._size], self.cells[:self._size]
+        found = np.full(len(ids), -1, dtype=np.int32)
+        if not len(known) or not len(ids):
+            return found
+        order = np.argsort(known, kind='stable')
+        positions = np.searchsorted(known, ids, sorter=order)
+        positions = np.minimum(positions, len(known) - 1)
+        matched = known[order[positions]] == ids
+        found[matched] = cells[order[positions[matched]]]
+        return found
+
+    def candidates(self, query, nprobe):
+        """Row positions in the ``nprobe`` cells closest to ``query``"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        probed = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        with self._lock:
+            order, offsets, sorted_size = self._order, self._offsets, self._sorted
+            tail = self.cells[sorted_size:self._size]
+        parts = [order[offsets[cell]:offsets[cell + 1]] for cell in probed]
+        parts.append(np.flatnonzero(np.isin(tail, probed)) + sorted_size)
+        return np.concatenate(parts)
+
+    def save(self, path):
+        """Write the index to ``path`` atomically.
+
+        The temporary file is named per process, so processes saving the
+        same path at once never write into each other's file.
+        """
+        with self._lock:
+            ids, cells = self.ids[:self._size], self.cells[:self._size]
+            temp_path = f"{path}.{os.getpid()}.tmp"
+            with open(temp_path, 'wb') as f:
+                np.savez(f, centroids=self.centroids, ids=ids, cells=cells,
+                         trained_size=np.array(self.trained_size), version=np.array(self.version),
+                         database=np.array(self.database or ''))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            index = cls(data['centroids'])
+            index.trained_size = int(data['trained_size'])
+            index.version = str(data['version'])
+            index.database = str(data['database']) or None
+            index.bind(data['ids'], data['cells'])
+        return index
+
+    def _sort(self):
+        """Order the rows by cell so each cell's rows are one slice"""
+        cells = self.cells[:self._size]
+        self._order = np.argsort(cells, kind='stable')
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(cells, minlength=self.nlist))])
+        self._sorted = self._size
+
+def saved_version(path):
+    """Training version of the index saved at ``path``, without loading it"""
+    with np.load(path) as data:
+        return str(data['version']) if 'version' in data.files else None
+
+def default_nlist(size):
+    """Rule-of-thumb cell count: about 4 * sqrt(N)"""
+    return max(1, int(4 * np.sqrt(size)))
+
+def _grow(column, size, capacity):
+    grown = np.zeros(capacity, dtype=column.dtype)
+    grown[:size] = column[:size]
+    return grown
+
+def _nearest(vectors, centroids, chunk_size=16384):
+    """Index of the most similar centroid for each row, in bounded-memory chunks"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        block = vectors[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
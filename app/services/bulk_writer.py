@@ -0,0 +1,97 @@
+from datetime import datetime
+import io
+from flask import current_app
+from app import db
+from app.models import Segment, encode_embedding
+
+# Columns written for each new segment; ids come from the database
+SEGMENT_COLUMNS = ('episode_id', 'start_time', 'end_time', 'text', 'text_hash', 'embedding', 'created_at')
+
+def insert_segments(rows, chunk_size=None):
+    """Insert new segments in chunks and return their ids, in input order.
+
+    ``rows`` yields dicts of the SEGMENT_COLUMNS (``created_at`` optional)
+    with ``embedding`` as a vector. Each chunk of INGESTION_WRITE_CHUNK rows
+    is encoded, written with a single executemany INSERT ... RETURNING (or
+    COPY on PostgreSQL with INGESTION_USE_COPY) and released before the
+    next one, so memory doesn't grow with the number of segments. Runs in
+    the session's transaction.
+    """
+    config = current_app.config
+    chunk_size = chunk_size or config['INGESTION_WRITE_CHUNK']
+    write = _copy_chunk if config['INGESTION_USE_COPY'] and supports_copy() else _insert_chunk
+
+    ids = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            ids.extend(write(_encode(chunk)))
+            chunk = []
+    if chunk:
+        ids.extend(write(_encode(chunk)))
+    return ids
+
+def supports_copy():
+    """Whether the session's database accepts COPY through psycopg2"""
+    bind = db.session.get_bind()
+    return bind.dialect.name == 'postgresql' and bind.dialect.driver == 'psycopg2'
+
+def _encode(chunk):
+    now = datetime.utcnow()
+    return [
+        {
+            'episode_id': row['episode_id'],
+            'start_time': row.get('start_time'),
+            'end_time': row.get('end_time'),
+            'text': row['text'],
+            'text_hash': row.get('text_hash'),
+            'embedding': encode_embedding(row['embedding']) if row.get('embedding') is not None else None,
+            'created_at': row.get('created_at') or now,
+        }
+        for row in chunk
+    ]
+
+def _insert_chunk(rows):
+    """One executemany INSERT, with ids returned in parameter order"""
+    table = Segment.__table__
+    result = db.session.execute(
+        table.insert().returning(table.c.id, sort_by_parameter_order=True),
+        rows
+    )
+    return result.scalars().all()
+
+def _copy_chunk(rows):
+    """COPY rows into the segment table using ids reserved from its sequence.
+
+    COPY can't return generated keys, so the ids are drawn up front with
+    one nextval() query and written explicitly.
+    """
+    ids = db.session.execute(
+        db.text("SELECT nextval(pg_get_serial_sequence('segment', 'id')) FROM generate_series(1, :count)"),
+        {'count': len(rows)}
+    ).scalars().all()
+
+    buffer = io.StringIO()
+    for segment_id, row in zip(ids, rows):
+        fields = [str(segment_id)] + [_copy_field(row[column]) for column in SEGMENT_COLUMNS]
+        buffer.write('\t'.join(fields))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    cursor = db.session.connection().connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY segment (id, {', '.join(SEGMENT_COLUMNS)}) FROM STDIN", buffer)
+    finally:
+        cursor.close()
+    return ids
+
+def _copy_field(value):
+    """A value in COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bytes):
+        return '\\\\x' + value.hex()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
@@ -0,0 +1,125 @@
+import inspect
+import os
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Selectable with EMBEDDING_BACKEND
+EMBEDDING_BACKENDS = ('torch', 'torch-int8', 'onnx')
+
+class TorchBackend:
+    """Eager PyTorch model; with ``quantize`` its linear layers run in int8.
+
+    Dynamic quantization converts the weights once at load time and
+    quantizes activations on the fly, so it needs no calibration data. It
+    only runs on CPU.
+    """
+
+    def __init__(self, model_name, quantize=False):
+        import torch
+        from transformers import AutoModel
+
+        model = AutoModel.from_pretrained(model_name)
+        if quantize:
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            self.device = 'cpu'
+        else:
+            self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.model = model.to(self.device)
+        self.model.eval()
+        self.hidden_size = model.config.hidden_size
+
+    def embed(self, inputs):
+        """Mean-pooled embeddings for a padded batch of numpy token arrays"""
+        import torch
+
+        tensors = {key: torch.from_numpy(values).to(self.device) for key, values in inputs.items()}
+        with torch.no_grad():
+            outputs = self.model(**tensors)
+            pooled = mean_pool(outputs.last_hidden_state, tensors['attention_mask'])
+        return pooled.cpu().numpy()
+
+class OnnxBackend:
+    """ONNX Runtime session over an export of the model.
+
+    The model is exported to ``path`` on first use if the file is missing.
+    """
+
+    def __init__(self, model_name, path, intra_op_threads=0, inter_op_threads=0):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise RuntimeError("EMBEDDING_BACKEND 'onnx' requires the onnxruntime package")
+
+        if not os.path.exists(path):
+            export_onnx(model_name, path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        if inter_op_threads:
+            options.inter_op_num_threads = inter_op_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = [model_input.name for model_input in self.session.get_inputs()]
+        self.hidden_size = self.session.get_outputs()[0].shape[-1]
+
+    def embed(self, inputs):
+        """Mean-pooled embeddings for a padded batch of numpy token arrays"""
+        feed = {name: inputs[name].astype(np.int64) for name in self.input_names}
+        hidden = self.session.run(['last_hidden_state'], feed)[0]
+        mask = inputs['attention_mask'][..., None].astype(hidden.dtype)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+
+def create_backend(name, model_name, onnx_path=None, intra_op_threads=0, inter_op_threads=0):
+    """Load the named inference backend"""
+    if name not in EMBEDDING_BACKENDS:
+        raise ValueError(f"EMBEDDING_BACKEND must be one of: {', '.join(EMBEDDING_BACKENDS)}")
+    if name == 'onnx':
+        return OnnxBackend(model_name, onnx_path, intra_op_threads, inter_op_threads)
+    set_torch_threads(intra_op_threads, inter_op_threads)
+    return TorchBackend(model_name, quantize=name == 'torch-int8')
+
+def set_torch_threads(intra_op_threads=0, inter_op_threads=0):
+    """Apply thread counts to torch (0 keeps its default)"""
+    import torch
+
+    if intra_op_threads:
+        torch.set_num_threads(intra_op_threads)
+    if inter_op_threads:
+        try:
+            torch.set_num_interop_threads(inter_op_threads)
+        except RuntimeError as e:
+            # Only allowed before torch has started any parallel work
+            logger.warning(f"Could not set torch inter-op threads: {str(e)}")
+
+def export_onnx(model_name, path):
+    """Export the model to ONNX with dynamic batch and sequence axes"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    model = AutoModel.from_pretrained(model_name)
+    model.eval()
+    sample = AutoTokenizer.from_pretrained(model_name)(['export sample'], return_tensors='pt')
+    # Positional order of the encoder's forward() arguments
+    names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    axes = {name: {0: 'batch', 1: 'sequence'} for name in names + ['last_hidden_state']}
+
+    # dynamic_axes belongs to the TorchScript exporter; newer torch defaults
+    # to the dynamo one, which needs the separate onnxscript package
+    options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with torch.no_grad():
+        torch.onnx.export(model, tuple(sample[name] for name in names), temp_path, input_names=names,
+                          output_names=['last_hidden_state'], dynamic_axes=axes, opset_version=14,
+                          **options)
+    os.replace(temp_path, path)
+    logger.info(f"Exported {model_name} to ONNX at {path}")
+
+def mean_pool(last_hidden_state, attention_mask):
+    """Average token embeddings, ignoring padding positions"""
+    mask = attention_mask.unsqueeze(-1).to(last_hidden_state.dtype)
+    summed = (last_hidden_state * mask).sum(dim=1)
+    counts = mask.sum(dim=1).clamp(min=1e-9)
+    return summed / counts
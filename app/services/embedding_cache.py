@@ -0,0 +1,183 @@
+from collections import OrderedDict
+import hashlib
+import sqlite3
+import threading
+import time
+from app.models import encode_embedding, decode_embedding
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Eviction trims the disk tier to this fraction of its limit, so it runs
+# once per many inserts rather than on every one
+EVICTION_LOW_WATER = 0.9
+
+class LRUCache:
+    """Thread-safe least-recently-used mapping with a fixed number of entries"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class EmbeddingCache:
+    """Content-addressed embedding cache.
+
+    Entries are keyed by a hash of the model name and the whitespace-normalized
+    text. Lookups go through an in-memory LRU first and then an optional
+    SQLite file on local disk, which survives restarts and is shared by every
+    process on the node. With ``max_rows`` the file is kept to about that
+    many entries by deleting the least recently used ones.
+    """
+
+    def __init__(self, memory_size, path=None, max_rows=0):
+        self.memory = LRUCache(memory_size)
+        self.path = path
+        self.max_rows = max_rows
+        self._conn = None
+        self._disk_rows = 0
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.model_seconds = 0.0
+        self.model_texts = 0
+        if path:
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS embedding_cache '
+                '(key BLOB PRIMARY KEY, embedding BLOB NOT NULL, accessed REAL NOT NULL DEFAULT 0) '
+                'WITHOUT ROWID'
+            )
+            columns = [row[1] for row in self._conn.execute('PRAGMA table_info(embedding_cache)')]
+            if 'accessed' not in columns:
+                # Files written before eviction existed; their rows go first
+                self._conn.execute('ALTER TABLE embedding_cache ADD COLUMN accessed REAL NOT NULL DEFAULT 0')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS ix_embedding_cache_accessed '
+                               'ON embedding_cache (accessed)')
+            self._conn.commit()
+            self._disk_rows = self._conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+
+    @staticmethod
+    def key(model_name, text):
+        normalized = ' '.join(text.split())
+        return hashlib.sha256(f"{model_name}\0{normalized}".encode('utf-8')).digest()
+
+    def get_many(self, keys):
+        """Return cached vectors aligned with ``keys`` (None where missing)"""
+        results = [self.memory.get(key) for key in keys]
+        memory_hits = sum(result is not None for result in results)
+
+        missing = [i for i, result in enumerate(results) if result is None]
+        disk_hits = 0
+        if missing and self._conn is not None:
+            found = self._disk_get([keys[i] for i in missing])
+            for i in missing:
+                embedding = found.get(keys[i])
+                if embedding is not None:
+                    results[i] = embedding
+                    self.memory.put(keys[i], embedding)
+                    disk_hits += 1
+
+        with self._stats_lock:
+            self.memory_hits += memory_hits
+            self.disk_hits += disk_hits
+            self.misses += len(keys) - memory_hits - disk_hits
+        return results
+
+    def put_many(self, keys, embeddings):
+        for key, embedding in zip(keys, embeddings):
+            self.memory.put(key, embedding)
+        if self._conn is not None:
+            now = time.time()
+            rows = [(key, encode_embedding(embedding), now) for key, embedding in zip(keys, embeddings)]
+            with self._lock:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO embedding_cache (key, embedding, accessed) VALUES (?, ?, ?)', rows
+                )
+                self._disk_rows += len(rows)
+                if self.max_rows and self._disk_rows > self.max_rows:
+                    self._evict()
+                self._conn.commit()
+
+    def record_model_time(self, seconds, count):
+        """Track model time so hits can be reported as model time saved"""
+        with self._stats_lock:
+            self.model_seconds += seconds
+            self.model_texts += count
+
+    def stats(self):
+        with self._stats_lock:
+            hits = self.memory_hits + self.disk_hits
+            lookups = hits + self.misses
+            per_text = self.model_seconds / self.model_texts if self.model_texts else 0.0
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'model_seconds_saved': hits * per_text
+            }
+
+    def _disk_get(self, keys):
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._conn.execute(
+                    f'SELECT key, embedding FROM embedding_cache WHERE key IN ({placeholders})', chunk
+                )
+                for key, raw in rows:
+                    found[key] = decode_embedding(raw)
+            if found:
+                # Record the access so eviction keeps recently used entries
+                self._conn.executemany('UPDATE embedding_cache SET accessed = ? WHERE key = ?',
+                                       [(time.time(), key) for key in found])
+                self._conn.commit()
+        return found
+
+    def _evict(self):
+        """Delete least recently used rows down to EVICTION_LOW_WATER of ``max_rows``.
+
+        The row count is tracked in memory and only recounted here, since
+        other processes write to the same file. Called with the lock held.
+        """
+        self._disk_rows = self._conn.execute('SELECT COUNT(*) FROM embedding_cache').fetchone()[0]
+        excess = self._disk_rows - int(self.max_rows * EVICTION_LOW_WATER)
+        if self._disk_rows <= self.max_rows or excess <= 0:
+            return
+        deleted = self._conn.execute(
+            'DELETE FROM embedding_cache WHERE key IN '
+            '(SELECT key FROM embedding_cache ORDER BY accessed LIMIT ?)', (excess,)
+        ).rowcount
+        self._disk_rows -= deleted
+        with self._stats_lock:
+            self.evictions += deleted
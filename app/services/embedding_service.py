@@ -1,54 +1,223 @@
-from transformers import AutoTokenizer, AutoModel
-import torch
 import numpy as np
 from flask import current_app
+from app.services.embedding_backends import create_backend
+from app.services.embedding_cache import EmbeddingCache, LRUCache
+from app.services.metrics import embedding_batch_seconds, embedding_texts, request_phase
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Global variables for model and tokenizer
-model = None
+# Global variables for the inference backend, tokenizer and embedding caches
+backend = None
 tokenizer = None
+cache = None
+query_cache = None
+
+def load_tokenizer():
+    """Load the embedding tokenizer (without the model)"""
+    global tokenizer
+    if tokenizer is None:
+        from transformers import AutoTokenizer
+
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(current_app.config['EMBEDDING_MODEL'])
+        except Exception as e:
+            logger.error(f"Error loading tokenizer: {str(e)}")
+            raise
+    return tokenizer
 
 def load_model():
-    """Load the embedding model and tokenizer"""
-    global model, tokenizer
-    if model is None or tokenizer is None:
-        model_name = current_app.config['EMBEDDING_MODEL']
+    """Load the tokenizer and the EMBEDDING_BACKEND running the model"""
+    global backend
+    load_tokenizer()
+    if backend is None:
+        config = current_app.config
         try:
-            tokenizer = AutoTokenizer.from_pretrained(model_name)
-            model = AutoModel.from_pretrained(model_name)
-            if torch.cuda.is_available():
-                model = model.cuda()
-            model.eval()
+            backend = create_backend(
+                config['EMBEDDING_BACKEND'],
+                config['EMBEDDING_MODEL'],
+                onnx_path=config['EMBEDDING_ONNX_PATH'],
+                intra_op_threads=config['EMBEDDING_INTRA_OP_THREADS'],
+                inter_op_threads=config['EMBEDDING_INTER_OP_THREADS']
+            )
         except Exception as e:
             logger.error(f"Error loading model: {str(e)}")
             raise
+    return backend
+
+def embedding_model_id():
+    """Model identity for embedding cache keys.
+
+    Backends other than the reference torch one produce slightly different
+    vectors, so their embeddings are cached separately.
+    """
+    config = current_app.config
+    if config['EMBEDDING_BACKEND'] == 'torch':
+        return config['EMBEDDING_MODEL']
+    return f"{config['EMBEDDING_MODEL']}@{config['EMBEDDING_BACKEND']}"
+
+def get_embedding_cache():
+    """Return the process-wide embedding cache"""
+    global cache
+    if cache is None:
+        cache = EmbeddingCache(
+            current_app.config['EMBEDDING_CACHE_SIZE'],
+            current_app.config['EMBEDDING_CACHE_PATH'],
+            current_app.config['EMBEDDING_CACHE_MAX_ROWS']
+        )
+    return cache
+
+def warm_up():
+    """Load the model and run a few forward passes so the first request is fast"""
+    load_model()
+    for batch in (['warm up'], ['warm up the embedding model'] * 4):
+        run_model(batch)
+    logger.info(f"Embedding model {current_app.config['EMBEDDING_MODEL']} loaded and warmed up "
+                f"({current_app.config['EMBEDDING_BACKEND']} backend)")
+
+def embed_query(text):
+    """Embed a search query, serving repeated queries from an LRU cache"""
+    embeddings = embed_queries([text])
+    if embeddings is None:
+        return None
+    return embeddings[0]
+
+def embed_queries(texts):
+    """Embed search queries, running the model only for uncached ones.
+
+    Queries bypass the segment embedding cache so they don't crowd it out.
+    Returns an array with one row per query, or None if the model fails.
+    """
+    global query_cache
+    if query_cache is None:
+        query_cache = LRUCache(current_app.config['QUERY_CACHE_SIZE'])
+    
+    model_id = embedding_model_id()
+    keys = [EmbeddingCache.key(model_id, text) for text in texts]
+    embeddings = [query_cache.get(key) for key in keys]
+    
+    missing = {}
+    for key, text, embedding in zip(keys, texts, embeddings):
+        if embedding is None and key not in missing:
+            missing[key] = text
+    if missing:
+        try:
+            vectors = run_model(list(missing.values()))
+        except Exception as e:
+            logger.error(f"Error creating query embedding: {str(e)}")
+            return None
+        computed = dict(zip(missing, vectors))
+        for key, vector in computed.items():
+            query_cache.put(key, vector)
+        embeddings = [computed[key] if embedding is None else embedding
+                      for key, embedding in zip(keys, embeddings)]
+    
+    return np.array(embeddings, dtype=np.float32)
 
 def create_embedding(text):
     """Create embedding for a text segment"""
+    embeddings = create_embeddings([text])
+    if embeddings is None:
+        return None
+    return embeddings[0]
+
+def create_embeddings(texts, batch_size=None, token_ids=None):
+    """Create embeddings for many text segments, reusing cached vectors.
+
+    Only texts missing from the embedding cache reach the model, each
+    distinct text once. ``token_ids`` may carry each text's tokens (without
+    special tokens) from segmentation so they are not tokenized again.
+    Returns an array with one row per input text, in input order.
+    """
     try:
-        load_model()
+        texts = list(texts)
+        tokens = list(token_ids) if token_ids is not None else [None] * len(texts)
+        embedding_cache = get_embedding_cache()
+        model_id = embedding_model_id()
+        keys = [EmbeddingCache.key(model_id, text) for text in texts]
+        cached = embedding_cache.get_many(keys)
+        
+        # Distinct cache misses, each computed once
+        missing = {}
+        for key, text, ids, embedding in zip(keys, texts, tokens, cached):
+            if embedding is None and key not in missing:
+                missing[key] = (text, ids)
+        
+        computed = {}
+        if missing:
+            # Wall time: process CPU time would include other threads (e.g.
+            # the fetch pool), and the model's own threads aren't this one's
+            start = time.perf_counter()
+            vectors = run_model([text for text, _ in missing.values()], batch_size,
+                                [ids for _, ids in missing.values()])
+            embedding_cache.record_model_time(time.perf_counter() - start, len(missing))
+            computed = dict(zip(missing, vectors))
+            embedding_cache.put_many(list(computed), vectors)
         
-        # Tokenize and prepare input
-        inputs = tokenizer(text, padding=True, truncation=True, return_tensors="pt", max_length=512)
-        if torch.cuda.is_available():
-            inputs = {k: v.cuda() for k, v in inputs.items()}
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
         
-        # Generate embeddings
-        with torch.no_grad():
-            outputs = model(**inputs)
-            embeddings = outputs.last_hidden_state.mean(dim=1)
+        first = cached[0] if cached[0] is not None else computed[keys[0]]
+        embeddings = np.empty((len(texts), len(first)), dtype=np.float32)
+        for i, (key, embedding) in enumerate(zip(keys, cached)):
+            embeddings[i] = embedding if embedding is not None else computed[key]
         
-        # Convert to numpy and return
-        if torch.cuda.is_available():
-            embeddings = embeddings.cpu()
-        return embeddings.numpy()[0]
+        logger.debug(f"Embedded {len(texts)} texts, {len(texts) - len(missing)} from cache; "
+                     f"cache stats: {embedding_cache.stats()}")
+        return embeddings
     
     except Exception as e:
-        logger.error(f"Error creating embedding: {str(e)}")
+        logger.error(f"Error creating embeddings: {str(e)}")
         return None
 
+def run_model(texts, batch_size=None, token_ids=None):
+    """Run the model over texts in batched forward passes.
+
+    Texts are tokenized once (or taken from ``token_ids``), sorted by token
+    count so each batch is padded only to its own longest member, and
+    mean-pooled over the attention mask.
+    """
+    load_model()
+    batch_size = batch_size or current_app.config['EMBEDDING_BATCH_SIZE']
+    
+    encoded = encode_texts(texts, token_ids)
+    order = sorted(range(len(texts)), key=lambda i: len(encoded['input_ids'][i]))
+    embeddings = np.zeros((len(texts), backend.hidden_size), dtype=np.float32)
+    backend_name = current_app.config['EMBEDDING_BACKEND']
+    
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        
+        # Pad to the longest sequence in this batch only
+        inputs = tokenizer.pad(
+            {key: [values[i] for i in batch] for key, values in encoded.items()},
+            return_tensors="np"
+        )
+        with embedding_batch_seconds.time(backend=backend_name):
+            embeddings[batch] = backend.embed(dict(inputs))
+        embedding_texts.inc(len(batch), backend=backend_name)
+    
+    return embeddings
+
+def encode_texts(texts, token_ids=None):
+    """Tokenize texts, reusing pre-computed token ids where given"""
+    if token_ids is None or all(ids is None for ids in token_ids):
+        return tokenizer(texts, truncation=True, max_length=512)
+    
+    encoded = {'input_ids': [], 'attention_mask': [], 'token_type_ids': []}
+    for text, ids in zip(texts, token_ids):
+        if ids is None:
+            ids = tokenizer(text, add_special_tokens=False, truncation=True,
+                            max_length=512 - tokenizer.num_special_tokens_to_add())['input_ids']
+        input_ids = tokenizer.build_inputs_with_special_tokens(list(ids))
+        encoded['input_ids'].append(input_ids)
+        encoded['attention_mask'].append([1] * len(input_ids))
+        encoded['token_type_ids'].append(tokenizer.create_token_type_ids_from_sequences(list(ids)))
+    if 'token_type_ids' not in tokenizer.model_input_names:
+        del encoded['token_type_ids']
+    return encoded
+
 def compute_similarity(embedding1, embedding2):
     """Compute cosine similarity between two embeddings"""
     if embedding1 is None or embedding2 is None:
@@ -62,20 +231,89 @@ def compute_similarity(embedding1, embedding2):
     
     return np.dot(embedding1, embedding2) / (norm1 * norm2)
 
-def find_similar_segments(query_embedding, threshold=0.7, limit=5):
-    """Find segments similar to the query embedding"""
-    from app.models import Segment
+def find_similar_segments(query_embedding, threshold=0.7, limit=5, exact=True, nprobe=None,
+                          filters=None):
+    """Find segments similar to the query embedding.
+
+    With ``exact=False`` the approximate IVF index is used, scanning
+    ``nprobe`` cells (ANN_NPROBE by default). An optional SegmentFilter
+    restricts the search to some shows, episodes or publish dates.
+    """
+    from app.services.segment_index import segment_index
+    
+    with request_phase('scoring'):
+        if exact:
+            matches = segment_index.search(query_embedding, threshold, limit, filters)
+        else:
+            matches = segment_index.search_approximate(query_embedding, threshold, limit, nprobe, filters)
+    return load_matches([matches])[0]
+
+def find_similar_segments_batch(query_embeddings, thresholds, limits, exact=True, nprobe=None,
+                                filters=None):
+    """Find similar segments for many queries, returning one list per query.
+
+    Exact searches score every query in one pass over the corpus, and the
+    matched segments for all queries are fetched with a single query.
+    """
+    from app.services.segment_index import segment_index
     
-    similar_segments = []
-    segments = Segment.query.all()
+    with request_phase('scoring'):
+        if exact:
+            matches = segment_index.search_batch(query_embeddings, thresholds, limits, filters)
+        else:
+            matches = [
+                segment_index.search_approximate(query_embedding, threshold, limit, nprobe, filters)
+                for query_embedding, threshold, limit in zip(query_embeddings, thresholds, limits)
+            ]
+    return load_matches(matches)
+
+def find_hybrid_segments(query_texts, query_embeddings, thresholds, limits, alpha=None, filters=None):
+    """Hybrid keyword + vector search for each query text and its embedding.
+
+    ``alpha`` weighs vector similarity against BM25 (HYBRID_ALPHA by
+    default). Returns one ``(Segment, score)`` list per query.
+    """
+    from app.services.lexical_index import hybrid_search
+    
+    with request_phase('scoring'):
+        matches = [
+            hybrid_search(query_text, query_embedding, threshold, limit, alpha, filters)
+            for query_text, query_embedding, threshold, limit
+            in zip(query_texts, query_embeddings, thresholds, limits)
+        ]
+    return load_matches(matches)
+
+def load_matches(matches):
+    """Turn ``(segment_ids, similarities)`` pairs into ``(Segment, similarity)`` lists.
+
+    Segments are loaded in one query together with their episode and show,
+    leaving out embeddings and descriptions, so serializing the results
+    issues no further queries.
+    """
+    from sqlalchemy.orm import joinedload, load_only
+    from app.models import Episode, Segment, Show
     
-    for segment in segments:
-        segment_embedding = segment.get_embedding()
-        if segment_embedding is not None:
-            similarity = compute_similarity(query_embedding, segment_embedding)
-            if similarity >= threshold:
-                similar_segments.append((segment, similarity))
+    wanted = set()
+    for segment_ids, _ in matches:
+        wanted.update(segment_ids.tolist())
+    segments_by_id = {}
+    if wanted:
+        with request_phase('fetch'):
+            segments = Segment.query.options(
+                load_only(Segment.id, Segment.episode_id, Segment.text, Segment.start_time, Segment.end_time),
+                joinedload(Segment.episode).load_only(
+                    Episode.id, Episode.show_id, Episode.listennotes_id, Episode.title,
+                    Episode.audio_url, Episode.published_at
+                ).joinedload(Episode.show).load_only(Show.id, Show.listennotes_id, Show.title)
+            ).filter(Segment.id.in_(wanted)).all()
+        segments_by_id = {segment.id: segment for segment in segments}
     
-    # Sort by similarity and return top matches
-    similar_segments.sort(key=lambda x: x[1], reverse=True)
-    return similar_segments[:limit]
+    # Keep ranking order; skip rows deleted since the index was built
+    return [
+        [
+            (segments_by_id[segment_id], similarity)
+            for segment_id, similarity in zip(segment_ids.tolist(), similarities.tolist())
+            if segment_id in segments_by_id
+        ]
+        for segment_ids, similarities in matches
+    ]
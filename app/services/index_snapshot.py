@@ -0,0 +1,151 @@
+import json
+import os
+import re
+import shutil
+import numpy as np
+import logging
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; publishing is then unsynchronized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Columns of a snapshot generation, one raw .bin file each ('scales' only for int8)
+SNAPSHOT_COLUMNS = ('ids', 'episode_ids', 'show_ids', 'published', 'matrix', 'scales')
+
+# Generations kept on disk besides the current one, for readers that are
+# still mapping the previous pointer
+SNAPSHOT_KEEP = 1
+
+POINTER_FILE = 'CURRENT'
+LOCK_FILE = 'lock'
+GENERATION_DIR = re.compile(r'^gen-(\d+)$')
+
+class SnapshotLock:
+    """Exclusive lock on a snapshot directory, held while writing a generation"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, LOCK_FILE)
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
+
+def current_generation(directory):
+    """Number of the generation the pointer file names, or None"""
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+
+def write_generation(directory, columns, meta, base=None, appended=None):
+    """Write the next generation and point readers at it.
+
+    Each column is a raw file whose dtype and shape are kept in meta.json.
+    ``columns`` are written out in full. ``appended`` maps column names to
+    rows added to the same column of generation ``base``: its file is
+    hard-linked into the new generation and only the rows are written.
+    Readers of ``base`` map just the prefix its meta describes, so they
+    are unaffected by the longer file.
+
+    The files go into a temporary directory that is renamed into place
+    before the pointer file is replaced, so readers only ever see complete
+    generations. Returns the new generation number.
+    """
+    generation = max(list_generations(directory) + [current_generation(directory) or 0]) + 1
+    path = generation_path(directory, generation)
+    temp_path = f"{path}.tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    shapes = {}
+    try:
+        if appended:
+            with open(os.path.join(generation_path(directory, base), 'meta.json')) as f:
+                base_columns = json.load(f)['columns']
+        for name, rows in (appended or {}).items():
+            column = base_columns[name]
+            values = np.ascontiguousarray(rows, dtype=column['dtype'])
+            file_path = os.path.join(temp_path, f"{name}.bin")
+            _link_column(os.path.join(generation_path(directory, base), f"{name}.bin"), file_path,
+                         np.dtype(column['dtype']).itemsize * int(np.prod(column['shape'])))
+            with open(file_path, 'ab') as f:
+                f.write(values.tobytes())
+            shapes[name] = {'dtype': column['dtype'],
+                            'shape': [column['shape'][0] + len(values)] + column['shape'][1:]}
+        for name, values in columns.items():
+            if values is None:
+                continue
+            values = np.ascontiguousarray(values)
+            with open(os.path.join(temp_path, f"{name}.bin"), 'wb') as f:
+                f.write(values.tobytes())
+            shapes[name] = {'dtype': values.dtype.str, 'shape': list(values.shape)}
+        with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+            json.dump(dict(meta, generation=generation, columns=shapes), f)
+        os.rename(temp_path, path)
+    except Exception:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+    pointer_path = os.path.join(directory, POINTER_FILE)
+    with open(f"{pointer_path}.tmp", 'w') as f:
+        f.write(f"{generation}\n")
+    os.replace(f"{pointer_path}.tmp", pointer_path)
+
+    for old in list_generations(directory):
+        if old < generation - SNAPSHOT_KEEP:
+            shutil.rmtree(generation_path(directory, old), ignore_errors=True)
+    return generation
+
+def _link_column(source, target, size):
+    """Hard-link a base column file (copy it where links aren't supported),
+    dropping any tail a failed earlier append left past ``size`` bytes"""
+    if os.path.getsize(source) > size:
+        # Readers only map the first ``size`` bytes, so truncating is safe
+        os.truncate(source, size)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def open_generation(directory, generation):
+    """``(meta, columns)`` of a generation, each column memory-mapped read-only.
+
+    Mapped pages are shared through the page cache by every process that
+    opens the same generation.
+    """
+    path = generation_path(directory, generation)
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    columns = dict.fromkeys(SNAPSHOT_COLUMNS)
+    for name, column in meta['columns'].items():
+        shape = tuple(column['shape'])
+        if not shape[0]:
+            columns[name] = np.empty(shape, dtype=column['dtype'])
+            continue
+        # asarray drops the memmap subclass but keeps the mapping
+        columns[name] = np.asarray(np.memmap(os.path.join(path, f"{name}.bin"), dtype=column['dtype'],
+                                             mode='r', shape=shape))
+    return meta, columns
+
+def list_generations(directory):
+    generations = []
+    for name in os.listdir(directory):
+        match = GENERATION_DIR.match(name)
+        if match:
+            generations.append(int(match.group(1)))
+    return sorted(generations)
+
+def generation_path(directory, generation):
+    return os.path.join(directory, f"gen-{generation:08d}")
@@ -0,0 +1,437 @@
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import time
+from app import db
+from app.models import Episode
+from app.services.embedding_service import create_embeddings, get_embedding_cache
+from app.services.metrics import ingestion_episodes, ingestion_queue_depth, ingestion_segments
+from app.services.podcast_service import (
+    ListenNotesAPI, apply_episode_details, existing_segment_hashes, mark_unchanged,
+    new_segment_positions, plan_segments, segmentation_settings, store_segments, transcript_checksum
+)
+from app.services.segment_index import segment_index
+from app.services.transcript_service import parse_transcript
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RateLimiter:
+    """Thread-safe limiter spacing calls at most ``rate`` per second"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+class IngestionProgress:
+    """Counters for a single ingestion run, mirrored into the process metrics.
+
+    ``total`` counts the episodes claimed so far, so it grows as the run
+    claims more.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.fetched = 0
+        self.embedded = 0
+        self.completed = 0
+        self.unchanged = 0
+        self.failed = 0
+        self.segments = 0
+        self.started_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.completed + self.unchanged + self.failed
+
+    def increment(self, field, amount=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + amount)
+        if field in ('completed', 'unchanged', 'failed'):
+            ingestion_episodes.inc(amount, outcome=field)
+        elif field == 'segments':
+            ingestion_segments.inc(amount)
+
+    def as_dict(self):
+        return {
+            'total': self.total,
+            'fetched': self.fetched,
+            'embedded': self.embedded,
+            'completed': self.completed,
+            'unchanged': self.unchanged,
+            'failed': self.failed,
+            'segments': self.segments,
+            'elapsed_seconds': round(time.monotonic() - self.started_at, 2)
+        }
+
+    def __str__(self):
+        return (f"{self.finished}/{self.total} episodes done "
+                f"({self.completed} completed, {self.unchanged} unchanged, "
+                f"{self.failed} failed), "
+                f"{self.segments} segments, "
+                f"{time.monotonic() - self.started_at:.1f}s elapsed")
+
+class EpisodeWork:
+    """An episode moving through the fetch -> embed -> store pipeline.
+
+    Only plain values travel between threads; ORM objects stay on the
+    writer thread.
+    """
+
+    def __init__(self, episode_id, listennotes_id, duration, stored_checksum, known_hashes):
+        self.episode_id = episode_id
+        self.listennotes_id = listennotes_id
+        self.duration = duration
+        self.stored_checksum = stored_checksum
+        self.known_hashes = known_hashes
+        self.details = None
+        self.transcript = None
+        self.checksum = None
+        self.unchanged = False
+        self.planned = None
+        self.new_positions = []
+        self.embeddings = None
+        self.error = None
+
+_DONE = object()
+
+def claimable(config):
+    """Filter for episodes a run may claim: pending ones, and ones left in
+    'processing' for JOB_TIMEOUT_MINUTES by a run that died"""
+    cutoff = datetime.utcnow() - timedelta(minutes=config['JOB_TIMEOUT_MINUTES'])
+    return db.or_(
+        Episode.transcript_status == 'pending',
+        db.and_(Episode.transcript_status == 'processing', Episode.last_updated < cutoff)
+    )
+
+class IngestionEngine:
+    """Concurrent ingestion of pending episodes.
+
+    Listen Notes requests run on a bounded thread pool behind a shared rate
+    limiter. Fetched transcripts go to a single embedding worker that batches
+    segments across episodes, and all database writes happen on the thread
+    calling ``run``.
+    """
+
+    def __init__(self, app, concurrency=None, rate_limit=None, batch_size=None):
+        self.app = app
+        self.concurrency = concurrency or app.config['INGESTION_CONCURRENCY']
+        self.rate_limiter = RateLimiter(
+            rate_limit if rate_limit is not None else app.config['LISTENNOTES_RATE_LIMIT']
+        )
+        self.batch_size = batch_size or app.config['EMBEDDING_BATCH_SIZE']
+        self.progress_interval = app.config['INGESTION_PROGRESS_INTERVAL']
+        self.status_batch = app.config['INGESTION_STATUS_BATCH']
+        self.claim_batch = app.config['INGESTION_CLAIM_BATCH']
+        self._claimed = set()
+        self._batched = set()
+        self._stop = threading.Event()
+
+    def run(self, shows):
+        """Ingest all pending episodes of ``shows`` and return the run progress.
+
+        Episodes are claimed INGESTION_CLAIM_BATCH at a time as the pipeline
+        drains, so a run that dies leaves at most a few in 'processing'.
+        Those are released back to 'pending' when the run ends, or picked up
+        by a later run once they are stale (see ``claimable``).
+        """
+        show_ids = [show.id for show in shows]
+        progress = IngestionProgress(0)
+        self._claimed = set()
+        self._batched = set()
+
+        try:
+            if show_ids:
+                self._run_pipeline(show_ids, progress)
+
+            now = datetime.utcnow()
+            for show in shows:
+                show.last_updated = now
+            # Also commits the episode statuses still batched by _write
+            self._commit_statuses()
+            db.session.commit()
+        finally:
+            self._release()
+
+        # Unchanged episodes may still have been re-dated
+        segment_index.publish()
+        if progress.completed and segment_index.loaded:
+            try:
+                segment_index.train_ann()
+            except Exception as e:
+                logger.error(f"Error updating the ANN index: {str(e)}")
+
+        logger.info(f"Ingestion run finished: {progress}; "
+                    f"Listen Notes client: {ListenNotesAPI.stats.as_dict()}; "
+                    f"embedding cache: {get_embedding_cache().stats()}")
+        return progress
+
+    def _claim(self, show_ids, progress):
+        """Move the next batch of claimable episodes to 'processing'.
+
+        The update only applies to rows that are still claimable, and only
+        the rows it changed are used, so concurrent runs never process the
+        same episode. Returns the claimed episodes.
+        """
+        candidates = [episode_id for episode_id, in db.session.query(Episode.id)
+                      .filter(Episode.show_id.in_(show_ids), claimable(self.app.config))
+                      .order_by(Episode.id)
+                      .limit(self.claim_batch)]
+        if not candidates:
+            return []
+        claimed = db.session.execute(
+            db.update(Episode)
+            .where(Episode.id.in_(candidates), claimable(self.app.config))
+            .values(transcript_status='processing', last_updated=datetime.utcnow())
+            .returning(Episode.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        self._commit_statuses()
+        db.session.commit()
+        self._claimed.update(claimed)
+        progress.increment('total', len(claimed))
+        return Episode.query.filter(Episode.id.in_(claimed)).order_by(Episode.id).all() if claimed else []
+
+    def _release(self):
+        """Return episodes claimed by this run but never finished to 'pending'"""
+        if not self._claimed:
+            return
+        try:
+            db.session.rollback()
+            Episode.query.filter(Episode.id.in_(list(self._claimed)),
+                                 Episode.transcript_status == 'processing') \
+                .update({'transcript_status': 'pending'}, synchronize_session=False)
+            db.session.commit()
+            logger.warning(f"Released {len(self._claimed)} unfinished episodes back to pending")
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error releasing unfinished episodes: {str(e)}")
+        self._claimed.clear()
+
+    def _run_pipeline(self, show_ids, progress):
+        api = ListenNotesAPI()
+        fetched = queue.Queue(maxsize=self.concurrency * 2)
+        embedded = queue.Queue(maxsize=self.concurrency * 2)
+        self._stop = threading.Event()
+
+        embedder = threading.Thread(
+            target=self._embed_worker,
+            args=(fetched, embedded, progress),
+            name='ingestion-embedder',
+            daemon=True
+        )
+        embedder.start()
+
+        pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='ingestion-fetch')
+        episodes_by_id = {}
+        exhausted = False
+        try:
+            last_report = time.monotonic()
+            while True:
+                # Top up the pipeline before it runs dry
+                if not exhausted and progress.total - progress.finished < self.claim_batch:
+                    episodes = self._claim(show_ids, progress)
+                    exhausted = not episodes
+                    known_hashes = existing_segment_hashes([e.id for e in episodes])
+                    for e in episodes:
+                        episodes_by_id[e.id] = e
+                        pool.submit(self._fetch, api, EpisodeWork(
+                            e.id, e.listennotes_id, e.duration, e.transcript_checksum, known_hashes[e.id]
+                        ), fetched, progress)
+                if progress.finished >= progress.total:
+                    break
+
+                ingestion_queue_depth.set(progress.total - progress.finished, stage='pending')
+                ingestion_queue_depth.set(fetched.qsize(), stage='fetched')
+                ingestion_queue_depth.set(embedded.qsize(), stage='embedded')
+                try:
+                    item = embedded.get(timeout=1.0)
+                except queue.Empty:
+                    if not embedder.is_alive():
+                        raise RuntimeError('embedding worker stopped unexpectedly')
+                    continue
+                self._write(item, episodes_by_id.pop(item.episode_id), progress)
+
+                if time.monotonic() - last_report >= self.progress_interval:
+                    logger.info(f"Ingestion progress: {progress}")
+                    last_report = time.monotonic()
+            self._put(fetched, _DONE)
+        finally:
+            # Unblock fetchers and the embedder however the loop ended, so
+            # no thread is left waiting on a queue nobody reads
+            self._stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+            embedder.join()
+            for stage in ('pending', 'fetched', 'embedded'):
+                ingestion_queue_depth.set(0, stage=stage)
+
+    def _put(self, target, item):
+        """Put ``item`` on a bounded queue unless the run is stopping"""
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fetch(self, api, item, fetched, progress):
+        """Fetch episode details and transcript (runs on the pool)"""
+        try:
+            self.rate_limiter.acquire()
+            item.details = api.get_episode_details(item.listennotes_id)
+            if item.details:
+                item.duration = item.details.get('audio_length_sec', 0)
+
+            self.rate_limiter.acquire()
+            item.transcript = api.get_episode_transcript(item.listennotes_id)
+            progress.increment('fetched')
+        except Exception as e:
+            item.error = f"fetch failed: {str(e)}"
+        self._put(fetched, item)
+
+    def _embed_worker(self, fetched, embedded, progress):
+        """Embed segments from many episodes in shared batches"""
+        with self.app.app_context():
+            while not self._stop.is_set():
+                try:
+                    item = fetched.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    return
+
+                # Drain whatever else is ready so batches span episodes
+                batch = [item]
+                pending_segments = self._plan(item)
+                stop = False
+                while pending_segments < self.batch_size * 4:
+                    try:
+                        item = fetched.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        stop = True
+                        break
+                    batch.append(item)
+                    pending_segments += self._plan(item)
+
+                self._embed_batch([item for item in batch if item.error is None])
+                for item in batch:
+                    if item.error is None:
+                        progress.increment('embedded')
+                    if not self._put(embedded, item):
+                        return
+
+                if stop:
+                    return
+
+    def _plan(self, item):
+        """Segment a fetched transcript, returning the number of segments to embed"""
+        if item.error is not None:
+            return 0
+        try:
+            parsed = parse_transcript(item.transcript)
+            if parsed is None:
+                item.error = 'no transcript available'
+                return 0
+            item.checksum = transcript_checksum(parsed, segmentation_settings())
+            if item.checksum == item.stored_checksum and item.known_hashes:
+                item.unchanged = True
+                item.planned = []
+                return 0
+            item.planned = plan_segments(parsed, item.duration)
+        except Exception as e:
+            item.error = f"segmentation failed: {str(e)}"
+            return 0
+        item.new_positions = new_segment_positions(item.planned, item.known_hashes)
+        return len(item.new_positions)
+
+    def _embed_batch(self, items):
+        for item in items:
+            item.embeddings = [None] * len(item.planned)
+
+        segments = [item.planned[i] for item in items for i in item.new_positions]
+        if not segments:
+            return
+
+        embeddings = create_embeddings([segment.text for segment in segments], self.batch_size,
+                                       [segment.token_ids for segment in segments])
+        if embeddings is None:
+            for item in items:
+                item.error = 'embedding model failed'
+            return
+
+        offset = 0
+        for item in items:
+            for i in item.new_positions:
+                item.embeddings[i] = embeddings[offset]
+                offset += 1
+
+    def _write(self, item, episode, progress):
+        """Store one episode's results (runs on the calling thread).
+
+        Episodes that only change status (unchanged or failed) are committed
+        together every INGESTION_STATUS_BATCH episodes instead of one by one.
+        Any error is confined to the episode, which is marked failed.
+        """
+        writing = item.error is None and not item.unchanged
+        try:
+            if writing:
+                # A failed write rolls back the session, so batched statuses
+                # go first (before the details, which must still be unflushed
+                # for store_segments to see whether they changed)
+                self._commit_statuses()
+            if item.details:
+                apply_episode_details(episode, item.details)
+            if item.error is not None:
+                raise RuntimeError(item.error)
+            if item.unchanged:
+                mark_unchanged(episode, commit=False)
+                progress.increment('unchanged')
+                self._status_changed(episode)
+                return
+
+            store_segments(episode, item.planned, item.embeddings, item.checksum)
+            self._claimed.discard(episode.id)
+            progress.increment('completed')
+            progress.increment('segments', len(item.new_positions))
+        except Exception as e:
+            logger.error(f"Error processing transcript for episode {item.episode_id}: {str(e)}")
+            if writing:
+                # Statuses batched but not committed are lost with the
+                # rollback; those episodes stay claimed and are released
+                db.session.rollback()
+                self._batched.clear()
+                try:
+                    if item.details:
+                        apply_episode_details(episode, item.details)
+                except Exception:
+                    pass
+            episode.transcript_status = 'failed'
+            progress.increment('failed')
+            self._status_changed(episode)
+
+    def _status_changed(self, episode):
+        self._batched.add(episode.id)
+        if len(self._batched) >= self.status_batch:
+            self._commit_statuses()
+
+    def _commit_statuses(self):
+        if self._batched:
+            db.session.commit()
+            self._claimed -= self._batched
+            self._batched.clear()
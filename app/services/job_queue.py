@@ -0,0 +1,281 @@
+from datetime import datetime, timedelta
+import os
+import signal
+import socket
+import threading
+import time
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Episode, Job, Show
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Job priorities: a newly added show jumps ahead of routine refreshes
+PRIORITY_NEW_SHOW = 10
+PRIORITY_MANUAL = 5
+PRIORITY_SCHEDULED = 0
+
+PENDING_STATUSES = ('queued', 'running')
+
+def enqueue_show_update(show_id, priority=PRIORITY_SCHEDULED):
+    """Queue an update of a show unless one is already pending.
+
+    A pending job is reused (and raised to ``priority`` if it is still
+    queued), so a show is never updated by two workers at once. Returns the
+    show's pending job.
+
+    The ix_job_pending_show unique index allows one pending job per show, so
+    if another process queues one between the lookup and the insert, the
+    insert fails and that job is returned instead.
+    """
+    for _ in range(2):
+        job = Job.query.filter(Job.show_id == show_id, Job.status.in_(PENDING_STATUSES)).first()
+        if job is not None:
+            if job.status == 'queued' and priority > job.priority:
+                job.priority = priority
+                db.session.commit()
+            return job
+
+        job = Job(kind='update_show', show_id=show_id, priority=priority)
+        db.session.add(job)
+        try:
+            db.session.commit()
+            return job
+        except IntegrityError:
+            db.session.rollback()
+    raise RuntimeError(f"could not queue an update of show {show_id}")
+
+def retry_at(attempts):
+    """When a job that failed after ``attempts`` runs may be claimed again.
+
+    The delay starts at JOB_RETRY_DELAY seconds and doubles per attempt, so
+    a show whose source keeps failing doesn't occupy a worker in a loop.
+    """
+    delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** max(attempts - 1, 0)
+    return datetime.utcnow() + timedelta(seconds=delay)
+
+def claim_job(worker):
+    """Mark the highest-priority queued job as running and return it, or None.
+
+    Jobs waiting out a retry delay are skipped. The candidate row is
+    locked with SKIP LOCKED where the database supports it, and the status
+    update only succeeds while the job is still queued, so concurrent
+    workers never claim the same job.
+    """
+    for _ in range(5):
+        due = db.or_(Job.run_after.is_(None), Job.run_after <= datetime.utcnow())
+        job_id = db.session.query(Job.id) \
+            .filter(Job.status == 'queued', due) \
+            .order_by(Job.priority.desc(), Job.id) \
+            .limit(1) \
+            .with_for_update(skip_locked=True) \
+            .scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+        claimed = Job.query.filter(Job.id == job_id, Job.status == 'queued').update({
+            'status': 'running',
+            'worker': worker,
+            'attempts': Job.attempts + 1,
+            'started_at': datetime.utcnow(),
+            'heartbeat_at': datetime.utcnow(),
+            'finished_at': None,
+            'run_after': None,
+        }, synchronize_session=False)
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+def run_job(job):
+    """Run a claimed job and record how it ended"""
+    from app.services.ingestion import IngestionEngine
+
+    job_id = job.id
+    error = None
+    try:
+        if job.kind != 'update_show':
+            raise ValueError(f"unknown job kind {job.kind!r}")
+        show = db.session.get(Show, job.show_id)
+        if show is None:
+            raise ValueError(f"show {job.show_id} no longer exists")
+        progress = IngestionEngine(current_app._get_current_object()).run([show])
+        if progress.failed:
+            error = f"{progress.failed} of {progress.total} episodes failed"
+        status = 'completed'
+    except Exception as e:
+        logger.error(f"Error running job {job_id}: {str(e)}")
+        db.session.rollback()
+        error = str(e)
+        status = 'failed'
+
+    job = db.session.get(Job, job_id)
+    if status == 'failed' and job.attempts < current_app.config['JOB_MAX_ATTEMPTS']:
+        status = 'queued'
+        job.run_after = retry_at(job.attempts)
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+    return job
+
+def requeue_stale_jobs():
+    """Requeue running jobs whose worker has stopped sending heartbeats.
+
+    A job silent for JOB_TIMEOUT_MINUTES is assumed lost with its worker
+    and retried after the retry delay, or failed once it has been attempted
+    JOB_MAX_ATTEMPTS times. Episodes left in 'processing' as long by a dead
+    run go back to 'pending'.
+    """
+    config = current_app.config
+    cutoff = datetime.utcnow() - timedelta(minutes=config['JOB_TIMEOUT_MINUTES'])
+    stale = Job.query.filter(Job.status == 'running', Job.heartbeat_at < cutoff).all()
+    for job in stale:
+        job.status = 'queued' if job.attempts < config['JOB_MAX_ATTEMPTS'] else 'failed'
+        job.error = f"timed out on worker {job.worker}"
+        if job.status == 'failed':
+            job.finished_at = datetime.utcnow()
+        else:
+            job.run_after = retry_at(job.attempts)
+        logger.warning(f"Job {job.id} timed out on worker {job.worker}")
+    released = Episode.query.filter(Episode.transcript_status == 'processing',
+                                    Episode.last_updated < cutoff) \
+        .update({'transcript_status': 'pending'}, synchronize_session=False)
+    if released:
+        logger.warning(f"Released {released} stale processing episodes back to pending")
+    if stale or released:
+        db.session.commit()
+    return len(stale)
+
+def schedule_stale_shows():
+    """Queue updates for the shows not updated for UPDATE_SCHEDULE_HOURS.
+
+    The JOB_SCHEDULE_BATCH stalest shows without a pending job are queued
+    per call, so refreshes spread out over time instead of every show
+    becoming due at once.
+    """
+    config = current_app.config
+    cutoff = datetime.utcnow() - timedelta(hours=config['UPDATE_SCHEDULE_HOURS'])
+    pending = db.select(Job.show_id).where(Job.status.in_(PENDING_STATUSES), Job.show_id.isnot(None))
+    show_ids = [show_id for show_id, in db.session.query(Show.id)
+                .filter(db.or_(Show.last_updated.is_(None), Show.last_updated < cutoff))
+                .filter(Show.id.notin_(pending))
+                .order_by(Show.last_updated.is_(None).desc(), Show.last_updated, Show.id)
+                .limit(config['JOB_SCHEDULE_BATCH'])]
+    for show_id in show_ids:
+        enqueue_show_update(show_id, PRIORITY_SCHEDULED)
+    return len(show_ids)
+
+def latest_jobs_by_show(show_ids):
+    """Most recent job of each show, keyed by show id"""
+    if not show_ids:
+        return {}
+    latest = db.session.query(db.func.max(Job.id)).filter(Job.show_id.in_(show_ids)).group_by(Job.show_id)
+    return {job.show_id: job for job in Job.query.filter(Job.id.in_(latest))}
+
+def heartbeat(app, job_id, stopped):
+    """Refresh a running job's heartbeat every JOB_HEARTBEAT_INTERVAL seconds until ``stopped`` is set"""
+    with app.app_context():
+        while not stopped.wait(app.config['JOB_HEARTBEAT_INTERVAL']):
+            try:
+                Job.query.filter(Job.id == job_id, Job.status == 'running') \
+                    .update({'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error updating heartbeat of job {job_id}: {str(e)}")
+
+def work(once=False):
+    """Process jobs until stopped (or, with ``once``, until the queue is empty).
+
+    Between jobs the worker requeues timed-out jobs and queues stale shows
+    every JOB_SCHEDULE_INTERVAL seconds. SIGTERM and SIGINT stop it after the
+    current job. With JOB_METRICS_PORT set, the worker's metrics are served
+    on that port while it runs.
+    """
+    from app.services.metrics import serve_metrics, time_commits
+    from app.services.segment_index import segment_index
+
+    config = current_app.config
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info(f"Job worker {worker} stopping after the current job")
+        stopping.append(signum)
+
+    previous = {}
+    if threading.current_thread() is threading.main_thread():
+        previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+    metrics_server = None
+    if config['JOB_METRICS_PORT']:
+        time_commits()
+        metrics_server = serve_metrics(current_app._get_current_object(), config['JOB_METRICS_PORT'])
+    logger.info(f"Job worker {worker} started")
+    next_sweep = 0.0
+    processed = 0
+    try:
+        while not stopping:
+            if time.monotonic() >= next_sweep:
+                requeue_stale_jobs()
+                schedule_stale_shows()
+                next_sweep = time.monotonic() + config['JOB_SCHEDULE_INTERVAL']
+
+            job = claim_job(worker)
+            if job is None:
+                if once:
+                    break
+                time.sleep(config['JOB_POLL_INTERVAL'])
+                continue
+
+            if config['INDEX_SNAPSHOT_DIR']:
+                # Track the current snapshot so the run can publish its changes
+                segment_index.ensure_loaded()
+            logger.info(f"Job {job.id} ({job.kind}, show {job.show_id}) claimed by {worker}")
+            stopped = threading.Event()
+            beat = threading.Thread(target=heartbeat, name='job-heartbeat',
+                                    args=(current_app._get_current_object(), job.id, stopped), daemon=True)
+            beat.start()
+            try:
+                job = run_job(job)
+            finally:
+                stopped.set()
+                beat.join()
+            logger.info(f"Job {job.id} {job.status}" + (f": {job.error}" if job.error else ""))
+            processed += 1
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+        if metrics_server is not None:
+            metrics_server.shutdown()
+            metrics_server.server_close()
+    return processed
+
+jobs_cli = AppGroup('jobs', help='Background job queue')
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty.')
+def work_command(once):
+    """Run a job worker"""
+    processed = work(once=once)
+    click.echo(f"Processed {processed} jobs")
+
+@jobs_cli.command('enqueue')
+@click.argument('listennotes_ids', nargs=-1)
+@click.option('--all', 'all_shows', is_flag=True, help='Queue every show.')
+def enqueue_command(listennotes_ids, all_shows):
+    """Queue updates for shows by Listen Notes id"""
+    query = Show.query if all_shows else Show.query.filter(Show.listennotes_id.in_(listennotes_ids))
+    for show in query.order_by(Show.id):
+        job = enqueue_show_update(show.id, PRIORITY_MANUAL)
+        click.echo(f"{show.listennotes_id}: job {job.id} {job.status}")
+
+@jobs_cli.command('status')
+def status_command():
+    """Count jobs by status"""
+    for status, count in db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status):
+        click.echo(f"{status}: {count}")
@@ -0,0 +1,241 @@
+from array import array
+from collections import Counter
+import math
+import re
+import threading
+import numpy as np
+from flask import current_app
+from app.services.segment_index import segment_index, top_matches
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'\w+')
+
+def tokenize(text):
+    """Lower-cased word tokens used for both indexing and queries"""
+    return TOKEN.findall(text.lower())
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over segment text.
+
+    Each term maps to growable arrays of segment ids and term frequencies,
+    and document lengths live in an array indexed by segment id, where 0
+    marks a segment that is not (or no longer) indexed. Removed segments
+    are skipped at query time and purged from the postings once they make
+    up a quarter of the indexed documents.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._reset()
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    def __len__(self):
+        return self._documents
+
+    def load(self):
+        """Build the index from all stored segment text"""
+        from app import db
+        from app.models import Segment
+
+        with self._lock:
+            self._reset()
+            # The database is at least as current as the mapped segment index
+            self._generation = segment_index.version
+            rows = db.session.query(Segment.id, Segment.text) \
+                .filter(Segment.embedding.isnot(None)) \
+                .order_by(Segment.id) \
+                .yield_per(10000)
+            for segment_id, text in rows:
+                self._index(segment_id, text)
+            self._loaded = True
+            logger.info(f"Lexical index loaded with {self._documents} segments, "
+                        f"{len(self._postings)} terms")
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        self._follow_segment_index()
+
+    def add(self, segment_ids, texts):
+        """Index freshly stored segments; a no-op until the index is loaded"""
+        with self._lock:
+            if not self._loaded:
+                return
+            segment_ids = [int(segment_id) for segment_id in segment_ids]
+            if self._removed_ids.intersection(segment_ids):
+                # A reused id must not revive its old postings
+                self._compact()
+            for segment_id, text in zip(segment_ids, texts):
+                if segment_id >= len(self._lengths) or not self._lengths[segment_id]:
+                    self._index(segment_id, text)
+
+    def remove(self, segment_ids):
+        with self._lock:
+            if not self._loaded:
+                return
+            for segment_id in segment_ids:
+                if segment_id < len(self._lengths) and self._lengths[segment_id]:
+                    self._total_length -= int(self._lengths[segment_id])
+                    self._lengths[segment_id] = 0
+                    self._documents -= 1
+                    self._removed_ids.add(segment_id)
+            if len(self._removed_ids) > max(1000, self._documents // 4):
+                self._compact()
+
+    def search(self, query, limit=10, allowed_ids=None):
+        """Return ``(segment_ids, bm25_scores)`` of the best matches.
+
+        ``allowed_ids`` (a sorted id array) restricts the results, e.g. to
+        the segments matching a search filter.
+        """
+        self.ensure_loaded()
+        terms = set(tokenize(query))
+        with self._lock:
+            postings = []
+            for term in terms:
+                entry = self._postings.get(term)
+                if entry is not None:
+                    postings.append((np.array(entry[0], dtype=np.int64),
+                                     np.array(entry[1], dtype=np.float32)))
+            lengths = self._lengths
+            documents = self._documents
+            average_length = self._total_length / documents if documents else 0.0
+
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if not postings or limit <= 0:
+            return empty
+
+        ids_parts, score_parts = [], []
+        for ids, frequencies in postings:
+            document_lengths = lengths[ids].astype(np.float32)
+            live = document_lengths > 0
+            ids, frequencies, document_lengths = ids[live], frequencies[live], document_lengths[live]
+            if not len(ids):
+                continue
+            idf = math.log(1 + (documents - len(ids) + 0.5) / (len(ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * document_lengths / average_length)
+            ids_parts.append(ids)
+            score_parts.append(idf * frequencies * (self.k1 + 1) / (frequencies + norm))
+        if not ids_parts:
+            return empty
+
+        ids, inverse = np.unique(np.concatenate(ids_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts)).astype(np.float32)
+        if allowed_ids is not None:
+            keep = np.isin(ids, allowed_ids, assume_unique=True)
+            ids, scores = ids[keep], scores[keep]
+        return top_matches(ids, scores, -np.inf, limit)
+
+    def _follow_segment_index(self):
+        """Catch up with segments ingested by another process.
+
+        Job workers publish their changes as segment index snapshot
+        generations, or the segment index polls the database for them
+        without snapshots. The segment index here is brought up to date
+        first, then the segments it gained are indexed and those it lost
+        are dropped.
+        """
+        from app import db
+        from app.models import Segment
+
+        segment_index.ensure_loaded()
+        generation = segment_index.version
+        if generation is None or generation == self._generation:
+            return
+        ids = segment_index.all_ids()
+        with self._lock:
+            if generation == self._generation:
+                return
+            indexed = np.flatnonzero(self._lengths)
+            self.remove(indexed[~np.isin(indexed, ids)].tolist())
+            missing = ids[~np.isin(ids, indexed)].tolist()
+            for start in range(0, len(missing), 10000):
+                rows = db.session.query(Segment.id, Segment.text) \
+                    .filter(Segment.id.in_(missing[start:start + 10000])).all()
+                self.add([segment_id for segment_id, _ in rows], [text for _, text in rows])
+            self._generation = generation
+            if missing:
+                logger.info(f"Lexical index caught up with segment index version {generation}: "
+                            f"{len(missing)} segments added")
+
+    def _index(self, segment_id, text):
+        counts = Counter(tokenize(text))
+        length = min(sum(counts.values()), 65535)
+        if not length:
+            return
+        if segment_id >= len(self._lengths):
+            grown = np.zeros(max(segment_id + 1, 2 * len(self._lengths), 1024), dtype=np.uint16)
+            grown[:len(self._lengths)] = self._lengths
+            self._lengths = grown
+        self._lengths[segment_id] = length
+        self._documents += 1
+        self._total_length += length
+        for term, count in counts.items():
+            entry = self._postings.get(term)
+            if entry is None:
+                entry = self._postings[term] = (array('q'), array('H'))
+            entry[0].append(segment_id)
+            entry[1].append(min(count, 65535))
+
+    def _compact(self):
+        """Drop postings of removed segments"""
+        lengths = self._lengths
+        postings = {}
+        for term, (ids, frequencies) in self._postings.items():
+            id_array = np.frombuffer(ids, dtype=np.int64)
+            live = lengths[id_array] > 0
+            if live.all():
+                postings[term] = (ids, frequencies)
+            elif live.any():
+                postings[term] = (array('q', id_array[live].tobytes()),
+                                  array('H', np.frombuffer(frequencies, dtype=np.uint16)[live].tobytes()))
+            del id_array
+        self._postings = postings
+        self._removed_ids = set()
+
+    def _reset(self):
+        self._loaded = False
+        self._generation = None
+        self._postings = {}
+        self._lengths = np.zeros(0, dtype=np.uint16)
+        self._documents = 0
+        self._total_length = 0
+        self._removed_ids = set()
+
+def hybrid_search(query_text, query_embedding, threshold=0.0, limit=5, alpha=None, filters=None):
+    """Rank segments by a weighted mix of vector and BM25 similarity.
+
+    Candidates are the HYBRID_CANDIDATES best segments from each index.
+    Each candidate's BM25 score is divided by the best one among them and
+    combined as ``alpha * cosine + (1 - alpha) * bm25``, so only the
+    candidates are ever scored by both. Returns ``(segment_ids, scores)``.
+    """
+    config = current_app.config
+    alpha = config['HYBRID_ALPHA'] if alpha is None else alpha
+    candidates = config['HYBRID_CANDIDATES']
+
+    vector_ids, _ = segment_index.search_approximate(query_embedding, -1.0, candidates, filters=filters)
+    allowed_ids = segment_index.filter_ids(filters) if filters else None
+    lexical_ids, lexical_scores = lexical_index.search(query_text, candidates, allowed_ids)
+
+    ids, vector_scores = segment_index.similarities(np.union1d(vector_ids, lexical_ids), query_embedding)
+    lexical = np.zeros(len(ids), dtype=np.float32)
+    if len(lexical_ids) and len(ids):
+        positions = np.minimum(np.searchsorted(ids, lexical_ids), len(ids) - 1)
+        found = ids[positions] == lexical_ids
+        lexical[positions[found]] = lexical_scores[found] / lexical_scores.max()
+
+    scores = alpha * vector_scores + (1 - alpha) * lexical
+    return top_matches(ids, scores, threshold, limit)
+
+# Process-wide index shared by the API and the ingestion pipeline
+lexical_index = LexicalIndex()
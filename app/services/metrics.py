@@ -0,0 +1,282 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import bisect
+import math
+import threading
+import time
+from flask import has_request_context, request
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text exposition format served by /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; from sub-millisecond index scans up to slow model batches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Metric:
+    """A named metric holding one value per combination of label values"""
+
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        if not self.labels:
+            # Unlabelled series are exported from the start, at zero
+            self._values[()] = self._zero()
+
+    def _zero(self):
+        return 0
+
+    def samples(self):
+        """``(suffix, labels, value)`` for every series of the metric"""
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield '', dict(zip(self.labels, key)), value
+
+    def _key(self, labels):
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} takes labels {', '.join(self.labels) or '(none)'}")
+        return tuple(str(labels[name]) for name in self.labels)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down.
+
+    With ``function`` the value is computed at collection time instead; it
+    returns a number, or a dict of numbers keyed by label value tuples.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def samples(self):
+        if self.function is None:
+            yield from super().samples()
+            return
+        try:
+            values = self.function()
+        except Exception as e:
+            logger.error(f"Error collecting metric {self.name}: {str(e)}")
+            return
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield '', dict(zip(self.labels, key)), value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labels)
+
+    def _zero(self):
+        # Per-bucket counts (the last one is +Inf), sum and count
+        return [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = self._zero()
+            series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = [(key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items()]
+        for key, (counts, total, count) in sorted(values):
+            labels = dict(zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield '_bucket', dict(labels, le=bound), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+class MetricsRegistry:
+    """The metrics of this process, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self._register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels.items():
+        value = _format_value(value) if name == 'le' else str(value)
+        value = value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+def time_commits():
+    """Observe the duration of every session commit in db_commit_seconds"""
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+
+    if not event.contains(Session, 'before_commit', _commit_started):
+        event.listen(Session, 'before_commit', _commit_started)
+        event.listen(Session, 'after_commit', _commit_finished)
+        event.listen(Session, 'after_rollback', _commit_abandoned)
+
+def _commit_started(session):
+    session.info['commit_started'] = time.perf_counter()
+
+def _commit_finished(session):
+    started = session.info.pop('commit_started', None)
+    if started is not None:
+        db_commit_seconds.observe(time.perf_counter() - started)
+
+def _commit_abandoned(session):
+    session.info.pop('commit_started', None)
+
+def _job_counts():
+    from app import db
+    from app.models import Job
+    return {(status,): count for status, count
+            in db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status)}
+
+def _segment_index_size():
+    from app.services.segment_index import segment_index
+    return len(segment_index)
+
+def _segment_index_bytes():
+    from app.services.segment_index import segment_index
+    return segment_index.nbytes
+
+def _lexical_index_size():
+    from app.services.lexical_index import lexical_index
+    return len(lexical_index)
+
+registry = MetricsRegistry()
+
+http_request_seconds = registry.histogram(
+    'podcast_http_request_seconds', 'HTTP request latency', ('endpoint', 'method', 'status'))
+request_phase_seconds = registry.histogram(
+    'podcast_request_phase_seconds',
+    'Time spent in each phase of a request (auth, embed, scoring, fetch, serialization)',
+    ('endpoint', 'phase'))
+embedding_batch_seconds = registry.histogram(
+    'podcast_embedding_batch_seconds', 'Model forward pass latency per batch', ('backend',))
+embedding_texts = registry.counter(
+    'podcast_embedding_texts_total', 'Texts run through the embedding model', ('backend',))
+listennotes_request_seconds = registry.histogram(
+    'podcast_listennotes_request_seconds', 'Listen Notes API request latency', ('outcome',))
+listennotes_retries = registry.counter(
+    'podcast_listennotes_retries_total', 'Listen Notes API requests retried')
+db_commit_seconds = registry.histogram(
+    'podcast_db_commit_seconds', 'Session commit latency, including the final flush')
+ingestion_episodes = registry.counter(
+    'podcast_ingestion_episodes_total', 'Episodes processed by ingestion runs', ('outcome',))
+ingestion_segments = registry.counter(
+    'podcast_ingestion_segments_total', 'Segments embedded and written by ingestion runs')
+ingestion_queue_depth = registry.gauge(
+    'podcast_ingestion_queue_depth', 'Episodes waiting between ingestion pipeline stages', ('stage',))
+jobs = registry.gauge(
+    'podcast_jobs', 'Jobs in the queue by status', ('status',), function=_job_counts)
+segment_index_segments = registry.gauge(
+    'podcast_segment_index_segments', 'Segments in the vector index', function=_segment_index_size)
+segment_index_bytes = registry.gauge(
+    'podcast_segment_index_bytes', 'Memory held by index vectors', function=_segment_index_bytes)
+lexical_index_segments = registry.gauge(
+    'podcast_lexical_index_segments', 'Segments in the keyword index', function=_lexical_index_size)
+
+@contextmanager
+def request_phase(phase):
+    """Time a phase of the current request under its endpoint"""
+    endpoint = (request.endpoint or 'unknown') if has_request_context() else 'none'
+    with request_phase_seconds.time(endpoint=endpoint, phase=phase):
+        yield
+
+def serve_metrics(app, port):
+    """Serve /metrics on ``port`` from a background thread (for job workers)"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            with app.app_context():
+                body = registry.render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('', port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Serving metrics on port {server.server_address[1]}")
+    return server
@@ -1,14 +1,78 @@
+from collections import Counter
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+import hashlib
+import random
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
-from app import db, scheduler
-from app.models import Show, Episode, Segment
-from app.services.embedding_service import create_embedding
+from app import db
+from app.models import Segment, record_index_change
+from app.services.bulk_writer import insert_segments
+from app.services.embedding_service import create_embeddings, load_tokenizer
+from app.services.lexical_index import lexical_index
+from app.services.metrics import listennotes_request_seconds, listennotes_retries
+from app.services.segment_index import segment_index
+from app.services.transcript_service import (
+    assign_times, parse_transcript, segment_by_characters, segment_by_tokens
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class ClientStats:
+    """Thread-safe request counters for the Listen Notes client.
+
+    Requests and retries are also recorded in the process metrics.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.requests = 0
+            self.retries = 0
+            self.errors = 0
+            self.total_latency = 0.0
+            self.max_latency = 0.0
+    
+    def record_request(self, latency, error=False):
+        listennotes_request_seconds.observe(latency, outcome='error' if error else 'ok')
+        with self._lock:
+            self.requests += 1
+            self.errors += int(error)
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+    
+    def record_retry(self):
+        listennotes_retries.inc()
+        with self._lock:
+            self.retries += 1
+    
+    def as_dict(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'errors': self.errors,
+                'avg_latency': self.total_latency / self.requests if self.requests else 0.0,
+                'max_latency': self.max_latency
+            }
+
 class ListenNotesAPI:
+    # One pooled session per process so keep-alive connections are reused
+    # across instances and threads
+    _session = None
+    _session_lock = threading.Lock()
+    stats = ClientStats()
+    
     def __init__(self):
         self.base_url = current_app.config['LISTENNOTES_API_BASE_URL']
         self.api_key = current_app.config['LISTENNOTES_API_KEY']
@@ -16,136 +80,303 @@ class ListenNotesAPI:
             'X-ListenAPI-Key': self.api_key,
             'Content-Type': 'application/json'
         }
+        self.timeout = (
+            current_app.config['LISTENNOTES_CONNECT_TIMEOUT'],
+            current_app.config['LISTENNOTES_READ_TIMEOUT']
+        )
+        self.max_retries = current_app.config['LISTENNOTES_MAX_RETRIES']
+        self.backoff_base = current_app.config['LISTENNOTES_BACKOFF_BASE']
+        self.backoff_max = current_app.config['LISTENNOTES_BACKOFF_MAX']
+        self.session = self._get_session(current_app.config['LISTENNOTES_POOL_SIZE'])
+    
+    @classmethod
+    def _get_session(cls, pool_size):
+        with cls._session_lock:
+            if cls._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls._session = session
+            return cls._session
     
     def get_episode_transcript(self, episode_id):
         url = f"{self.base_url}/episodes/{episode_id}/transcript"
-        response = requests.get(url, headers=self.headers)
+        response = self._get(url)
         if response.status_code == 200:
             return response.json()
         return None
     
     def get_episode_details(self, episode_id):
         url = f"{self.base_url}/episodes/{episode_id}"
-        response = requests.get(url, headers=self.headers)
+        response = self._get(url)
         if response.status_code == 200:
             return response.json()
         return None
+    
+    def _get(self, url):
+        """GET with retries on connection errors, timeouts and RETRY_STATUSES"""
+        for attempt in range(self.max_retries + 1):
+            error = None
+            response = None
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, headers=self.headers, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            self.stats.record_request(
+                time.monotonic() - start,
+                error=error is not None or response.status_code >= 400
+            )
+            
+            retryable = error is not None or response.status_code in RETRY_STATUSES
+            if not retryable or attempt == self.max_retries:
+                break
+            
+            self.stats.record_retry()
+            delay = self._retry_delay(attempt, response)
+            logger.warning(f"Retrying {url} in {delay:.2f}s "
+                           f"({error or response.status_code}, attempt {attempt + 1})")
+            time.sleep(delay)
+        
+        if error is not None:
+            raise error
+        return response
+    
+    def _retry_delay(self, attempt, response):
+        """Honor Retry-After, else exponential backoff with full jitter"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    retry_at = parsedate_to_datetime(retry_after)
+                    delay = (retry_at - datetime.now(retry_at.tzinfo)).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.backoff_max)
+        
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
 
 def segment_transcript(transcript_text, max_length=500):
     """Split transcript into segments of approximately max_length characters"""
-    words = transcript_text.split()
-    segments = []
-    current_segment = []
-    current_length = 0
-    
-    for word in words:
-        word_length = len(word) + 1  # +1 for space
-        if current_length + word_length > max_length and current_segment:
-            segments.append(' '.join(current_segment))
-            current_segment = [word]
-            current_length = word_length
+    return [segment.text for segment in segment_by_characters(transcript_text, max_length)]
+
+def apply_episode_details(episode, episode_data):
+    """Copy Listen Notes episode details onto an episode"""
+    episode.title = episode_data.get('title', episode.title)
+    episode.description = episode_data.get('description', episode.description)
+    episode.audio_url = episode_data.get('audio', episode.audio_url)
+    if episode_data.get('pub_date_ms') is not None:
+        episode.published_at = datetime.fromtimestamp(episode_data['pub_date_ms'] / 1000)
+    episode.duration = episode_data.get('audio_length_sec') or 0
+
+def index_details_changed(episode):
+    """Whether the show or publish time the search index holds for an
+    episode's segments has been changed and not yet flushed"""
+    state = db.inspect(episode)
+    return state.attrs.show_id.history.has_changes() or state.attrs.published_at.history.has_changes()
+
+def segmentation_settings():
+    """Settings that determine how a transcript is split into segments"""
+    config = current_app.config
+    return (config['EMBEDDING_MODEL'], config['SEGMENT_MAX_TOKENS'],
+            config['SEGMENT_OVERLAP_TOKENS'], config['MAX_SEGMENT_LENGTH'])
+
+def plan_segments(parsed, duration):
+    """Split a ParsedTranscript into TranscriptSegments with time ranges.
+
+    Segments follow the embedding tokenizer's token budget when
+    SEGMENT_MAX_TOKENS is set, and MAX_SEGMENT_LENGTH characters otherwise.
+    Times come from the transcript's timing cues when it has them.
+    """
+    config = current_app.config
+    if config['SEGMENT_MAX_TOKENS']:
+        segments = list(segment_by_tokens(
+            parsed.text,
+            load_tokenizer(),
+            config['SEGMENT_MAX_TOKENS'],
+            config['SEGMENT_OVERLAP_TOKENS']
+        ))
+    else:
+        segments = list(segment_by_characters(parsed.text, config['MAX_SEGMENT_LENGTH']))
+    
+    assign_times(segments, parsed, duration)
+    return segments
+
+def transcript_checksum(parsed, settings):
+    """Checksum of a transcript, its timings and the settings used to segment it"""
+    digest = hashlib.sha256(repr(settings).encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(parsed.text.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(parsed.timing_signature().encode('utf-8'))
+    return digest.hexdigest()
+
+def existing_segment_hashes(episode_ids):
+    """Map episode id to a Counter of the text hashes of its stored segments"""
+    hashes = {episode_id: Counter() for episode_id in episode_ids}
+    if episode_ids:
+        rows = db.session.query(Segment.episode_id, Segment.text_hash) \
+            .filter(Segment.episode_id.in_(list(episode_ids)))
+        for episode_id, segment_hash in rows:
+            hashes[episode_id][segment_hash] += 1
+    return hashes
+
+def new_segment_positions(planned_segments, known_hashes):
+    """Positions of planned segments that no stored segment will be kept for.
+
+    Like ``store_segments``, each stored segment is matched by at most one
+    planned segment, so a text planned more often than it is stored needs
+    new embeddings for the extra copies.
+    """
+    remaining = Counter(known_hashes)
+    positions = []
+    for i, segment in enumerate(planned_segments):
+        if remaining[segment.text_hash] > 0:
+            remaining[segment.text_hash] -= 1
         else:
-            current_segment.append(word)
-            current_length += word_length
+            positions.append(i)
+    return positions
+
+def embed_new_segments(planned_segments, known_hashes):
+    """Embed planned segments whose text is not stored yet.
+
+    Returns a list aligned with ``planned_segments`` holding None for
+    segments that will be kept as they are, or None if the model failed.
+    """
+    new_positions = new_segment_positions(planned_segments, known_hashes)
+    embeddings = [None] * len(planned_segments)
+    if new_positions:
+        vectors = create_embeddings(
+            [planned_segments[i].text for i in new_positions],
+            token_ids=[planned_segments[i].token_ids for i in new_positions]
+        )
+        if vectors is None:
+            return None
+        for i, vector in zip(new_positions, vectors):
+            embeddings[i] = vector
+    return embeddings
+
+def store_segments(episode, planned_segments, embeddings, checksum=None):
+    """Sync an episode's stored segments with a new plan and mark it completed.
+
+    Existing segments whose text still appears are kept with their
+    embeddings (only their times are updated), stale ones are deleted and
+    new ones bulk-inserted in chunks, all in a single transaction.
+    ``embeddings`` is aligned with ``planned_segments`` and may hold None
+    for kept segments.
+    """
+    details_changed = index_details_changed(episode)
+    existing = {}
+    for segment_id, segment_hash, start_time, end_time in db.session.query(
+            Segment.id, Segment.text_hash, Segment.start_time, Segment.end_time) \
+            .filter(Segment.episode_id == episode.id).order_by(Segment.id):
+        existing.setdefault(segment_hash, []).append((segment_id, start_time, end_time))
     
-    if current_segment:
-        segments.append(' '.join(current_segment))
+    new_segments = []
+    time_updates = []
+    for planned, embedding in zip(planned_segments, embeddings):
+        matches = existing.get(planned.text_hash)
+        if matches:
+            segment_id, old_start, old_end = matches.pop(0)
+            if (old_start, old_end) != (planned.start_time, planned.end_time):
+                time_updates.append({'id': segment_id, 'start_time': planned.start_time,
+                                     'end_time': planned.end_time})
+            continue
+        if embedding is None:
+            raise ValueError(f"missing embedding for new segment of episode {episode.id}")
+        new_segments.append((planned, embedding))
     
-    return segments
+    stale_ids = [segment_id for matches in existing.values() for segment_id, _, _ in matches]
+    if stale_ids:
+        Segment.query.filter(Segment.id.in_(stale_ids)).delete(synchronize_session=False)
+    if time_updates:
+        db.session.execute(db.update(Segment), time_updates)
+    record_index_change(bool(stale_ids) or details_changed)
+    
+    # Core executemany (or COPY) rather than ORM objects, one chunk at a time
+    segment_ids = insert_segments({
+        'episode_id': episode.id,
+        'start_time': planned.start_time,
+        'end_time': planned.end_time,
+        'text': planned.text,
+        'text_hash': planned.text_hash,
+        'embedding': embedding,
+    } for planned, embedding in new_segments)
+    
+    if checksum is not None:
+        episode.transcript_checksum = checksum
+    episode.transcript_status = 'completed'
+    episode.last_updated = datetime.utcnow()
+    db.session.commit()
+    
+    # Keep the in-process search indexes in sync with the changed rows. The
+    # episode is stored by now, so a failure here doesn't fail it: it is
+    # logged, and the indexes read the rows back from the database later.
+    try:
+        segment_index.remove(stale_ids)
+        segment_index.update_episode(episode.id, episode.show_id, episode.published_at)
+        segment_index.add(segment_ids, [embedding for _, embedding in new_segments],
+                          episode.id, episode.show_id, episode.published_at)
+        lexical_index.remove(stale_ids)
+        lexical_index.add(segment_ids, [planned.text for planned, _ in new_segments])
+    except Exception as e:
+        logger.error(f"Error updating search indexes for episode {episode.id}: {str(e)}")
+
+def mark_unchanged(episode, commit=True):
+    """Complete an episode whose transcript matches the last processed one.
+
+    With ``commit=False`` the status change is left for the caller to commit.
+    """
+    if index_details_changed(episode):
+        record_index_change()
+    episode.transcript_status = 'completed'
+    episode.last_updated = datetime.utcnow()
+    if commit:
+        db.session.commit()
+    # Episode details may have been refreshed even though segments didn't change
+    try:
+        segment_index.update_episode(episode.id, episode.show_id, episode.published_at)
+    except Exception as e:
+        logger.error(f"Error updating search indexes for episode {episode.id}: {str(e)}")
 
 def process_episode_transcript(episode):
-    """Process transcript for an episode and create embeddings"""
+    """Process transcript for an episode and create embeddings.
+
+    Reprocessing is incremental: an unchanged transcript is skipped, and
+    otherwise only segments whose text changed are embedded and written.
+    """
     try:
         api = ListenNotesAPI()
         transcript_data = api.get_episode_transcript(episode.listennotes_id)
+        parsed = parse_transcript(transcript_data)
         
-        if not transcript_data or 'transcript' not in transcript_data:
+        if parsed is None:
             episode.transcript_status = 'failed'
             db.session.commit()
             return
         
+        checksum = transcript_checksum(parsed, segmentation_settings())
+        known_hashes = existing_segment_hashes([episode.id])[episode.id]
+        if checksum == episode.transcript_checksum and known_hashes:
+            mark_unchanged(episode)
+            return
+        
         # Split transcript into segments
-        segments = segment_transcript(
-            transcript_data['transcript'],
-            current_app.config['MAX_SEGMENT_LENGTH']
-        )
+        planned = plan_segments(parsed, episode.duration)
         
-        # Create segments with embeddings
-        for i, text in enumerate(segments):
-            # Calculate approximate time ranges based on position in transcript
-            total_duration = episode.duration or 0
-            segment_duration = total_duration / len(segments)
-            start_time = int(i * segment_duration)
-            end_time = int((i + 1) * segment_duration)
-            
-            # Create embedding for segment
-            embedding = create_embedding(text)
-            
-            segment = Segment(
-                episode_id=episode.id,
-                start_time=start_time,
-                end_time=end_time,
-                text=text
-            )
-            segment.set_embedding(embedding)
-            db.session.add(segment)
+        # Embed only segments that aren't stored yet, in batched forward passes
+        embeddings = embed_new_segments(planned, known_hashes)
+        if embeddings is None:
+            raise RuntimeError('embedding model failed')
         
-        episode.transcript_status = 'completed'
-        episode.last_updated = datetime.utcnow()
-        db.session.commit()
+        store_segments(episode, planned, embeddings, checksum)
         
     except Exception as e:
         logger.error(f"Error processing transcript for episode {episode.id}: {str(e)}")
+        db.session.rollback()
         episode.transcript_status = 'failed'
         db.session.commit()
-
-def update_show_episodes(show):
-    """Update episodes for a show and process their transcripts"""
-    try:
-        api = ListenNotesAPI()
-        
-        # Get episodes that need transcript processing
-        pending_episodes = Episode.query.filter_by(
-            show_id=show.id,
-            transcript_status='pending'
-        ).all()
-        
-        for episode in pending_episodes:
-            # Update episode details if needed
-            episode_data = api.get_episode_details(episode.listennotes_id)
-            if episode_data:
-                episode.title = episode_data.get('title', episode.title)
-                episode.description = episode_data.get('description', episode.description)
-                episode.audio_url = episode_data.get('audio', episode.audio_url)
-                episode.published_at = datetime.fromtimestamp(episode_data.get('pub_date_ms', 0)/1000)
-                episode.duration = episode_data.get('audio_length_sec', 0)
-                db.session.commit()
-            
-            # Process transcript
-            episode.transcript_status = 'processing'
-            db.session.commit()
-            process_episode_transcript(episode)
-        
-        show.last_updated = datetime.utcnow()
-        db.session.commit()
-        
-    except Exception as e:
-        logger.error(f"Error updating show {show.id}: {str(e)}")
-
-def schedule_podcast_updates():
-    """Schedule regular updates of podcast episodes and transcripts"""
-    def update_all_shows():
-        with scheduler.app.app_context():
-            shows = Show.query.all()
-            for show in shows:
-                update_show_episodes(show)
-    
-    # Schedule updates based on configuration
-    update_interval = current_app.config['UPDATE_SCHEDULE_HOURS']
-    scheduler.add_job(
-        id='update_podcasts',
-        func=update_all_shows,
-        trigger='interval',
-        hours=update_interval,
-        next_run_time=datetime.now()
-    )
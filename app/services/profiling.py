@@ -0,0 +1,57 @@
+import cProfile
+import io
+import pstats
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in a cProfile report
+CPROFILE_REPORT_LINES = 60
+
+class RequestProfiler:
+    """Profile of a single request.
+
+    Uses the pyinstrument sampling profiler when it is installed, sampling
+    every ``interval`` seconds, and falls back to the standard library's
+    cProfile, which traces every call and so slows the request down more.
+    """
+
+    def __init__(self, interval=0.001):
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+
+        if Profiler is not None:
+            self.engine = 'pyinstrument'
+            self._profiler = Profiler(interval=interval)
+        else:
+            self.engine = 'cprofile'
+            self._profiler = cProfile.Profile()
+        self._running = False
+
+    def start(self):
+        if self.engine == 'pyinstrument':
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+        self._running = True
+
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        if self.engine == 'pyinstrument':
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self):
+        """Plain-text report of the profiled request"""
+        self.stop()
+        if self.engine == 'pyinstrument':
+            return self._profiler.output_text(unicode=True, show_all=False)
+        output = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=output)
+        stats.sort_stats('cumulative').print_stats(CPROFILE_REPORT_LINES)
+        return output.getvalue()
@@ -0,0 +1,1062 @@
+from datetime import datetime, timezone
+import hashlib
+import os
+import threading
+import time
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from app.services.ann_index import IVFIndex, default_nlist, saved_version
+from app.services.index_snapshot import SnapshotLock, current_generation, open_generation, write_generation
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on the score block materialized per chunk of batched queries
+SCORE_BLOCK_BYTES = 64 * 1024 * 1024
+
+# Storage precisions for index vectors (see quantize), and how many
+# low-precision rows are widened to float32 at a time while scoring
+INDEX_PRECISIONS = ('float32', 'float16', 'int8')
+SCORE_BLOCK_ROWS = 16384
+
+# Publish times are stored as microseconds since the epoch; undated
+# episodes sort first and never match a date filter.
+EPOCH = datetime(1970, 1, 1)
+NO_DATE = np.iinfo(np.int64).min
+LATEST_DATE = np.iinfo(np.int64).max
+
+# Rows appended after the filter views were built are scanned directly
+# until there are more than this many (or an eighth of the index)
+VIEW_REBUILD_MIN = 4096
+
+class SegmentFilter:
+    """Restricts a search to some shows, episodes and/or a publish date range.
+
+    Ids are database primary keys and both dates are inclusive. Unset
+    criteria don't restrict the search; set ones must all match.
+    """
+
+    __slots__ = ('show_ids', 'episode_ids', 'published_after', 'published_before')
+
+    def __init__(self, show_ids=None, episode_ids=None, published_after=None, published_before=None):
+        self.show_ids = show_ids
+        self.episode_ids = episode_ids
+        self.published_after = published_after
+        self.published_before = published_before
+
+    def __bool__(self):
+        return any(value is not None for value in (
+            self.show_ids, self.episode_ids, self.published_after, self.published_before
+        ))
+
+class SortedColumn:
+    """Row positions ordered by a column's value, for lookups without a scan"""
+
+    def __init__(self, values):
+        self.order = np.argsort(values, kind='stable')
+        self.values = values[self.order]
+
+    def equal_to(self, values):
+        starts = np.searchsorted(self.values, values, side='left')
+        ends = np.searchsorted(self.values, values, side='right')
+        parts = [self.order[start:end] for start, end in zip(starts, ends) if end > start]
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def between(self, low, high):
+        start = np.searchsorted(self.values, low, side='left')
+        end = np.searchsorted(self.values, high, side='right')
+        return self.order[start:end]
+
+class SegmentIndex:
+    """In-memory dense index over segment embeddings.
+
+    Embeddings are kept L2-normalized in one contiguous matrix whose rows
+    line up with an array of segment ids, so scoring a query against the
+    whole corpus is a single matrix-vector product. The matrix is float32,
+    or float16 / int8 with per-row scales (INDEX_PRECISION) to cut memory,
+    in which case the best candidates can be re-ranked with the stored
+    float32 embeddings (INDEX_RESCORE_FACTOR). Parallel arrays hold each
+    row's episode, show and publish time for filtered searches, which score
+    only the selected rows. An optional IVF index groups the rows into
+    cells, so approximate searches on large corpora score only a few.
+
+    With INDEX_SNAPSHOT_DIR set, the columns are memory-mapped from an
+    on-disk snapshot generation shared by all worker processes. Local
+    changes are only recorded until ``publish`` writes the next generation
+    on top of the current one; other processes switch to it on their next
+    check. Without snapshots, each process polls a database watermark
+    instead and reads the segments other processes wrote.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._ann_lock = threading.Lock()
+        self._loaded = False
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._episode_ids = np.empty(0, dtype=np.int64)
+        self._show_ids = np.empty(0, dtype=np.int64)
+        self._published = np.empty(0, dtype=np.int64)
+        self._matrix = None
+        self._scales = None
+        self._precision = 'float32'
+        self._rescore_factor = 0
+        self._views = None
+        self._views_size = 0
+        self._ann = None
+        self._ann_modified = None  # ANN_INDEX_PATH modification time last checked
+        self._snapshot_dir = ''
+        self._check_interval = 0
+        self._next_check = 0.0
+        self._generation = None
+        self._dirty = False
+        self._database = None
+        self._max_id = 0
+        self._removed = set()
+        self._episode_updates = {}
+        self._watermark = None
+        self._catch_ups = 0
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def generation(self):
+        """Snapshot generation currently mapped, None without snapshots or with unpublished changes"""
+        return None if self._dirty else self._generation
+
+    @property
+    def version(self):
+        """Changes whenever the index takes in segments written by another
+        process: the snapshot generation (None with unpublished changes), or
+        a count of database catch-ups without snapshots"""
+        return self.generation if self._snapshot_dir else self._catch_ups
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self):
+        """Bytes allocated for index vectors and columns, including spare capacity"""
+        with self._lock:
+            columns = (self._matrix, self._scales, self._ids, self._episode_ids, self._show_ids, self._published)
+            return sum(column.nbytes for column in columns if column is not None)
+
+    def load(self):
+        """Build the index from all stored segment embeddings.
+
+        With INDEX_SNAPSHOT_DIR set, the current snapshot generation is
+        mapped instead; only the first process to start (or one whose
+        INDEX_PRECISION differs from the snapshot's) reads the database
+        and writes a generation for the others.
+        """
+        config = current_app.config
+        if config['INDEX_PRECISION'] not in INDEX_PRECISIONS:
+            raise ValueError(f"INDEX_PRECISION must be one of: {', '.join(INDEX_PRECISIONS)}")
+
+        with self._lock:
+            self._reset()
+            self._precision = config['INDEX_PRECISION']
+            self._rescore_factor = config['INDEX_RESCORE_FACTOR'] if self._precision != 'float32' else 0
+            self._snapshot_dir = config['INDEX_SNAPSHOT_DIR']
+            self._check_interval = config['INDEX_SNAPSHOT_CHECK_INTERVAL']
+            self._next_check = time.monotonic() + self._check_interval
+            self._database = _database_id()
+
+            if self._snapshot_dir:
+                try:
+                    os.makedirs(self._snapshot_dir, exist_ok=True)
+                    with SnapshotLock(self._snapshot_dir):
+                        generation = current_generation(self._snapshot_dir)
+                        if generation is None or not self._map_generation(generation):
+                            self._map_generation(self._rebuild_generation())
+                except Exception as e:
+                    logger.error(f"Error using index snapshots in {self._snapshot_dir}: {str(e)}; "
+                                 f"falling back to a private index that polls the database every "
+                                 f"{self._check_interval}s for segments ingested by job workers")
+                    self._reset()
+                    self._snapshot_dir = ''
+            if not self._snapshot_dir:
+                self._watermark = _database_watermark()
+                self._load_rows()
+
+            self._loaded = True
+            memory = self._matrix.nbytes if self._matrix is not None else 0
+            source = f"snapshot generation {self._generation}" if self._generation else "database"
+            logger.info(f"Segment index loaded from {source} with {self._size} segments "
+                        f"({self._precision}, {memory / 2**20:.1f} MiB of vectors)")
+
+    def publish(self):
+        """Write local changes as a new snapshot generation and map it.
+
+        Called by the ingesting process after a run. The next generation
+        builds on the current one, whoever wrote it: segments stored with
+        ids above its highest one are read from the database and appended,
+        and the segments this process removed or re-dated are applied.
+        Only a pure append is cheap to write, as it hard-links the current
+        column files. Returns the new generation, or None when there was
+        nothing to publish.
+        """
+        if not self._snapshot_dir or not self._loaded or not self._dirty:
+            return None
+        with self._lock:
+            try:
+                with SnapshotLock(self._snapshot_dir):
+                    current = current_generation(self._snapshot_dir)
+                    if current is not None and (current == self._generation or self._map_generation(current)):
+                        generation = self._write_changes(current)
+                    else:
+                        # Nothing this process can build on
+                        ann = self._ann
+                        self._reset()
+                        self._ann = ann
+                        generation = self._rebuild_generation()
+            except Exception as e:
+                logger.error(f"Error publishing index snapshot to {self._snapshot_dir}: {str(e)}")
+                return None
+            self._map_generation(generation)
+            self._loaded = True
+            self._removed.clear()
+            self._episode_updates.clear()
+            self._dirty = False
+            logger.info(f"Published index snapshot generation {generation} with {self._size} segments")
+            return generation
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self.load()
+        elif self._snapshot_dir:
+            self._refresh()
+        else:
+            self._catch_up()
+
+    def add(self, segment_ids, embeddings, episode_id=None, show_id=None, published_at=None):
+        """Add freshly stored segments of one episode to a loaded index.
+
+        When the index has not been loaded yet this is a no-op: the segments
+        are already in the database and will be picked up by ``load``.
+        """
+        with self._lock:
+            if not self._loaded:
+                return
+            if self._snapshot_dir:
+                # Read back from the database by the next publish
+                self._dirty = True
+                return
+            ids, vectors = [], []
+            segment_ids = np.asarray(segment_ids, dtype=np.int64)
+            known = set(segment_ids[np.isin(segment_ids, self._ids[:self._size])].tolist())
+            for segment_id, embedding in zip(segment_ids, embeddings):
+                if embedding is None or segment_id in known:
+                    continue
+                ids.append(segment_id)
+                vectors.append(embedding)
+            if ids:
+                count = len(ids)
+                self._append(ids, vectors,
+                             np.full(count, -1 if episode_id is None else episode_id, dtype=np.int64),
+                             np.full(count, -1 if show_id is None else show_id, dtype=np.int64),
+                             np.full(count, _timestamp(published_at), dtype=np.int64))
+                self._dirty = True
+                if self._ann is not None:
+                    vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+                    self._ann.append(ids, self._ann.assign(vectors))
+
+    def remove(self, segment_ids):
+        """Drop segments from a loaded index"""
+        with self._lock:
+            if not self._loaded or not len(segment_ids):
+                return
+            if self._snapshot_dir:
+                self._removed.update(int(segment_id) for segment_id in segment_ids)
+                self._dirty = True
+                return
+            if self._size == 0:
+                return
+            keep = ~np.isin(self._ids[:self._size], np.asarray(segment_ids, dtype=np.int64))
+            if keep.all():
+                return
+            # Compact into fresh arrays so concurrent readers keep their views
+            self._ids = self._ids[:self._size][keep].copy()
+            self._episode_ids = self._episode_ids[:self._size][keep].copy()
+            self._show_ids = self._show_ids[:self._size][keep].copy()
+            self._published = self._published[:self._size][keep].copy()
+            self._matrix = self._matrix[:self._size][keep].copy()
+            if self._scales is not None:
+                self._scales = self._scales[:self._size][keep].copy()
+            self._size = len(self._ids)
+            self._views = None
+            self._dirty = True
+            if self._ann is not None:
+                self._ann.keep(keep)
+
+    def update_episode(self, episode_id, show_id, published_at):
+        """Refresh the show and publish time recorded for an episode's rows"""
+        with self._lock:
+            if not self._loaded:
+                return
+            published = _timestamp(published_at)
+            if self._snapshot_dir:
+                self._episode_updates[episode_id] = (show_id, published)
+                self._dirty = True
+                return
+            if self._size == 0:
+                return
+            rows = np.flatnonzero(self._episode_ids[:self._size] == episode_id)
+            if not len(rows) or ((self._show_ids[rows] == show_id).all()
+                                 and (self._published[rows] == published).all()):
+                return
+            # Copy on write so concurrent readers see consistent columns
+            self._show_ids = self._show_ids.copy()
+            self._published = self._published.copy()
+            self._show_ids[rows] = show_id
+            self._published[rows] = published
+            self._views = None
+            self._dirty = True
+
+    def search(self, query_embedding, threshold=0.7, limit=5, filters=None):
+        """Return ``(segment_ids, similarities)`` of the best matches.
+
+        Results are ordered by descending similarity, ties keeping index
+        order, and only scores ``>= threshold`` are kept. With a
+        SegmentFilter only the matching rows are scored.
+        """
+        ids, matrix, scales = self._snapshot(filters)
+        if len(ids) == 0 or limit <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        scores = score_rows(matrix, scales, query)
+        if self._rescore_factor:
+            candidates, _ = top_matches(ids, scores, -np.inf, limit * self._rescore_factor)
+            return self._rescore([candidates], query[None], [threshold], [limit])[0]
+        return top_matches(ids, scores, threshold, limit)
+
+    def search_batch(self, query_embeddings, thresholds, limits, filters=None):
+        """Exact search for many queries at once.
+
+        Queries are scored in chunks, each a single matrix-matrix product
+        against the corpus (or the rows selected by ``filters``). Returns one
+        ``(segment_ids, similarities)`` pair per query, in input order,
+        ranked as ``search`` would.
+        """
+        ids, matrix, scales = self._snapshot(filters)
+        size = len(ids)
+
+        queries = _normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        if size == 0:
+            empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+            return [empty] * len(queries)
+
+        chunk_size = max(1, SCORE_BLOCK_BYTES // (4 * size))
+        results = []
+        for start in range(0, len(queries), chunk_size):
+            end = start + chunk_size
+            scores = score_rows(matrix, scales, queries[start:end].T).T
+            for row, threshold, limit in zip(scores, thresholds[start:end], limits[start:end]):
+                if self._rescore_factor:
+                    results.append(top_matches(ids, row, -np.inf, limit * self._rescore_factor)[0])
+                else:
+                    results.append(top_matches(ids, row, threshold, limit))
+        if self._rescore_factor:
+            return self._rescore(results, queries, thresholds, limits)
+        return results
+
+    def similarities(self, segment_ids, query_embedding):
+        """Cosine similarity of the query to specific segments.
+
+        Returns ``(segment_ids, similarities)`` sorted by id, leaving out
+        ids that aren't in the index.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            rows = self._rows_for_ids(segment_ids, size) if size else np.empty(0, dtype=np.int64)
+            rows = rows[np.argsort(ids[rows])]
+            vectors = self._vectors(size, rows) if len(rows) else None
+
+        if not len(rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        return ids[rows], vectors @ query
+
+    def dimension(self):
+        """Length of the indexed vectors, None while the index is empty"""
+        self.ensure_loaded()
+        with self._lock:
+            return self._matrix.shape[1] if self._size else None
+
+    def all_ids(self):
+        """Ids of every indexed segment, in index order"""
+        self.ensure_loaded()
+        with self._lock:
+            return self._ids[:self._size].copy()
+
+    def filter_ids(self, filters):
+        """Sorted ids of the segments matching a SegmentFilter"""
+        self.ensure_loaded()
+        with self._lock:
+            if not self._size:
+                return np.empty(0, dtype=np.int64)
+            return np.sort(self._ids[self._select(filters, self._size)])
+
+    def search_approximate(self, query_embedding, threshold=0.7, limit=5, nprobe=None, filters=None):
+        """Approximate search through the IVF index.
+
+        Only the rows in the probed cells are scored, straight from the index
+        matrix, and re-ranked as ``search`` does at low precision. Corpora
+        smaller than ANN_MIN_SEGMENTS or without a trained IVF index are
+        searched exactly, and so are filtered searches: IVF cells can't be
+        restricted to a filter, while a filtered scan only touches the
+        selected rows.
+        """
+        self.ensure_loaded()
+        ann = None if filters else self.ensure_ann()
+        if ann is None:
+            return self.search(query_embedding, threshold, limit, filters)
+        if limit <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            matrix = self._matrix[:size]
+            scales = self._scales[:size] if self._scales is not None else None
+            rows = np.sort(ann.candidates(query, nprobe or current_app.config['ANN_NPROBE']))
+
+        scores = score_rows(matrix[rows], scales[rows] if scales is not None else None, query)
+        if self._rescore_factor:
+            candidates, _ = top_matches(ids[rows], scores, -np.inf, limit * self._rescore_factor)
+            return self._rescore([candidates], query[None], [threshold], [limit])[0]
+        return top_matches(ids[rows], scores, threshold, limit)
+
+    def ensure_ann(self):
+        """Return the IVF index, or None to search exactly.
+
+        Never trains: the index comes from ``train_ann`` in this process or
+        from ANN_INDEX_PATH, where job workers and ``flask index train-ann``
+        save it, and is reloaded once the file holds a newer training.
+        """
+        config = current_app.config
+        if not self._size or self._size < config['ANN_MIN_SEGMENTS']:
+            return None
+        path = config['ANN_INDEX_PATH']
+        modified = _modified(path)
+        if modified is None or modified == self._ann_modified:
+            return self._ann
+
+        with self._ann_lock:
+            if modified != self._ann_modified:
+                self._ann_modified = modified
+                self._load_ann(path)
+            return self._ann
+
+    def train_ann(self, force=False):
+        """Train the IVF index when it is missing, from another database or
+        outgrown by ANN_RETRAIN_FACTOR, and save it to ANN_INDEX_PATH.
+
+        Runs in job workers after ingestion and in ``flask index
+        train-ann``, off the request path. k-means samples
+        ANN_TRAIN_POINTS_PER_CELL vectors per cell. Returns the index, or
+        None below ANN_MIN_SEGMENTS.
+        """
+        self.ensure_loaded()
+        config = current_app.config
+        if not self._size or self._size < config['ANN_MIN_SEGMENTS']:
+            return None
+        path = config['ANN_INDEX_PATH']
+
+        with self._ann_lock:
+            if self._ann is None and _modified(path) is not None:
+                self._load_ann(path)
+            ann = self._ann
+            if force or ann is None or self._ann_stale(ann, config):
+                ann = self._train_ann(config)
+                with self._lock:
+                    self._sync_ann(ann)
+                    self._ann = ann
+            if path:
+                ann.save(path)
+                self._ann_modified = _modified(path)
+            return ann
+
+    def _ann_stale(self, ann, config):
+        return self._size > config['ANN_RETRAIN_FACTOR'] * max(ann.trained_size, 1)
+
+    def _load_ann(self, path):
+        """Switch to the IVF index saved at ``path``, unless it is the
+        training already in use"""
+        try:
+            if self._ann is not None and saved_version(path) == self._ann.version:
+                return
+            ann = IVFIndex.load(path)
+        except Exception as e:
+            logger.error(f"Error loading ANN index from {path}: {str(e)}")
+            return
+        if ann.database != self._database:
+            logger.info(f"ANN index at {path} was built from another database")
+            return
+        with self._lock:
+            self._sync_ann(ann)
+            self._ann = ann
+        logger.info(f"Loaded ANN index with {ann.nlist} cells from {path}")
+
+    def _train_ann(self, config):
+        """Train a new IVF index and assign every current row to a cell"""
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            matrix = self._matrix[:size]
+            scales = self._scales[:size] if self._scales is not None else None
+        nlist = config['ANN_NLIST'] or default_nlist(size)
+        sample_size = min(size, nlist * config['ANN_TRAIN_POINTS_PER_CELL'])
+        rows = np.sort(np.random.default_rng(0).choice(size, sample_size, replace=False))
+        sample = dequantize(matrix[rows], scales[rows] if scales is not None else None)
+        ann = IVFIndex.train(sample, nlist, iterations=config['ANN_TRAIN_ITERATIONS'],
+                             points_per_cell=config['ANN_TRAIN_POINTS_PER_CELL'])
+        ann.trained_size = size
+        ann.database = self._database
+
+        # Assign outside the lock; _sync_ann catches up with later changes
+        cells = np.empty(size, dtype=np.int32)
+        for start in range(0, size, SCORE_BLOCK_ROWS):
+            end = start + SCORE_BLOCK_ROWS
+            cells[start:end] = ann.assign(dequantize(matrix[start:end],
+                                                     scales[start:end] if scales is not None else None))
+        ann.bind(ids, cells)
+        logger.info(f"Trained ANN index with {ann.nlist} cells on {sample_size} of {size} segments")
+        return ann
+
+    def _load_rows(self, after_id=None):
+        """Append stored segment embeddings read from the database: all of
+        them, or those with ids above ``after_id`` not indexed yet"""
+        indexed = set()
+        if after_id is not None:
+            ids = self._ids[:self._size]
+            indexed = set(ids[ids > after_id].tolist())
+        for ids, vectors, episode_ids, show_ids, published in _stored_rows(after_id):
+            new = [i for i, segment_id in enumerate(ids) if segment_id not in indexed]
+            if len(new) < len(ids):
+                ids, vectors = [ids[i] for i in new], [vectors[i] for i in new]
+                episode_ids, show_ids = [episode_ids[i] for i in new], [show_ids[i] for i in new]
+                published = [published[i] for i in new]
+            if ids:
+                self._append(ids, vectors, episode_ids, show_ids, published)
+
+    def _sync_ann(self, ann):
+        """Line the IVF index's rows up with the index rows, assigning cells
+        only to segments it hasn't seen"""
+        size = self._size
+        ids = self._ids[:size]
+        known = len(ann)
+        if known <= size and np.array_equal(ann.ids[:known], ids[:known]):
+            # Only appended rows, as after catching up or a publish
+            missing = np.arange(known, size)
+            cells = None
+        else:
+            cells = ann.cells_of(ids)
+            missing = np.flatnonzero(cells < 0)
+        assigned = np.empty(len(missing), dtype=np.int32)
+        for start in range(0, len(missing), SCORE_BLOCK_ROWS):
+            end = start + SCORE_BLOCK_ROWS
+            assigned[start:end] = ann.assign(self._vectors(size, missing[start:end]))
+        if cells is None:
+            ann.append(ids[known:], assigned)
+        else:
+            cells[missing] = assigned
+            ann.bind(ids, cells)
+
+    def _refresh(self):
+        """Switch to a newer snapshot generation, checked at most every
+        INDEX_SNAPSHOT_CHECK_INTERVAL seconds.
+
+        Unpublished local changes are kept aside, so they are published on
+        top of whichever generation is current by then.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self._check_interval
+        generation = current_generation(self._snapshot_dir)
+        if generation is None or generation == self._generation:
+            return
+        with self._lock:
+            if generation != self._generation and self._map_generation(generation):
+                logger.info(f"Segment index switched to snapshot generation {generation} "
+                            f"with {self._size} segments")
+
+    def _catch_up(self):
+        """Without snapshots, take in segments written by other processes,
+        checked at most every INDEX_SNAPSHOT_CHECK_INTERVAL seconds.
+
+        The watermark is the highest segment id and the change count kept in
+        the segment_index_state row. A higher id alone means new segments,
+        which are read and appended. A new change count means segments were
+        deleted or re-dated, so the whole index is reloaded.
+        """
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self._check_interval
+        watermark = _database_watermark()
+        if watermark == self._watermark:
+            return
+
+        with self._lock:
+            previous = self._watermark
+            if watermark == previous:
+                return
+            if previous and watermark[1] == previous[1]:
+                self._watermark = watermark
+                before = self._size
+                self._load_rows(after_id=previous[0])
+                if self._ann is not None:
+                    self._sync_ann(self._ann)
+                logger.info(f"Segment index caught up with the database: {self._size - before} segments added")
+            else:
+                ann = self._ann
+                self.load()
+                self._ann = ann
+                if ann is not None:
+                    self._sync_ann(ann)
+            self._catch_ups += 1
+
+    def _map_generation(self, generation):
+        """Point the index columns at a snapshot generation's mapped files.
+
+        Returns False, leaving the index as it was, if the generation can't
+        be read, or was written from another database or with another
+        INDEX_PRECISION.
+        """
+        try:
+            meta, columns = open_generation(self._snapshot_dir, generation)
+        except Exception as e:
+            logger.error(f"Error opening index snapshot generation {generation}: {str(e)}")
+            return False
+        if meta.get('database') != self._database:
+            logger.info(f"Index snapshot generation {generation} was built from another database")
+            return False
+        if meta['precision'] != self._precision:
+            logger.info(f"Index snapshot generation {generation} is {meta['precision']}, "
+                        f"not {self._precision}")
+            return False
+        if 'max_id' not in meta:
+            logger.info(f"Index snapshot generation {generation} was written in an older format")
+            return False
+
+        self._ids = columns['ids']
+        self._episode_ids = columns['episode_ids']
+        self._show_ids = columns['show_ids']
+        self._published = columns['published']
+        self._matrix = columns['matrix']
+        self._scales = columns['scales']
+        self._size = meta['size']
+        self._max_id = meta['max_id']
+        self._views = None
+        self._generation = generation
+        if self._ann is not None:
+            self._sync_ann(self._ann)
+        return True
+
+    def _rebuild_generation(self):
+        """Read every stored segment and write them as a new generation"""
+        max_id = _database_watermark()[0]
+        self._load_rows()
+        size = self._size
+        columns = {
+            'ids': self._ids[:size],
+            'episode_ids': self._episode_ids[:size],
+            'show_ids': self._show_ids[:size],
+            'published': self._published[:size],
+            'matrix': self._matrix[:size] if self._matrix is not None else None,
+            'scales': self._scales[:size] if self._scales is not None else None,
+        }
+        return write_generation(self._snapshot_dir, columns, self._meta(size, max_id))
+
+    def _write_changes(self, base):
+        """Write the mapped generation ``base`` plus newer stored segments and
+        the local removals and episode updates as the next generation.
+
+        Returns ``base`` itself when nothing changed.
+        """
+        # Ids are ordered by commit (see SegmentIndexState), so every segment
+        # up to this watermark is either stored already or in ``new``
+        max_id = _database_watermark()[0]
+        size = self._size
+        new = _quantized_rows(_stored_rows(self._max_id), self._precision)
+        keep = None
+        if self._removed and size:
+            keep = ~np.isin(self._ids[:size], np.fromiter(self._removed, dtype=np.int64))
+            keep = None if keep.all() else keep
+        if new is None and keep is None and (not self._episode_updates or not size):
+            return base
+
+        base_columns = {
+            'ids': self._ids[:size],
+            'episode_ids': self._episode_ids[:size],
+            'show_ids': self._show_ids[:size],
+            'published': self._published[:size],
+            'matrix': self._matrix[:size] if self._matrix is not None else None,
+            'scales': self._scales[:size] if self._scales is not None else None,
+        }
+        new = new or dict.fromkeys(base_columns)
+        if keep is None and size:
+            # Append to the current column files, rewriting only the small
+            # show and publish time columns when episodes were re-dated
+            rewrite = ('show_ids', 'published') if self._episode_updates else ()
+            appended = {name: new[name] if new[name] is not None else base_columns[name][:0]
+                        for name in base_columns if name not in rewrite and base_columns[name] is not None}
+            columns = {name: _concatenate(base_columns[name], new[name]) for name in rewrite}
+        else:
+            appended = None
+            if keep is not None:
+                base_columns = {name: values[keep] if values is not None else None
+                                for name, values in base_columns.items()}
+            columns = {name: _concatenate(base_columns[name], new[name]) for name in base_columns}
+        if self._episode_updates:
+            episode_ids = _concatenate(base_columns['episode_ids'], new['episode_ids'])
+            for episode_id, (show_id, published) in self._episode_updates.items():
+                rows = episode_ids == episode_id
+                columns['show_ids'][rows] = show_id
+                columns['published'][rows] = published
+        total = len(columns['ids']) if 'ids' in columns else size + len(appended['ids'])
+        return write_generation(self._snapshot_dir, columns, self._meta(total, max_id),
+                                base=base, appended=appended)
+
+    def _meta(self, size, max_id):
+        return {'size': size, 'max_id': max_id, 'precision': self._precision, 'database': self._database}
+
+    def _snapshot(self, filters=None):
+        """Consistent ``(ids, matrix, scales)`` of the rows a search should score"""
+        self.ensure_loaded()
+        with self._lock:
+            size = self._size
+            ids = self._ids[:size]
+            matrix = self._matrix[:size] if self._matrix is not None else None
+            scales = self._scales[:size] if self._scales is not None else None
+            rows = self._select(filters, size) if filters and size else None
+
+        if matrix is None:
+            return ids, np.empty((0, 0), dtype=np.float32), None
+        if rows is not None:
+            return ids[rows], matrix[rows], scales[rows] if scales is not None else None
+        return ids, matrix, scales
+
+    def _vectors(self, size, rows=None):
+        """Index rows as float32 unit vectors"""
+        matrix = self._matrix[:size]
+        scales = self._scales[:size] if self._scales is not None else None
+        if rows is not None:
+            matrix = matrix[rows]
+            scales = scales[rows] if scales is not None else None
+        return dequantize(matrix, scales)
+
+    def _rescore(self, candidates, queries, thresholds, limits):
+        """Re-rank each query's candidates using the stored float32 embeddings"""
+        from app import db
+        from app.models import Segment, decode_embedding
+
+        wanted = set()
+        for candidate_ids in candidates:
+            wanted.update(candidate_ids.tolist())
+        stored = {}
+        if wanted:
+            rows = db.session.query(Segment.id, Segment.embedding).filter(Segment.id.in_(wanted))
+            stored = {segment_id: decode_embedding(raw) for segment_id, raw in rows}
+
+        results = []
+        for candidate_ids, query, threshold, limit in zip(candidates, queries, thresholds, limits):
+            ids = np.array([i for i in candidate_ids.tolist() if stored.get(i) is not None], dtype=np.int64)
+            if not len(ids):
+                results.append((ids, np.empty(0, dtype=np.float32)))
+                continue
+            vectors = _normalize_rows(np.array([stored[i] for i in ids.tolist()], dtype=np.float32))
+            results.append(top_matches(ids, vectors @ query, threshold, limit))
+        return results
+
+    def _select(self, filters, size):
+        """Sorted positions of the rows matching ``filters``.
+
+        Each criterion is looked up in a sorted view of its column, so the
+        cost grows with the number of matching rows rather than the corpus.
+        Rows appended since the views were built are checked directly until
+        that tail is large enough to be worth rebuilding them.
+        """
+        built = self._ensure_views(size)
+
+        selections = []
+        for name, column, values in (('show', self._show_ids, filters.show_ids),
+                                     ('episode', self._episode_ids, filters.episode_ids)):
+            if values is not None:
+                values = np.unique(np.asarray(list(values), dtype=np.int64))
+                tail = np.flatnonzero(np.isin(column[built:size], values)) + built
+                selections.append(np.concatenate([self._views[name].equal_to(values), tail]))
+
+        if filters.published_after is not None or filters.published_before is not None:
+            low = _timestamp(filters.published_after) if filters.published_after is not None else NO_DATE + 1
+            high = _timestamp(filters.published_before) if filters.published_before is not None else LATEST_DATE
+            published = self._published[built:size]
+            tail = np.flatnonzero((published >= low) & (published <= high)) + built
+            selections.append(np.concatenate([self._views['published'].between(low, high), tail]))
+
+        # Intersect starting from the narrowest criterion
+        selections.sort(key=len)
+        rows = np.sort(selections[0])
+        for selection in selections[1:]:
+            rows = np.intersect1d(rows, selection, assume_unique=True)
+        return rows
+
+    def _rows_for_ids(self, segment_ids, size):
+        """Positions of the given segment ids, through the sorted id view"""
+        built = self._ensure_views(size)
+        wanted = np.unique(np.asarray(segment_ids, dtype=np.int64))
+        tail = np.flatnonzero(np.isin(self._ids[built:size], wanted)) + built
+        return np.concatenate([self._views['id'].equal_to(wanted), tail])
+
+    def _ensure_views(self, size):
+        """(Re)build the sorted column views if needed; returns the rows they cover"""
+        if self._views is None or size - self._views_size > max(VIEW_REBUILD_MIN, self._views_size // 8):
+            self._views = {
+                'id': SortedColumn(self._ids[:size]),
+                'show': SortedColumn(self._show_ids[:size]),
+                'episode': SortedColumn(self._episode_ids[:size]),
+                'published': SortedColumn(self._published[:size]),
+            }
+            self._views_size = size
+        return self._views_size
+
+    def _reset(self):
+        self._ann = None
+        self._ann_modified = None
+        self._loaded = False
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._episode_ids = np.empty(0, dtype=np.int64)
+        self._show_ids = np.empty(0, dtype=np.int64)
+        self._published = np.empty(0, dtype=np.int64)
+        self._matrix = None
+        self._scales = None
+        self._views = None
+        self._views_size = 0
+        self._generation = None
+        self._max_id = 0
+        self._removed = set()
+        self._episode_updates = {}
+        self._dirty = False
+
+    def _append(self, ids, vectors, episode_ids, show_ids, published):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        vectors, scales = quantize(_normalize_rows(vectors), self._precision)
+        count = len(ids)
+        needed = self._size + count
+
+        if self._matrix is None:
+            capacity = max(needed, 1024)
+            self._matrix = np.zeros((capacity, vectors.shape[1]), dtype=vectors.dtype)
+            self._scales = np.zeros(capacity, dtype=np.float32) if scales is not None else None
+            self._ids = np.zeros(capacity, dtype=np.int64)
+            self._episode_ids = np.zeros(capacity, dtype=np.int64)
+            self._show_ids = np.zeros(capacity, dtype=np.int64)
+            self._published = np.zeros(capacity, dtype=np.int64)
+        elif needed > len(self._ids):
+            # Grow geometrically into fresh buffers; readers holding views of
+            # the old ones keep seeing a consistent prefix.
+            capacity = max(needed, 2 * len(self._ids))
+            matrix = np.zeros((capacity, self._matrix.shape[1]), dtype=self._matrix.dtype)
+            matrix[:self._size] = self._matrix[:self._size]
+            self._matrix = matrix
+            if self._scales is not None:
+                self._scales = _grow(self._scales, self._size, capacity)
+            self._ids = _grow(self._ids, self._size, capacity)
+            self._episode_ids = _grow(self._episode_ids, self._size, capacity)
+            self._show_ids = _grow(self._show_ids, self._size, capacity)
+            self._published = _grow(self._published, self._size, capacity)
+
+        self._matrix[self._size:needed] = vectors
+        if scales is not None:
+            self._scales[self._size:needed] = scales
+        self._ids[self._size:needed] = ids
+        self._episode_ids[self._size:needed] = episode_ids
+        self._show_ids[self._size:needed] = show_ids
+        self._published[self._size:needed] = published
+        self._size = needed
+
+def quantize(vectors, precision):
+    """Encode unit vectors for the index, returning ``(matrix, scales)``.
+
+    int8 maps each row's largest component to 127 and keeps that row's
+    scale factor; float16 and float32 are plain casts with no scales.
+    """
+    if precision == 'int8':
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        return np.round(vectors / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vectors.astype(precision), None
+
+def dequantize(matrix, scales=None):
+    if matrix.dtype == np.float32:
+        return matrix
+    vectors = matrix.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    return vectors
+
+def score_rows(matrix, scales, query):
+    """``matrix @ query`` for a float32, float16 or int8 index matrix.
+
+    ``query`` is one vector or a ``(dim, n)`` block of them. Low-precision
+    rows are widened a block at a time, so scoring never holds a float32
+    copy of the whole matrix.
+    """
+    if matrix.dtype == np.float32:
+        return matrix @ query
+    scores = np.empty((len(matrix),) + query.shape[1:], dtype=np.float32)
+    for start in range(0, len(matrix), SCORE_BLOCK_ROWS):
+        end = start + SCORE_BLOCK_ROWS
+        scores[start:end] = matrix[start:end].astype(np.float32) @ query
+    if scales is not None:
+        scores *= scales if scores.ndim == 1 else scales[:, None]
+    return scores
+
+def top_matches(ids, scores, threshold, limit):
+    """Best ``limit`` rows scoring ``>= threshold``, ties keeping index order"""
+    if limit <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    candidates = np.flatnonzero(scores >= threshold)
+    if len(candidates) > limit:
+        # Keep everything tied with the k-th best score so the stable
+        # sort below picks the same rows a full sort would.
+        kth = np.partition(scores[candidates], len(candidates) - limit)[len(candidates) - limit]
+        candidates = candidates[scores[candidates] >= kth]
+    order = np.argsort(-scores[candidates], kind='stable')[:limit]
+    top = candidates[order]
+    return ids[top], scores[top]
+
+def _database_id():
+    """Fingerprint of the database URL, so snapshots aren't mixed across databases"""
+    from app import db
+
+    url = db.engine.url.render_as_string(hide_password=True)
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+
+def _stored_rows(after_id=None):
+    """Stored segments with an embedding (and an id above ``after_id``), in id
+    order, as chunks of ``(ids, vectors, episode_ids, show_ids, published)``
+    lists"""
+    from app import db
+    from app.models import Episode, Segment, decode_embedding
+
+    rows = db.session.query(Segment.id, Segment.embedding, Segment.episode_id,
+                            Episode.show_id, Episode.published_at) \
+        .join(Episode, Segment.episode_id == Episode.id) \
+        .filter(Segment.embedding.isnot(None)) \
+        .order_by(Segment.id)
+    if after_id is not None:
+        rows = rows.filter(Segment.id > after_id)
+
+    ids, vectors, episode_ids, show_ids, published = [], [], [], [], []
+    for segment_id, raw, episode_id, show_id, published_at in rows.yield_per(10000):
+        embedding = decode_embedding(raw)
+        if embedding is None:
+            continue
+        ids.append(segment_id)
+        vectors.append(embedding)
+        episode_ids.append(episode_id)
+        show_ids.append(show_id)
+        published.append(_timestamp(published_at))
+        if len(ids) >= 10000:
+            yield ids, vectors, episode_ids, show_ids, published
+            ids, vectors, episode_ids, show_ids, published = [], [], [], [], []
+    if ids:
+        yield ids, vectors, episode_ids, show_ids, published
+
+def _quantized_rows(chunks, precision):
+    """Snapshot columns for chunks of ``_stored_rows``, or None if there are none"""
+    parts = {name: [] for name in ('ids', 'episode_ids', 'show_ids', 'published', 'matrix', 'scales')}
+    for ids, vectors, episode_ids, show_ids, published in chunks:
+        matrix, scales = quantize(_normalize_rows(np.asarray(vectors, dtype=np.float32)), precision)
+        parts['ids'].append(np.asarray(ids, dtype=np.int64))
+        parts['episode_ids'].append(np.asarray(episode_ids, dtype=np.int64))
+        parts['show_ids'].append(np.asarray(show_ids, dtype=np.int64))
+        parts['published'].append(np.asarray(published, dtype=np.int64))
+        parts['matrix'].append(matrix)
+        if scales is not None:
+            parts['scales'].append(scales)
+    if not parts['ids']:
+        return None
+    return {name: np.concatenate(values) if values else None for name, values in parts.items()}
+
+def _concatenate(base, new):
+    """A fresh array of ``base`` followed by ``new`` (either may be None)"""
+    if new is None:
+        return None if base is None else np.array(base)
+    return new.copy() if base is None else np.concatenate([base, new])
+
+def _database_watermark():
+    """``(highest segment id, change count)``; both only ever go up.
+
+    Read on a connection of its own, so the caller's session (possibly a
+    search request's) is neither committed nor kept in a transaction.
+    """
+    from app import db
+    from app.models import Segment, SegmentIndexState
+
+    changes = db.select(SegmentIndexState.changes).where(SegmentIndexState.id == 1).scalar_subquery()
+    with db.engine.connect() as connection:
+        latest, count = connection.execute(db.select(db.func.max(Segment.id), changes)).one()
+    return latest or 0, count or 0
+
+def _modified(path):
+    """Modification time of ``path``, None when it is unset or missing"""
+    try:
+        return os.stat(path).st_mtime_ns if path else None
+    except FileNotFoundError:
+        return None
+
+def _grow(column, size, capacity):
+    grown = np.zeros(capacity, dtype=column.dtype)
+    grown[:size] = column[:size]
+    return grown
+
+def _timestamp(value):
+    """Microseconds since the epoch for a publish time (NO_DATE for None)"""
+    if value is None:
+        return NO_DATE
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    delta = value - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    if norm == 0:
+        return vector
+    return vector / norm
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+# Process-wide index shared by the API and the ingestion pipeline
+segment_index = SegmentIndex()
+
+index_cli = AppGroup('index', help='Segment search index')
+
+@index_cli.command('train-ann')
+@click.option('--force', is_flag=True, help='Retrain even if the saved index is still current.')
+def train_ann_command(force):
+    """Train the IVF index and save it to ANN_INDEX_PATH"""
+    ann = segment_index.train_ann(force=force)
+    if ann is None:
+        click.echo(f"{len(segment_index)} segments; ANN_MIN_SEGMENTS is "
+                   f"{current_app.config['ANN_MIN_SEGMENTS']}, searches stay exact")
+    else:
+        click.echo(f"ANN index: {ann.nlist} cells over {len(ann)} segments")
@@ -0,0 +1,149 @@
+from datetime import datetime
+import atexit
+import threading
+import time
+from flask import current_app
+from app import db
+from app.models import APIToken
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Unknown tokens are cached too; purge expired entries past this many
+TOKEN_CACHE_MAX_ENTRIES = 10000
+
+class TokenCache:
+    """Short-lived cache of API token validation results.
+
+    Lookups of both active and unknown tokens are cached for TOKEN_CACHE_TTL
+    seconds. ``invalidate`` applies a status change in this process at once;
+    other processes pick it up when their entry expires.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, token):
+        """Return the id of an active token, or None"""
+        now = time.monotonic()
+        entry = self._entries.get(token)
+        if entry is not None and entry[1] > now:
+            return entry[0]
+
+        token_id = db.session.query(APIToken.id).filter_by(token=token, is_active=True).scalar()
+        expires_at = now + current_app.config['TOKEN_CACHE_TTL']
+        with self._lock:
+            if len(self._entries) >= TOKEN_CACHE_MAX_ENTRIES:
+                self._entries = {key: value for key, value in self._entries.items() if value[1] > now}
+                if len(self._entries) >= TOKEN_CACHE_MAX_ENTRIES:
+                    self._entries = {}
+            self._entries[token] = (token_id, expires_at)
+        return token_id
+
+    def invalidate(self, token=None):
+        """Forget one token (or all of them)"""
+        with self._lock:
+            if token is None:
+                self._entries = {}
+            else:
+                self._entries.pop(token, None)
+
+class UsageRecorder:
+    """Counts API token usage in memory and writes it back in batches.
+
+    A background thread flushes the counts every TOKEN_USAGE_FLUSH_INTERVAL
+    seconds as a single executemany UPDATE, and once more at interpreter
+    exit so a graceful restart loses nothing. Counts from a failed flush are
+    kept and retried with the next one. Counts go to the database of the
+    app they were recorded in: recording in another app first flushes the
+    pending ones to the previous app's database.
+    """
+
+    def __init__(self):
+        self._counts = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._app = None
+        self._thread = None
+
+    def record(self, token_id):
+        app = current_app._get_current_object()
+        if app is not self._app:
+            self._bind(app)
+        with self._lock:
+            self._counts[token_id] = self._counts.get(token_id, 0) + 1
+            self._last_used[token_id] = datetime.utcnow()
+
+    def flush(self):
+        """Write pending usage to the database, returning the number of tokens updated"""
+        with self._flush_lock:
+            counts, last_used = self._take()
+            if not counts:
+                return 0
+            if not self._write(counts, last_used):
+                with self._lock:
+                    for token_id, count in counts.items():
+                        self._counts[token_id] = self._counts.get(token_id, 0) + count
+                        self._last_used.setdefault(token_id, last_used[token_id])
+                return 0
+            return len(counts)
+
+    def _take(self):
+        with self._lock:
+            counts, last_used = self._counts, self._last_used
+            self._counts, self._last_used = {}, {}
+        return counts, last_used
+
+    def _write(self, counts, last_used):
+        table = APIToken.__table__
+        try:
+            db.session.execute(
+                table.update()
+                .where(table.c.id == db.bindparam('token_id'))
+                .values(requests_count=db.func.coalesce(table.c.requests_count, 0) + db.bindparam('uses'),
+                        last_used=db.bindparam('used_at')),
+                [{'token_id': token_id, 'uses': count, 'used_at': last_used[token_id]}
+                 for token_id, count in counts.items()]
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error flushing API token usage: {str(e)}")
+            return False
+        return True
+
+    def _bind(self, app):
+        """Flush what was counted for the previous app, then count for ``app``"""
+        with self._flush_lock:
+            if app is self._app:
+                return
+            if self._app is not None:
+                counts, last_used = self._take()
+                if counts:
+                    with self._app.app_context():
+                        if not self._write(counts, last_used):
+                            # Their token ids mean nothing in the new app's database
+                            logger.error(f"Dropped usage of {len(counts)} API tokens of a previous app")
+            self._app = app
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='token-usage-flush', daemon=True)
+                self._thread.start()
+                atexit.register(self._shutdown)
+
+    def _run(self):
+        while not self._stop.wait(self._app.config['TOKEN_USAGE_FLUSH_INTERVAL']):
+            # Holding the lock keeps _bind from switching apps under the flush
+            with self._flush_lock, self._app.app_context():
+                self.flush()
+
+    def _shutdown(self):
+        self._stop.set()
+        with self._flush_lock, self._app.app_context():
+            self.flush()
+
+# Process-wide instances used by the API token check
+token_cache = TokenCache()
+usage_recorder = UsageRecorder()
@@ -0,0 +1,254 @@
+from bisect import bisect_left, bisect_right
+import math
+import re
+from app.models import text_hash
+
+# Sentence-final punctuation, optionally followed by closing quotes/brackets
+SENTENCE_END = re.compile(r'[.!?]+["\')\]]*$')
+
+class TranscriptSegment:
+    """A slice of a transcript planned for storage as a Segment"""
+
+    __slots__ = ('text', 'char_start', 'char_end', 'token_ids', 'start_time', 'end_time', '_hash')
+
+    def __init__(self, text, char_start, char_end, token_ids=None):
+        self.text = text
+        self.char_start = char_start
+        self.char_end = char_end
+        self.token_ids = token_ids
+        self.start_time = None
+        self.end_time = None
+        self._hash = None
+
+    @property
+    def text_hash(self):
+        if self._hash is None:
+            self._hash = text_hash(self.text)
+        return self._hash
+
+    def __repr__(self):
+        return f'<TranscriptSegment {self.char_start}-{self.char_end}>'
+
+def segment_by_characters(transcript_text, max_length=500):
+    """Pack whitespace-separated words into segments of up to max_length characters"""
+    current = []
+    current_length = 0
+    segment_start = None
+    segment_end = None
+
+    for match in re.finditer(r'\S+', transcript_text):
+        word_length = len(match.group()) + 1  # +1 for space
+        if current_length + word_length > max_length and current:
+            yield TranscriptSegment(' '.join(current), segment_start, segment_end)
+            current = []
+            current_length = 0
+        if not current:
+            segment_start = match.start()
+        current.append(match.group())
+        current_length += word_length
+        segment_end = match.end()
+
+    if current:
+        yield TranscriptSegment(' '.join(current), segment_start, segment_end)
+
+def sentence_cut_points(transcript_text, offsets):
+    """Token positions where a sentence ends, i.e. valid segment cut points"""
+    cuts = []
+    for i, (start, end) in enumerate(offsets):
+        if end <= start:
+            continue
+        next_start = offsets[i + 1][0] if i + 1 < len(offsets) else len(transcript_text)
+        if next_start > end and SENTENCE_END.search(transcript_text, start, end):
+            cuts.append(i + 1)
+    return cuts
+
+def segment_by_tokens(transcript_text, tokenizer, max_tokens, overlap=0):
+    """Split a transcript into windows of at most max_tokens model tokens.
+
+    The transcript is tokenized once; segment text is sliced from the
+    original string using the fast tokenizer's character offsets and each
+    segment carries its token ids for reuse at embedding time. Windows end on
+    a sentence boundary when one falls in their second half, and consecutive
+    windows share up to ``overlap`` tokens, starting on a sentence boundary
+    inside the overlap when possible.
+    """
+    encoding = tokenizer(transcript_text, add_special_tokens=False,
+                         return_offsets_mapping=True, verbose=False)
+    token_ids = encoding['input_ids']
+    offsets = encoding['offset_mapping']
+    total = len(token_ids)
+    budget = max(1, max_tokens - tokenizer.num_special_tokens_to_add())
+    overlap = min(overlap, budget // 2)
+    cuts = sentence_cut_points(transcript_text, offsets)
+
+    start = 0
+    while start < total:
+        end = min(start + budget, total)
+        if end < total:
+            # Last sentence end in the second half of the window
+            i = bisect_right(cuts, end) - 1
+            if i >= 0 and cuts[i] > start + budget // 2:
+                end = cuts[i]
+
+        char_start = offsets[start][0]
+        char_end = offsets[end - 1][1]
+        yield TranscriptSegment(transcript_text[char_start:char_end], char_start, char_end,
+                                token_ids[start:end])
+
+        if end >= total:
+            break
+        next_start = max(end - overlap, start + 1)
+        # Prefer to start the overlap at the beginning of a sentence
+        i = bisect_left(cuts, next_start)
+        if i < len(cuts) and cuts[i] < end:
+            next_start = cuts[i]
+        start = next_start
+
+class ParsedTranscript:
+    """Transcript text plus optional timing cues.
+
+    ``cues`` is a list of ``(char_start, char_end, start_seconds, end_seconds)``
+    tuples in text order, one per timed word or caption cue.
+    """
+
+    __slots__ = ('text', 'cues')
+
+    def __init__(self, text, cues=None):
+        self.text = text
+        self.cues = cues or []
+
+    def timing_signature(self):
+        """Compact string of all cue times, for change detection"""
+        return ';'.join(f"{start:.3f}-{end:.3f}" for _, _, start, end in self.cues)
+
+CUE_TIME = re.compile(r'(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})')
+CUE_TAG = re.compile(r'<[^>]*>')
+
+def parse_cue_time(value):
+    match = CUE_TIME.match(value.strip())
+    if not match:
+        raise ValueError(f"invalid cue time {value!r}")
+    hours, minutes, seconds, fraction = match.groups()
+    return (int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds)
+            + int(fraction.ljust(3, '0')) / 1000)
+
+def is_caption_text(text):
+    head = text.lstrip()[:200]
+    return head.startswith('WEBVTT') or '-->' in head
+
+def parse_captions(text):
+    """Parse SRT or WebVTT captions into (cue text, start, end) tuples"""
+    cues = []
+    cue_start = cue_end = None
+    lines = []
+    for line in text.splitlines() + ['']:
+        line = line.strip()
+        if not line:
+            if cue_start is not None and lines:
+                cues.append((' '.join(lines), cue_start, cue_end))
+            cue_start = cue_end = None
+            lines = []
+        elif '-->' in line:
+            start, end = line.split('-->', 1)
+            cue_start = parse_cue_time(start)
+            cue_end = parse_cue_time(end.split()[0])
+            lines = []
+        elif cue_start is not None:
+            cleaned = CUE_TAG.sub('', line).strip()
+            if cleaned:
+                lines.append(cleaned)
+    return cues
+
+def _timed_items(transcript_data):
+    """Word- or cue-level (text, start, end) items from a transcript payload"""
+    for key in ('words', 'segments', 'cues'):
+        items = transcript_data.get(key)
+        if items:
+            timed = []
+            for item in items:
+                text = item.get('text', item.get('word', ''))
+                if 'start_ms' in item:
+                    start, end = item['start_ms'] / 1000, item['end_ms'] / 1000
+                else:
+                    start, end = item['start'], item['end']
+                timed.append((text, float(start), float(end)))
+            return timed
+
+    transcript = transcript_data.get('transcript')
+    if isinstance(transcript, str) and is_caption_text(transcript):
+        return parse_captions(transcript)
+    return None
+
+def parse_transcript(transcript_data):
+    """Turn a transcript payload into a ParsedTranscript, or None if it has none.
+
+    Word lists (``words``/``segments``/``cues`` with start/end seconds) and
+    SRT/WebVTT caption text are joined into plain text in a single pass while
+    recording where each timed item sits in it; a plain ``transcript``
+    string yields a transcript without cues.
+    """
+    if not transcript_data:
+        return None
+
+    timed = _timed_items(transcript_data)
+    if timed is None:
+        transcript = transcript_data.get('transcript')
+        return ParsedTranscript(transcript) if isinstance(transcript, str) else None
+
+    parts = []
+    cues = []
+    position = 0
+    for text, start, end in timed:
+        text = text.strip()
+        if not text:
+            continue
+        if parts:
+            position += 1  # joining space
+        parts.append(text)
+        cues.append((position, position + len(text), start, max(start, end)))
+        position += len(text)
+    return ParsedTranscript(' '.join(parts), cues)
+
+class CueCursor:
+    """Forward-only lookup from character offset to time over sorted cues"""
+
+    def __init__(self, cues):
+        self.cues = cues
+        self.index = 0
+
+    def time_at(self, offset, end=False):
+        cues = self.cues
+        # Advance past cues that finish before the offset; an end offset
+        # sitting exactly on a cue's last character still belongs to it.
+        while self.index < len(cues) - 1 and (
+                cues[self.index][1] < offset or (not end and cues[self.index][1] == offset)):
+            self.index += 1
+        char_start, char_end, start, stop = cues[self.index]
+        if offset <= char_start:
+            return start
+        if offset >= char_end:
+            return stop
+        return start + (stop - start) * (offset - char_start) / (char_end - char_start)
+
+def assign_times(segments, parsed, duration):
+    """Set start_time/end_time on segments ordered by character position.
+
+    With cues, a character offset maps to a time by interpolating inside the
+    cue that contains it (or the start of the next cue in a gap). Without
+    cues, times are proportional to character position over ``duration``.
+    Segment starts and ends both advance monotonically, so two cursors walk
+    the cues once and the whole pass is linear.
+    """
+    if not parsed.cues:
+        length = len(parsed.text) or 1
+        total = duration or 0
+        for segment in segments:
+            segment.start_time = int(total * segment.char_start / length)
+            segment.end_time = int(math.ceil(total * segment.char_end / length))
+        return
+
+    start_cursor = CueCursor(parsed.cues)
+    end_cursor = CueCursor(parsed.cues)
+    for segment in segments:
+        segment.start_time = int(start_cursor.time_at(segment.char_start))
+        segment.end_time = int(math.ceil(end_cursor.time_at(segment.char_end, end=True)))
@@ -0,0 +1,105 @@
+"""Measure recall@k and latency of the IVF index against exact search.
+
+Vectors are drawn around random topic centres so the corpus has the kind
+of cluster structure real segment embeddings have.
+
+    python benchmarks/ann_recall.py --rows 200000 --nprobe 4 8 16 32
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.ann_index import IVFIndex, default_nlist
+
+
+def clustered_vectors(rng, rows, dim, topics):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_top_k(matrix, query, k):
+    scores = matrix @ query
+    k = min(k, len(scores))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--nlist', type=int, default=0, help='IVF cells (0 = about 4 * sqrt(rows))')
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32, 64])
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    matrix = clustered_vectors(rng, args.rows, args.dim, args.topics)
+    queries = matrix[rng.integers(0, args.rows, args.queries)] + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    index = IVFIndex.train(matrix, args.nlist or default_nlist(args.rows))
+    index.bind(np.arange(args.rows), index.assign(matrix))
+    build_seconds = time.perf_counter() - start
+
+    exact_latency = []
+    truth = []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(exact_top_k(matrix, query, args.k))
+        exact_latency.append(time.perf_counter() - start)
+
+    runs = []
+    for nprobe in args.nprobe:
+        latency = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            rows = index.candidates(query, nprobe)
+            ids = rows[exact_top_k(matrix[rows], query, args.k)]
+            latency.append(time.perf_counter() - start)
+            hits += len(np.intersect1d(ids, expected))
+        runs.append({
+            'nprobe': nprobe,
+            f'recall_at_{args.k}': hits / (args.k * args.queries),
+            'p50_ms': percentile_ms(latency, 50),
+            'p99_ms': percentile_ms(latency, 99),
+        })
+
+    results = {
+        'benchmark': 'ann_recall',
+        'rows': args.rows,
+        'dim': args.dim,
+        'k': args.k,
+        'nlist': index.nlist,
+        'build_seconds': build_seconds,
+        'exact': {'p50_ms': percentile_ms(exact_latency, 50), 'p99_ms': percentile_ms(exact_latency, 99)},
+        'ann': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
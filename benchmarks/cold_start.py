@@ -0,0 +1,128 @@
+"""Measure cold-start time of each app role (api, worker, cli).
+
+Every sample is a fresh Python process, which imports the app, runs
+create_app for the role and, for the api role, serves a first search by
+embedding. Times are reported for the import, create_app, the first
+request and the whole process, with its peak RSS and whether torch or
+transformers were imported.
+
+By default the model is not preloaded, as in a search-only API process
+(SEARCH_TEXT_QUERIES=0) or a CLI command. --preload times production
+startup with EMBEDDING_PRELOAD on, using --model (default: the configured
+EMBEDDING_MODEL, which may be downloaded on first use).
+
+    python benchmarks/cold_start.py --repeat 5 --preload
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import benchmark_config, emit, latency_summary, run_info
+
+ROLES = ('api', 'worker', 'cli')
+HEAVY_MODULES = ('torch', 'transformers', 'onnxruntime')
+
+
+def child(args):
+    """One cold start, run in a fresh process; prints its timings as JSON"""
+    start = time.perf_counter()
+    from app import create_app, db
+    import_seconds = time.perf_counter() - start
+
+    overrides = {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(os.getcwd(), 'cold_start.db')}",
+        'EMBEDDING_PRELOAD': args.preload,
+        'SEARCH_TEXT_QUERIES': args.preload,
+    }
+    if args.model:
+        overrides['EMBEDDING_MODEL'] = args.model
+    start = time.perf_counter()
+    app = create_app(benchmark_config(**overrides), role=args.child)
+    create_app_seconds = time.perf_counter() - start
+
+    results = {'import_seconds': import_seconds, 'create_app_seconds': create_app_seconds}
+    if args.child == 'api':
+        from app.models import APIToken
+
+        with app.app_context():
+            db.create_all()
+            db.session.add(APIToken(token='benchmark-token', name='benchmark'))
+            db.session.commit()
+        start = time.perf_counter()
+        response = app.test_client().post('/api/search', headers={'X-API-Token': 'benchmark-token'},
+                                          json={'embedding': [0.1] * args.dim})
+        results['first_request_seconds'] = time.perf_counter() - start
+        assert response.status_code == 200, response.get_json()
+
+    results['peak_rss_mib'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    results['heavy_modules'] = [name for name in HEAVY_MODULES if name in sys.modules]
+    print(json.dumps(results))
+
+
+def cold_start(role, args, directory):
+    """Run one cold start of ``role``; returns its timings and the process wall time"""
+    command = [sys.executable, os.path.abspath(__file__), '--child', role, '--dim', str(args.dim)]
+    if args.preload:
+        command.append('--preload')
+    if args.model:
+        command += ['--model', args.model]
+    start = time.perf_counter()
+    process = subprocess.run(command, cwd=directory, capture_output=True, text=True)
+    total_seconds = time.perf_counter() - start
+    if process.returncode != 0:
+        raise RuntimeError(f"{role} cold start failed:\n{process.stderr}")
+    results = json.loads(process.stdout.strip().splitlines()[-1])
+    results['total_seconds'] = total_seconds
+    return results
+
+
+def run(args):
+    roles = []
+    for role in args.roles:
+        samples = []
+        for _ in range(args.repeat):
+            # A new directory per sample, so no database or log is reused
+            with tempfile.TemporaryDirectory() as directory:
+                samples.append(cold_start(role, args, directory))
+        summary = {'role': role, 'heavy_modules': samples[-1]['heavy_modules']}
+        for key in ('total_seconds', 'import_seconds', 'create_app_seconds', 'first_request_seconds'):
+            if key in samples[0]:
+                timings = latency_summary([sample[key] for sample in samples])
+                summary[key.replace('_seconds', '')] = {name: timings[name] for name in ('p50_ms', 'max_ms')}
+        summary['peak_rss_mib'] = max(sample['peak_rss_mib'] for sample in samples)
+        roles.append(summary)
+    return roles
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--roles', nargs='+', choices=ROLES, default=list(ROLES))
+    parser.add_argument('--repeat', type=int, default=5, help='cold starts per role')
+    parser.add_argument('--preload', action='store_true', help='load and warm up the model (EMBEDDING_PRELOAD)')
+    parser.add_argument('--model', help='embedding model name or path for --preload')
+    parser.add_argument('--dim', type=int, default=384, help='length of the first search embedding')
+    parser.add_argument('--child', choices=ROLES, help=argparse.SUPPRESS)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.child:
+        child(args)
+        return
+
+    emit({
+        'benchmark': 'cold_start',
+        'repeat': args.repeat,
+        'preload': args.preload,
+        'model': args.model,
+        'run': run_info(),
+        'roles': run(args),
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
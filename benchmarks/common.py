@@ -0,0 +1,65 @@
+"""Helpers shared by the benchmark scripts."""
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+from config import Config
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    EMBEDDING_PRELOAD = False
+    EMBEDDING_CACHE_PATH = ''
+    INDEX_SNAPSHOT_DIR = ''
+    ANN_INDEX_PATH = ''
+    TESTING = True
+
+
+def benchmark_config(**overrides):
+    """BenchmarkConfig with some settings replaced"""
+    return type('BenchmarkConfig', (BenchmarkConfig,), overrides)
+
+
+def latency_summary(samples):
+    """Mean and percentiles of latencies given in seconds, in milliseconds"""
+    samples = np.asarray(samples, dtype=np.float64) * 1000
+    return {
+        'mean_ms': float(samples.mean()),
+        'p50_ms': float(np.percentile(samples, 50)),
+        'p90_ms': float(np.percentile(samples, 90)),
+        'p99_ms': float(np.percentile(samples, 99)),
+        'max_ms': float(samples.max()),
+    }
+
+
+def run_info():
+    """Where and on what code a benchmark ran, for comparing results"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+
+
+def emit(results, output=None):
+    """Print results as JSON and optionally write them to ``output``"""
+    text = json.dumps(results, indent=2)
+    print(text)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
@@ -0,0 +1,97 @@
+"""Compare two benchmark result files and flag regressions.
+
+Works on the output of any benchmark script or of run_suite.py. Numeric
+values are matched by their path in the JSON. List entries are matched by
+their mode, method, precision, database or role name. Names decide which way
+is better:
+- latencies (`*_ms`, `*seconds`) and sizes (`*bytes`, `*_mib`) should go down;
+- rates (`*qps`, `*per_second`) and `speedup`/`recall*` should go up;
+- other values are listed but not judged.
+
+Exits with status 1 if any judged value got worse by more than --tolerance.
+
+    python benchmarks/compare.py before.json after.json --tolerance 0.1
+"""
+import argparse
+import json
+import sys
+
+# Parts of the results that describe the run rather than measure it
+SKIPPED_KEYS = {'run', 'generated', 'error'}
+ENTRY_KEYS = ('mode', 'method', 'precision', 'database', 'role')
+LOWER_IS_BETTER = ('_ms', 'seconds', 'bytes', '_mib')
+HIGHER_IS_BETTER = ('qps', 'per_second', 'speedup', 'recall')
+
+
+def flatten(value, path=''):
+    """``{path: number}`` for every numeric leaf"""
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {path: value}
+    values = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key not in SKIPPED_KEYS:
+                values.update(flatten(item, f'{path}.{key}' if path else key))
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            name = next((str(item[key]) for key in ENTRY_KEYS if isinstance(item, dict) and key in item), str(i))
+            values.update(flatten(item, f'{path}[{name}]'))
+    return values
+
+
+def direction(path):
+    """-1 if lower is better, 1 if higher is better, 0 if unknown"""
+    name = path.rsplit('.', 1)[-1]
+    if any(marker in name for marker in HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+def compare(before, after, tolerance):
+    """Rows of ``(path, before, after, change, verdict)`` for the values in both files"""
+    before, after = flatten(before), flatten(after)
+    rows = []
+    for path in sorted(before.keys() & after.keys()):
+        old, new = before[path], after[path]
+        change = (new - old) / abs(old) if old else 0.0
+        better = direction(path)
+        if better == 0 or abs(change) <= tolerance:
+            verdict = ''
+        elif change * better > 0:
+            verdict = 'better'
+        else:
+            verdict = 'REGRESSION'
+        rows.append((path, old, new, change, verdict))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--tolerance', type=float, default=0.1, help='relative change ignored as noise')
+    parser.add_argument('--all', action='store_true', help='also list values that did not change much')
+    args = parser.parse_args()
+
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+
+    rows = compare(before, after, args.tolerance)
+    width = max([len(row[0]) for row in rows] + [4])
+    for path, old, new, change, verdict in rows:
+        if verdict or args.all:
+            print(f"{path:<{width}}  {old:>14.4g}  {new:>14.4g}  {change:>+8.1%}  {verdict}")
+    regressions = sum(1 for row in rows if row[4] == 'REGRESSION')
+    print(f"{len(rows)} values compared, {regressions} regressions beyond {args.tolerance:.0%}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Check parity and measure throughput of the embedding inference backends.
+
+Embeds the same synthetic segments through run_model with each
+EMBEDDING_BACKEND and compares every vector with the reference torch
+backend. The script exits non-zero if any backend's lowest cosine
+similarity falls below --min-cosine, so it doubles as a parity check.
+
+    python benchmarks/embedding_backends.py --texts 2000 --intra-op-threads 4
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from app.services.embedding_backends import EMBEDDING_BACKENDS
+
+WORDS = ('the podcast episode host guest talks about music science history politics startup '
+         'market interview story today week data model language learning climate energy city '
+         'football season team coach book author film review game design code open source').split()
+
+
+class BenchmarkConfig(Config):
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    EMBEDDING_PRELOAD = False
+    EMBEDDING_CACHE_PATH = ''
+    INDEX_SNAPSHOT_DIR = ''
+    TESTING = True
+
+
+def synthetic_texts(rng, count, max_words):
+    lengths = rng.integers(5, max_words, count)
+    return [' '.join(rng.choice(WORDS, length)) for length in lengths]
+
+
+def cosine_rows(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument('--texts', type=int, default=1000)
+    parser.add_argument('--max-words', type=int, default=150)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--intra-op-threads', type=int, default=0)
+    parser.add_argument('--inter-op-threads', type=int, default=0)
+    parser.add_argument('--onnx-path', help='exported model to use (default: export to a temporary file)')
+    parser.add_argument('--min-cosine', type=float, default=0.99)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    from app import create_app
+    from app.services import embedding_service
+
+    onnx_path = args.onnx_path or os.path.join(tempfile.mkdtemp(), 'embedding_model.onnx')
+    app = create_app(BenchmarkConfig)
+    app.config.update(EMBEDDING_ONNX_PATH=onnx_path,
+                      EMBEDDING_INTRA_OP_THREADS=args.intra_op_threads,
+                      EMBEDDING_INTER_OP_THREADS=args.inter_op_threads)
+    texts = synthetic_texts(np.random.default_rng(0), args.texts, args.max_words)
+
+    reference = None
+    runs = []
+    with app.app_context():
+        for backend in ['torch'] + [name for name in args.backends if name != 'torch']:
+            app.config['EMBEDDING_BACKEND'] = backend
+            embedding_service.backend = None
+            start = time.perf_counter()
+            embedding_service.load_model()
+            load_seconds = time.perf_counter() - start
+            embedding_service.run_model(texts[:args.batch_size], args.batch_size)
+
+            start = time.perf_counter()
+            embeddings = embedding_service.run_model(texts, args.batch_size)
+            seconds = time.perf_counter() - start
+
+            if reference is None:
+                reference = embeddings
+            similarity = cosine_rows(embeddings, reference)
+            if backend in args.backends:
+                runs.append({
+                    'backend': backend,
+                    'load_seconds': load_seconds,
+                    'texts_per_second': len(texts) / seconds,
+                    'min_cosine': float(similarity.min()),
+                    'mean_cosine': float(similarity.mean()),
+                    'parity_ok': bool(similarity.min() > args.min_cosine),
+                })
+
+    results = {
+        'benchmark': 'embedding_backends',
+        'model': BenchmarkConfig.EMBEDDING_MODEL,
+        'texts': args.texts,
+        'batch_size': args.batch_size,
+        'intra_op_threads': args.intra_op_threads,
+        'inter_op_threads': args.inter_op_threads,
+        'min_cosine': args.min_cosine,
+        'runs': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if not all(run['parity_ok'] for run in runs):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""Compare JSON text and binary float32 storage for segment embeddings.
+
+Writes the same random vectors into two SQLite tables, then reports the
+on-disk table size and how fast each format decodes back into numpy.
+
+    python benchmarks/embedding_storage.py --rows 100000 --dim 384
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.models import encode_embedding, decode_embedding
+
+
+def table_bytes(conn, table):
+    """Bytes used by a table's pages, via the dbstat virtual table"""
+    try:
+        return conn.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = ?', (table,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return conn.execute(f'SELECT SUM(LENGTH(embedding)) FROM {table}').fetchone()[0]
+
+
+def time_decode(conn, table, decode):
+    start = time.perf_counter()
+    count = 0
+    for (raw,) in conn.execute(f'SELECT embedding FROM {table}'):
+        decode(raw)
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    vectors = np.random.default_rng(0).standard_normal((args.rows, args.dim)).astype(np.float32)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, 'bench.db'))
+        conn.execute('CREATE TABLE json_segment (id INTEGER PRIMARY KEY, embedding TEXT)')
+        conn.execute('CREATE TABLE binary_segment (id INTEGER PRIMARY KEY, embedding BLOB)')
+        conn.executemany('INSERT INTO json_segment (embedding) VALUES (?)',
+                         ((json.dumps(v.astype(np.float64).tolist()),) for v in vectors))
+        conn.executemany('INSERT INTO binary_segment (embedding) VALUES (?)',
+                         ((encode_embedding(v),) for v in vectors))
+        conn.commit()
+
+        results = {
+            'benchmark': 'embedding_storage',
+            'rows': args.rows,
+            'dim': args.dim,
+            'json': {
+                'table_bytes': table_bytes(conn, 'json_segment'),
+                'decode_rows_per_sec': time_decode(conn, 'json_segment',
+                                                   lambda raw: np.array(json.loads(raw))),
+            },
+            'binary': {
+                'table_bytes': table_bytes(conn, 'binary_segment'),
+                'decode_rows_per_sec': time_decode(conn, 'binary_segment', decode_embedding),
+            },
+        }
+        conn.close()
+
+    results['size_ratio'] = results['json']['table_bytes'] / results['binary']['table_bytes']
+    results['decode_speedup'] = results['binary']['decode_rows_per_sec'] / results['json']['decode_rows_per_sec']
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Measure memory, latency and recall@k of the search index precisions.
+
+Each precision is scored the way SegmentIndex scores it, against the same
+clustered vectors, and compared with the float32 top-k. The "+rescore"
+rows re-rank ``k * factor`` candidates with the float32 vectors, as
+INDEX_RESCORE_FACTOR does with the stored embeddings.
+
+    python benchmarks/index_precision.py --rows 200000 --k 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.services.segment_index import INDEX_PRECISIONS, quantize, score_rows, top_matches
+
+
+def clustered_vectors(rng, rows, dim, topics):
+    centres = rng.standard_normal((topics, dim)).astype(np.float32)
+    vectors = centres[rng.integers(0, topics, rows)] + 0.6 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile_ms(samples, q):
+    return float(np.percentile(samples, q) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = clustered_vectors(rng, args.rows, args.dim, args.topics)
+    ids = np.arange(args.rows, dtype=np.int64)
+    queries = vectors[rng.integers(0, args.rows, args.queries)] \
+        + 0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    truth = [top_matches(ids, vectors @ query, -np.inf, args.k)[0] for query in queries]
+
+    runs = []
+    for precision in INDEX_PRECISIONS:
+        matrix, scales = quantize(vectors, precision)
+        memory = matrix.nbytes + (scales.nbytes if scales is not None else 0)
+        for rescore in ([False, True] if precision != 'float32' else [False]):
+            latency = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                scores = score_rows(matrix, scales, query)
+                if rescore:
+                    candidates, _ = top_matches(ids, scores, -np.inf, args.k * args.rescore_factor)
+                    found, _ = top_matches(candidates, vectors[candidates] @ query, -np.inf, args.k)
+                else:
+                    found, _ = top_matches(ids, scores, -np.inf, args.k)
+                latency.append(time.perf_counter() - start)
+                hits += len(np.intersect1d(found, expected))
+            runs.append({
+                'precision': precision + ('+rescore' if rescore else ''),
+                'vector_bytes': int(memory),
+                'bytes_per_vector': memory / args.rows,
+                f'recall_at_{args.k}': hits / (args.k * args.queries),
+                'p50_ms': percentile_ms(latency, 50),
+                'p99_ms': percentile_ms(latency, 99),
+            })
+
+    results = {
+        'benchmark': 'index_precision',
+        'rows': args.rows,
+        'dim': args.dim,
+        'k': args.k,
+        'rescore_factor': args.rescore_factor,
+        'runs': runs,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
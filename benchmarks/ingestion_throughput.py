@@ -0,0 +1,227 @@
+"""Measure ingestion throughput: fetch -> segment -> embed -> persist.
+
+Episodes are fetched from a stub Listen Notes server running in this
+process. It serves word-timed transcripts of --words-per-episode made-up
+words. They are embedded by a tiny randomly initialised BERT, built in a
+temporary directory so nothing is downloaded. Pass --model to use a real
+model instead. The whole IngestionEngine pipeline runs against a
+temporary SQLite database. Model loading is timed separately.
+
+The time spent embedding, fetching and committing is read from the
+process metrics. Fetch time is summed over concurrent requests, so it can
+exceed the wall time. A second run over the same episodes measures the
+unchanged-transcript path.
+
+    python benchmarks/ingestion_throughput.py --episodes 200 --words-per-episode 3000
+"""
+import argparse
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from common import benchmark_config, emit, run_info
+import synthetic
+
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+
+
+def transcript_payloads(episodes, words_per_episode, seed=0):
+    """Details and word-timed transcript JSON for each stub episode"""
+    rng = np.random.default_rng(seed)
+    words = synthetic.vocabulary(seed=seed)
+    payloads = {}
+    for i in range(episodes):
+        text = synthetic.random_texts(rng, words, 1, words_per_episode, words_per_episode)[0].split()
+        transcript = {'words': [
+            {'word': word + ('.' if n % 15 == 14 else ''), 'start': n * 0.4, 'end': n * 0.4 + 0.35}
+            for n, word in enumerate(text)
+        ]}
+        details = {'title': f'Stub episode {i}', 'audio_length_sec': int(words_per_episode * 0.4),
+                   'pub_date_ms': 1700000000000 + i * 86400000}
+        payloads[f'stub-episode-{i}'] = (json.dumps(details).encode(), json.dumps(transcript).encode())
+    return payloads
+
+
+def start_stub_server(payloads):
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = re.match(r'^/episodes/([^/]+)(/transcript)?$', self.path)
+            if match is None or match.group(1) not in payloads:
+                self.send_error(404)
+                return
+            body = payloads[match.group(1)][1 if match.group(2) else 0]
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='stub-listennotes', daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+
+def build_tiny_model(directory, seed=0):
+    """A small random BERT and a WordPiece vocabulary of the synthetic words"""
+    import torch
+    from transformers import BertConfig, BertModel, BertTokenizerFast
+
+    os.makedirs(directory, exist_ok=True)
+    vocab_path = os.path.join(directory, 'vocab.txt')
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(SPECIAL_TOKENS + ['.'] + synthetic.vocabulary(seed=seed)) + '\n')
+    tokenizer = BertTokenizerFast(vocab_file=vocab_path)
+    tokenizer.save_pretrained(directory)
+
+    torch.manual_seed(seed)
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=64, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=128, max_position_embeddings=512)
+    BertModel(config).save_pretrained(directory)
+    return directory
+
+
+def histogram_totals(histogram):
+    """``(sum, count)`` of a histogram over all its label values"""
+    total = count = 0
+    for suffix, _, value in histogram.samples():
+        if suffix == '_sum':
+            total += value
+        elif suffix == '_count':
+            count += value
+    return total, count
+
+
+def phase_totals():
+    from app.services import metrics
+
+    return {
+        'embedding': histogram_totals(metrics.embedding_batch_seconds),
+        'listennotes': histogram_totals(metrics.listennotes_request_seconds),
+        'commit': histogram_totals(metrics.db_commit_seconds),
+    }
+
+
+def ingest(app, shows):
+    """Run one ingestion over ``shows``; returns the progress, seconds and phase times"""
+    from app.services.ingestion import IngestionEngine
+
+    before = phase_totals()
+    start = time.perf_counter()
+    progress = IngestionEngine(app).run(shows)
+    seconds = time.perf_counter() - start
+    after = phase_totals()
+    phases = {
+        f'{name}_seconds': after[name][0] - before[name][0] for name in after
+    }
+    phases['embedding_batches'] = after['embedding'][1] - before['embedding'][1]
+    return progress, seconds, phases
+
+
+def run(args, directory, model):
+    from app import create_app, db
+    from app.models import Episode, Segment, Show
+    from app.services.embedding_service import load_model, load_tokenizer
+    from app.services.segment_index import segment_index
+
+    payloads = transcript_payloads(args.episodes, args.words_per_episode, args.seed)
+    server, url = start_stub_server(payloads)
+    app = create_app(benchmark_config(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(directory, 'ingestion.db')}",
+        LISTENNOTES_API_BASE_URL=url,
+        LISTENNOTES_RATE_LIMIT=0,
+        EMBEDDING_MODEL=model,
+        EMBEDDING_BACKEND=args.backend,
+        EMBEDDING_ONNX_PATH=os.path.join(directory, 'model.onnx'),
+        EMBEDDING_BATCH_SIZE=args.batch_size,
+        EMBEDDING_CACHE_SIZE=0,
+        INGESTION_CONCURRENCY=args.concurrency,
+    ))
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            load_tokenizer()
+            load_model()
+            model_load_seconds = time.perf_counter() - start
+
+            shows = [Show(listennotes_id=f'stub-show-{i}', title=f'Stub show {i}')
+                     for i in range(-(-args.episodes // 50))]
+            db.session.add_all(shows)
+            db.session.flush()
+            db.session.add_all([
+                Episode(listennotes_id=episode_id, show_id=shows[i // 50].id, title=episode_id)
+                for i, episode_id in enumerate(payloads)
+            ])
+            db.session.commit()
+            segment_index.load()
+
+            progress, seconds, phases = ingest(app, shows)
+            segments = db.session.query(Segment.id).count()
+
+            Episode.query.update({'transcript_status': 'pending'})
+            db.session.commit()
+            rerun, rerun_seconds, _ = ingest(app, shows)
+            db.engine.dispose()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        'model_load_seconds': model_load_seconds,
+        'first_run': dict({
+            'seconds': seconds,
+            'completed': progress.completed,
+            'failed': progress.failed,
+            'segments': segments,
+            'episodes_per_second': progress.completed / seconds,
+            'segments_per_second': segments / seconds,
+            'words_per_second': progress.completed * args.words_per_episode / seconds,
+        }, **phases),
+        'unchanged_run': {
+            'seconds': rerun_seconds,
+            'unchanged': rerun.unchanged,
+            'episodes_per_second': rerun.unchanged / rerun_seconds,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--episodes', type=int, default=100)
+    parser.add_argument('--words-per-episode', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--backend', default='torch', help='EMBEDDING_BACKEND to embed with')
+    parser.add_argument('--model', help='model name or path (default: a tiny random BERT)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        model = args.model or build_tiny_model(os.path.join(directory, 'model'), args.seed)
+        results = run(args, directory, model)
+
+    emit(dict({
+        'benchmark': 'ingestion_throughput',
+        'episodes': args.episodes,
+        'words_per_episode': args.words_per_episode,
+        'concurrency': args.concurrency,
+        'batch_size': args.batch_size,
+        'backend': args.backend,
+        'model': args.model or 'tiny-random-bert',
+        'run': run_info(),
+    }, **results), args.output)
+
+
+if __name__ == '__main__':
+    main()
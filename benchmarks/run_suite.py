@@ -0,0 +1,97 @@
+"""Run the search and ingestion benchmarks at one scale into a single JSON file.
+
+The scale sets the size of the synthetic corpus searched and the number of
+episodes ingested. Each scale is about ten times the one before:
+
+    small    10k segments, 50 episodes
+    medium   100k segments, 200 episodes
+    large    1M segments, 500 episodes
+    xlarge   10M segments, 1000 episodes (int8 index)
+
+The corpus is generated once into a temporary SQLite database, unless
+--database-url names one to reuse. Each benchmark then runs in its own
+process, so one can't warm caches for the next. Compare two result files
+with compare.py:
+
+    python benchmarks/run_suite.py --scale medium --output before.json
+    python benchmarks/compare.py before.json after.json
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from common import emit, run_info
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCALES = {
+    'small': {'segments': 10000, 'episodes': 50, 'precision': 'float32'},
+    'medium': {'segments': 100000, 'episodes': 200, 'precision': 'float32'},
+    'large': {'segments': 1000000, 'episodes': 500, 'precision': 'float32'},
+    'xlarge': {'segments': 10000000, 'episodes': 1000, 'precision': 'int8'},
+}
+
+BENCHMARKS = ('search_latency', 'search_qps', 'ingestion_throughput', 'cold_start')
+
+
+def benchmark_args(name, scale, args, database_url):
+    if name == 'search_latency':
+        return ['--database-url', database_url, '--precision', args.precision or scale['precision'],
+                '--queries', str(args.queries)]
+    if name == 'search_qps':
+        return ['--database-url', database_url, '--queries', str(args.queries)]
+    if name == 'cold_start':
+        return []
+    extra = ['--model', args.model] if args.model else []
+    return ['--episodes', str(scale['episodes'])] + extra
+
+
+def run_benchmark(name, arguments, directory):
+    """Run one benchmark script, returning its results or the error it failed with"""
+    output = os.path.join(directory, f'{name}.json')
+    command = [sys.executable, os.path.join(HERE, f'{name}.py'), '--output', output] + arguments
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0 or not os.path.exists(output):
+        return {'error': process.stderr.strip().splitlines()[-20:]}
+    with open(output) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small')
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--database-url', help='reuse this synthetic corpus (see synthetic.py)')
+    parser.add_argument('--precision', help="INDEX_PRECISION for search (default: the scale's)")
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--model', help='embedding model for ingestion (default: a tiny random BERT)')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        database_url = args.database_url
+        if database_url is None and any(name.startswith('search') for name in args.only):
+            database_url = f"sqlite:///{os.path.join(directory, 'corpus.db')}"
+            results['synthetic'] = run_benchmark(
+                'synthetic', ['--database-url', database_url, '--segments', str(scale['segments'])], directory)
+        for name in args.only:
+            print(f"Running {name} ({args.scale})", file=sys.stderr)
+            results[name] = run_benchmark(name, benchmark_args(name, scale, args, database_url), directory)
+
+    emit({
+        'benchmark': 'suite',
+        'scale': args.scale,
+        'run': run_info(),
+        'results': results,
+    }, args.output)
+    if any('error' in result for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Measure find_similar_segments latency percentiles on a synthetic corpus.
+
+Each mode is timed over the same queries after a few warm-up calls:
+"exact" scans the whole index, "ann" uses the IVF index (trained up front,
+whatever the corpus size) and "hybrid" fuses BM25 keyword scores with
+vector similarity. Index load and build times are reported too.
+
+A temporary SQLite database is filled with --segments rows unless
+--database-url points at one filled before (see synthetic.py).
+
+    python benchmarks/search_latency.py --segments 1000000 --precision int8
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import benchmark_config, emit, latency_summary, run_info
+import synthetic
+
+
+def time_queries(search, vectors, texts, warmup):
+    for vector, text in list(zip(vectors, texts))[:warmup]:
+        search(vector, text)
+    latency = []
+    found = 0
+    for vector, text in zip(vectors, texts):
+        start = time.perf_counter()
+        results = search(vector, text)
+        latency.append(time.perf_counter() - start)
+        found += len(results)
+    return latency, found
+
+
+def run(args, database_url):
+    from app import create_app, db
+    from app.models import Segment, decode_embedding
+    from app.services.embedding_service import find_hybrid_segments, find_similar_segments
+    from app.services.lexical_index import lexical_index
+    from app.services.segment_index import segment_index
+
+    app = create_app(benchmark_config(
+        SQLALCHEMY_DATABASE_URI=database_url,
+        INDEX_PRECISION=args.precision,
+        ANN_MIN_SEGMENTS=0,
+    ))
+    with app.app_context():
+        population = synthetic.ensure_populated(db, args.segments, args.dim, args.topics, args.seed)
+        segments = db.session.query(Segment.id).count()
+
+        start = time.perf_counter()
+        segment_index.load()
+        timings = {'index_load_seconds': time.perf_counter() - start}
+        # A reused database may hold vectors of another size than --dim
+        dim = len(decode_embedding(db.session.query(Segment.embedding).limit(1).scalar()))
+        vectors, texts = synthetic.queries(args.queries, dim, args.topics, args.seed)
+
+        runs = []
+        for mode in args.modes:
+            if mode == 'ann':
+                start = time.perf_counter()
+                segment_index.train_ann()
+                timings['ann_build_seconds'] = time.perf_counter() - start
+
+                def search(vector, text):
+                    return find_similar_segments(vector, args.threshold, args.limit, exact=False)
+            elif mode == 'hybrid':
+                start = time.perf_counter()
+                lexical_index.load()
+                timings['lexical_load_seconds'] = time.perf_counter() - start
+
+                def search(vector, text):
+                    return find_hybrid_segments([text], [vector], [args.threshold], [args.limit])[0]
+            else:
+                def search(vector, text):
+                    return find_similar_segments(vector, args.threshold, args.limit)
+
+            latency, found = time_queries(search, vectors, texts, args.warmup)
+            runs.append(dict({'mode': mode, 'avg_results': found / args.queries}, **latency_summary(latency)))
+        db.engine.dispose()
+
+    return {
+        'segments': segments,
+        'generated': population,
+        'index_bytes': segment_index.nbytes,
+        'timings': timings,
+        'runs': runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=0.0)
+    parser.add_argument('--precision', default='float32')
+    parser.add_argument('--modes', nargs='+', default=['exact', 'ann', 'hybrid'],
+                        choices=['exact', 'ann', 'hybrid'])
+    parser.add_argument('--database-url', help='use this database, filling it only if empty')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        results = run(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, f"sqlite:///{os.path.join(directory, 'search.db')}")
+
+    emit(dict({
+        'benchmark': 'search_latency',
+        'precision': args.precision,
+        'queries': args.queries,
+        'limit': args.limit,
+        'threshold': args.threshold,
+        'run': run_info(),
+    }, **results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Compare query throughput of /api/search against /api/search/batch.
+
+Runs the API in-process through Flask's test client over a synthetic
+corpus (see synthetic.py), so the numbers include token lookup, JSON
+handling and the ORM fetch of matched segments.
+
+    python benchmarks/search_qps.py --segments 100000 --queries 500 --batch-size 100
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from common import benchmark_config, emit, latency_summary, run_info
+import synthetic
+
+
+def run(args, database_url):
+    from app import create_app, db
+    from app.models import APIToken, Segment, decode_embedding
+    from app.services.segment_index import segment_index
+    from app.services.token_service import usage_recorder
+
+    app = create_app(benchmark_config(SQLALCHEMY_DATABASE_URI=database_url))
+    with app.app_context():
+        synthetic.ensure_populated(db, args.segments, args.dim, args.topics, args.seed)
+        if APIToken.query.filter_by(token='benchmark-token').first() is None:
+            db.session.add(APIToken(token='benchmark-token', name='benchmark'))
+            db.session.commit()
+        segment_index.load()
+        segments = len(segment_index)
+        dim = len(decode_embedding(db.session.query(Segment.embedding).limit(1).scalar()))
+
+    vectors, _ = synthetic.queries(args.queries, dim, args.topics, args.seed)
+    payloads = [{'embedding': vector.tolist(), 'limit': args.limit, 'threshold': 0.0} for vector in vectors]
+    client = app.test_client()
+    headers = {'X-API-Token': 'benchmark-token'}
+
+    latency = []
+    start = time.perf_counter()
+    for payload in payloads:
+        request_start = time.perf_counter()
+        response = client.post('/api/search', json=payload, headers=headers)
+        latency.append(time.perf_counter() - request_start)
+        assert response.status_code == 200, response.get_json()
+    single_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for offset in range(0, len(payloads), args.batch_size):
+        response = client.post('/api/search/batch', headers=headers,
+                               json={'queries': payloads[offset:offset + args.batch_size]})
+        assert response.status_code == 200, response.get_json()
+    batch_seconds = time.perf_counter() - start
+
+    with app.app_context():
+        # Write token usage now rather than at exit, after a temporary database is gone
+        usage_recorder.flush()
+        db.engine.dispose()
+    return {
+        'segments': segments,
+        'single_qps': args.queries / single_seconds,
+        'batch_qps': args.queries / batch_seconds,
+        'speedup': single_seconds / batch_seconds,
+        'single_latency': latency_summary(latency),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--limit', type=int, default=5)
+    parser.add_argument('--database-url', help='use this database, filling it only if empty')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    if args.database_url:
+        results = run(args, args.database_url)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            results = run(args, f"sqlite:///{os.path.join(directory, 'search.db')}")
+
+    emit(dict({
+        'benchmark': 'search_qps',
+        'queries': args.queries,
+        'batch_size': args.batch_size,
+        'run': run_info(),
+    }, **results), args.output)
+
+
+if __name__ == '__main__':
+    main()
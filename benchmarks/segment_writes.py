@@ -0,0 +1,171 @@
+"""Measure segment write throughput of the ORM and the bulk write paths.
+
+"orm" adds one Segment object per row and flushes them together, as
+store_segments used to. "executemany" and "copy" go through
+insert_segments in chunks of --chunk rows; "copy" only runs against
+PostgreSQL with psycopg2. Each method is run once for rows/sec and once
+under tracemalloc for peak Python memory.
+
+SQLite uses a temporary file. --postgres-url should point at a scratch
+database: the tables are created if missing and the benchmark's rows are
+deleted afterwards.
+
+    python benchmarks/segment_writes.py --rows 100000 --chunk 1000
+    python benchmarks/segment_writes.py --postgres-url postgresql://localhost/podcast_bench
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+
+
+class BenchmarkConfig(Config):
+    EMBEDDING_PRELOAD = False
+    EMBEDDING_CACHE_PATH = ''
+    INDEX_SNAPSHOT_DIR = ''
+    TESTING = True
+
+
+def segment_rows(episode_id, rows, dim, rng):
+    # A small pool of vectors keeps the generator itself out of the memory figures
+    pool = rng.standard_normal((256, dim)).astype(np.float32)
+    for i in range(rows):
+        yield {
+            'episode_id': episode_id,
+            'start_time': i * 15,
+            'end_time': i * 15 + 15,
+            'text': f'benchmark segment {i} ' + 'lorem ipsum dolor sit amet ' * 10,
+            'text_hash': f'{i:064x}',
+            'embedding': pool[i % len(pool)],
+        }
+
+
+def write_orm(db, rows):
+    from app.models import Segment
+
+    segments = []
+    for row in rows:
+        segment = Segment(episode_id=row['episode_id'], start_time=row['start_time'], end_time=row['end_time'],
+                          text=row['text'], text_hash=row['text_hash'])
+        segment.set_embedding(row['embedding'])
+        db.session.add(segment)
+        segments.append(segment)
+    db.session.flush()
+    ids = [segment.id for segment in segments]
+    db.session.commit()
+    return ids
+
+
+def write_bulk(db, rows):
+    from app.services.bulk_writer import insert_segments
+
+    ids = insert_segments(rows)
+    db.session.commit()
+    return ids
+
+
+def run_method(app, db, episode_id, method, args):
+    from app.models import Segment
+
+    app.config['INGESTION_WRITE_CHUNK'] = args.chunk
+    app.config['INGESTION_USE_COPY'] = method == 'copy'
+    write = write_orm if method == 'orm' else write_bulk
+
+    result = {'method': method}
+    for measure_memory in (False, True):
+        rows = segment_rows(episode_id, args.rows, args.dim, np.random.default_rng(0))
+        if measure_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        ids = write(db, rows)
+        seconds = time.perf_counter() - start
+        if measure_memory:
+            result['peak_mib'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        else:
+            result['seconds'] = seconds
+            result['rows_per_second'] = args.rows / seconds
+        assert len(ids) == args.rows
+        # Drop the rows again so every method writes into the same table size
+        db.session.query(Segment).filter(Segment.episode_id == episode_id).delete(synchronize_session=False)
+        db.session.commit()
+        db.session.expunge_all()
+    return result
+
+
+def run_database(url, methods, args):
+    from app import create_app, db
+    from app.models import Episode, Show
+    from app.services.bulk_writer import supports_copy
+
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = url
+    app = create_app(BenchmarkConfig)
+    with app.app_context():
+        db.create_all()
+        show = Show(listennotes_id=f'benchmark-show-{os.getpid()}', title='Benchmark show')
+        db.session.add(show)
+        db.session.flush()
+        episode = Episode(listennotes_id=f'benchmark-episode-{os.getpid()}', show_id=show.id, title='Episode')
+        db.session.add(episode)
+        db.session.commit()
+        episode_id, show_id = episode.id, show.id
+        dialect = db.engine.dialect.name
+
+        runs = []
+        try:
+            for method in methods:
+                if method == 'copy' and not supports_copy():
+                    continue
+                runs.append(run_method(app, db, episode_id, method, args))
+        finally:
+            db.session.rollback()
+            db.session.query(Episode).filter(Episode.id == episode_id).delete(synchronize_session=False)
+            db.session.query(Show).filter(Show.id == show_id).delete(synchronize_session=False)
+            db.session.commit()
+            db.engine.dispose()
+    return {'database': dialect, 'runs': runs}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--chunk', type=int, default=1000, help='rows per bulk write (INGESTION_WRITE_CHUNK)')
+    parser.add_argument('--methods', nargs='+', default=['orm', 'executemany', 'copy'],
+                        choices=['orm', 'executemany', 'copy'])
+    parser.add_argument('--postgres-url', help='also run against this PostgreSQL database')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    databases = []
+    with tempfile.TemporaryDirectory() as directory:
+        databases.append(run_database(f"sqlite:///{os.path.join(directory, 'segments.db')}", args.methods, args))
+    if args.postgres_url:
+        databases.append(run_database(args.postgres_url, args.methods, args))
+
+    results = {
+        'benchmark': 'segment_writes',
+        'rows': args.rows,
+        'dim': args.dim,
+        'chunk': args.chunk,
+        'databases': databases,
+    }
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
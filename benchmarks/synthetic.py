@@ -0,0 +1,160 @@
+"""Fill a database with synthetic shows, episodes and segments.
+
+Segment embeddings are random unit vectors clustered around ``topics``
+centres, so nearest-neighbour searches and the IVF index behave as they
+would on real content, and segment texts are drawn from a fixed made-up
+vocabulary so keyword search has something to match. Everything derives
+from ``seed``, so the same arguments always produce the same corpus.
+
+The benchmarks call ``populate`` on a temporary database. Run this script
+to fill one database once and reuse it across runs with --database-url:
+
+    python benchmarks/synthetic.py --database-url sqlite:///bench.db --segments 1000000
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+
+from common import benchmark_config, emit
+
+SEGMENTS_PER_EPISODE = 100
+EPISODES_PER_SHOW = 100
+
+
+def vocabulary(size=5000, seed=0):
+    """Pronounceable made-up words, the same ones for a given seed"""
+    rng = np.random.default_rng(seed)
+    consonants = list('bdfgklmnprstvz')
+    vowels = list('aeiou')
+    words = set()
+    while len(words) < size:
+        syllables = rng.integers(2, 4)
+        words.add(''.join(rng.choice(consonants) + rng.choice(vowels) for _ in range(syllables)))
+    return sorted(words)
+
+
+def topic_centres(dim, topics, seed=0):
+    return np.random.default_rng(seed).standard_normal((topics, dim)).astype(np.float32)
+
+
+def clustered_vectors(rng, centres, count, noise=0.6):
+    """Unit vectors scattered around randomly chosen centres"""
+    vectors = centres[rng.integers(0, len(centres), count)] \
+        + noise * rng.standard_normal((count, centres.shape[1])).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def random_texts(rng, words, count, min_words=20, max_words=60):
+    # Zipf-like word frequencies, as in natural text
+    weights = 1.0 / np.arange(1, len(words) + 1)
+    weights /= weights.sum()
+    lengths = rng.integers(min_words, max_words + 1, count)
+    picks = rng.choice(len(words), size=int(lengths.sum()), p=weights)
+    texts = []
+    offset = 0
+    for length in lengths:
+        texts.append(' '.join(words[i] for i in picks[offset:offset + length]))
+        offset += length
+    return texts
+
+
+def queries(count, dim, topics=500, seed=0):
+    """``(vectors, texts)`` for search queries resembling the corpus"""
+    rng = np.random.default_rng(seed + 1)
+    vectors = clustered_vectors(rng, topic_centres(dim, topics, seed), count)
+    return vectors, random_texts(rng, vocabulary(seed=seed), count, 2, 5)
+
+
+def populate(db, segments, dim=384, topics=500, seed=0, chunk=10000):
+    """Insert ``segments`` segments with their episodes and shows.
+
+    Rows are generated and inserted ``chunk`` at a time, each chunk in its
+    own transaction, so memory stays flat however large the corpus is.
+    Returns the row counts and the time taken.
+    """
+    from app.models import Episode, Segment, Show, encode_embedding
+
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    centres = topic_centres(dim, topics, seed)
+    words = vocabulary(seed=seed)
+
+    episode_count = max(1, -(-segments // SEGMENTS_PER_EPISODE))
+    show_count = max(1, -(-episode_count // EPISODES_PER_SHOW))
+    db.session.execute(db.insert(Show), [
+        {'listennotes_id': f'synthetic-show-{i}', 'title': f'Synthetic show {i}'}
+        for i in range(show_count)
+    ])
+    show_ids = [show_id for show_id, in db.session.query(Show.id).order_by(Show.id)]
+
+    # Publish dates spread over five years before 2024
+    first = 1546300800
+    published = first + rng.integers(0, 5 * 365 * 86400, episode_count)
+    for offset in range(0, episode_count, chunk):
+        db.session.execute(db.insert(Episode), [
+            {'listennotes_id': f'synthetic-episode-{i}', 'show_id': show_ids[i // EPISODES_PER_SHOW],
+             'title': f'Synthetic episode {i}', 'transcript_status': 'completed',
+             'published_at': datetime.datetime.utcfromtimestamp(int(published[i]))}
+            for i in range(offset, min(offset + chunk, episode_count))
+        ])
+    db.session.commit()
+    episode_ids = np.array([episode_id for episode_id, in db.session.query(Episode.id).order_by(Episode.id)])
+
+    for offset in range(0, segments, chunk):
+        count = min(chunk, segments - offset)
+        vectors = clustered_vectors(rng, centres, count)
+        texts = random_texts(rng, words, count)
+        db.session.execute(db.insert(Segment), [
+            {'episode_id': int(episode_ids[(offset + i) // SEGMENTS_PER_EPISODE]),
+             'start_time': ((offset + i) % SEGMENTS_PER_EPISODE) * 30,
+             'end_time': ((offset + i) % SEGMENTS_PER_EPISODE) * 30 + 30,
+             'text': text, 'embedding': encode_embedding(vector)}
+            for i, (text, vector) in enumerate(zip(texts, vectors))
+        ])
+        db.session.commit()
+
+    return {
+        'shows': show_count,
+        'episodes': episode_count,
+        'segments': segments,
+        'seconds': time.perf_counter() - started,
+    }
+
+
+def ensure_populated(db, segments, dim=384, topics=500, seed=0):
+    """Populate an empty database; reuse one that already holds segments.
+
+    Returns the population stats, or None for a reused database.
+    """
+    from app.models import Segment
+
+    db.create_all()
+    if db.session.query(Segment.id).first() is not None:
+        return None
+    return populate(db, segments, dim, topics, seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', required=True)
+    parser.add_argument('--segments', type=int, default=100000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--topics', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results as JSON to this file')
+    args = parser.parse_args()
+
+    from app import create_app, db
+
+    app = create_app(benchmark_config(SQLALCHEMY_DATABASE_URI=args.database_url))
+    with app.app_context():
+        stats = ensure_populated(db, args.segments, args.dim, args.topics, args.seed)
+    if stats is None:
+        raise SystemExit(f"{args.database_url} already holds segments")
+    emit(dict({'benchmark': 'synthetic'}, **stats), args.output)
+
+
+if __name__ == '__main__':
+    main()
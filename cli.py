@@ -1,6 +1,7 @@
 from flask.cli import FlaskGroup
 from dotenv import load_dotenv
 import os
+import sys
 
 # Load environment variables from .env file
 load_dotenv()
@@ -8,6 +9,10 @@ load_dotenv()
 # Set FLASK_APP environment variable
 os.environ['FLASK_APP'] = 'podcast_service.py'
 
+# Pick the app role from the command
+from app import command_role
+os.environ.setdefault('APP_ROLE', command_role(sys.argv[1:]))
+
 from podcast_service import app
 
 cli = FlaskGroup(app)
@@ -7,27 +7,94 @@ load_dotenv(os.path.join(basedir, '.env'))
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-key-please-change'
+    APP_ROLE = os.environ.get('APP_ROLE', 'api')  # 'api' (web + API), 'worker' (job queue) or 'cli' (commands only)
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'podcast.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    QUERY_COUNT_HEADER = os.environ.get('QUERY_COUNT_HEADER', '0') == '1'  # add X-Query-Count to responses
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'  # serve Prometheus metrics at /metrics
+    PROFILER_ENABLED = os.environ.get('PROFILER_ENABLED', '0') == '1'  # profile requests sent with X-Profile: 1
+    PROFILER_INTERVAL = 0.001  # seconds between pyinstrument samples
+    
+    # API listing pagination
+    API_PAGE_SIZE = 100
+    API_MAX_PAGE_SIZE = 1000
+    API_STREAM_BATCH_SIZE = 1000  # rows fetched per round trip in NDJSON mode
+    
+    # API token bookkeeping
+    TOKEN_CACHE_TTL = 30  # seconds a token lookup is trusted; other workers see status changes after this
+    TOKEN_USAGE_FLUSH_INTERVAL = 10  # seconds between batched usage count writes
     
     # ListenNotes API Configuration
     LISTENNOTES_API_KEY = os.environ.get('LISTENNOTES_API_KEY')
     LISTENNOTES_API_BASE_URL = 'https://listen-api.listennotes.com/api/v2'
+    LISTENNOTES_RATE_LIMIT = float(os.environ.get('LISTENNOTES_RATE_LIMIT', 5))  # requests/sec, 0 = unlimited
+    LISTENNOTES_CONNECT_TIMEOUT = 5  # seconds
+    LISTENNOTES_READ_TIMEOUT = 30  # seconds
+    LISTENNOTES_MAX_RETRIES = 4
+    LISTENNOTES_BACKOFF_BASE = 0.5  # seconds, doubled per retry
+    LISTENNOTES_BACKOFF_MAX = 30  # seconds, also caps Retry-After
+    LISTENNOTES_POOL_SIZE = int(os.environ.get('INGESTION_CONCURRENCY', 8))  # keep-alive connections
     
-    # Scheduler Configuration
-    SCHEDULER_API_ENABLED = True
-    SCHEDULER_TIMEZONE = "UTC"
-    
-    # Update schedule (default: every day at midnight UTC)
+    # Update schedule: job workers refresh a show once its last update is this old
     UPDATE_SCHEDULE_HOURS = int(os.environ.get('UPDATE_SCHEDULE_HOURS', 24))
     
+    # Job queue Configuration (workers run `flask jobs work`)
+    JOB_POLL_INTERVAL = 5  # seconds an idle worker waits before polling again
+    JOB_SCHEDULE_INTERVAL = 60  # seconds between sweeps for stale shows and dead jobs
+    JOB_SCHEDULE_BATCH = 10  # stale shows queued per sweep, stalest first
+    JOB_HEARTBEAT_INTERVAL = 30  # seconds between heartbeats of a running job
+    JOB_TIMEOUT_MINUTES = 10  # running jobs without a heartbeat for this long are retried
+    JOB_MAX_ATTEMPTS = 3
+    JOB_RETRY_DELAY = 60  # seconds before a failed job's first retry, doubled on each later one
+    JOB_METRICS_PORT = int(os.environ.get('JOB_METRICS_PORT', 0))  # workers serve /metrics here; 0 = off
+    
+    # Ingestion Configuration
+    INGESTION_CONCURRENCY = int(os.environ.get('INGESTION_CONCURRENCY', 8))  # parallel Listen Notes fetches
+    INGESTION_PROGRESS_INTERVAL = 30  # seconds between progress log lines
+    INGESTION_CLAIM_BATCH = 50  # episodes moved to 'processing' at a time; a dead run strands at most this many
+    INGESTION_WRITE_CHUNK = int(os.environ.get('INGESTION_WRITE_CHUNK', 1000))  # segment rows per bulk INSERT/COPY
+    INGESTION_USE_COPY = os.environ.get('INGESTION_USE_COPY', '0') == '1'  # COPY instead of INSERT on PostgreSQL (psycopg2)
+    INGESTION_STATUS_BATCH = 200  # unchanged/failed episode statuses committed together
+    
     # Embedding Configuration
     EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+    EMBEDDING_BACKEND = os.environ.get('EMBEDDING_BACKEND', 'torch')  # 'torch', 'torch-int8' (dynamic quantization, CPU) or 'onnx'
+    EMBEDDING_ONNX_PATH = os.environ.get('EMBEDDING_ONNX_PATH', os.path.join(basedir, 'embedding_model.onnx'))  # exported on first use
+    EMBEDDING_INTRA_OP_THREADS = int(os.environ.get('EMBEDDING_INTRA_OP_THREADS', 0))  # 0 = library default
+    EMBEDDING_INTER_OP_THREADS = int(os.environ.get('EMBEDDING_INTER_OP_THREADS', 0))
     EMBEDDING_BATCH_SIZE = 32
+    EMBEDDING_CACHE_SIZE = 20000  # in-memory LRU entries
+    EMBEDDING_CACHE_PATH = os.environ.get('EMBEDDING_CACHE_PATH', os.path.join(basedir, 'embedding_cache.db'))  # '' disables the disk tier
+    EMBEDDING_CACHE_MAX_ROWS = int(os.environ.get('EMBEDDING_CACHE_MAX_ROWS', 500000))  # disk tier entries, least recently used evicted; 0 = unlimited
+    EMBEDDING_PRELOAD = os.environ.get('EMBEDDING_PRELOAD', '1') == '1'  # load and warm up the model in create_app (api and worker roles)
+    SEARCH_TEXT_QUERIES = os.environ.get('SEARCH_TEXT_QUERIES', '1') == '1'  # embed text queries; '0' = embeddings only, the model is never loaded
+    QUERY_CACHE_SIZE = 4096  # recent search query embeddings kept in memory
+    SEARCH_BATCH_MAX_QUERIES = 1000  # per /api/search/batch request
+    
+    # Search index precision: 'float32', or 'float16' / 'int8' to use 2x / 4x less memory
+    INDEX_PRECISION = os.environ.get('INDEX_PRECISION', 'float32')
+    INDEX_RESCORE_FACTOR = 4  # with float16/int8, re-rank limit * factor candidates in float32 (0 = off)
+    INDEX_SNAPSHOT_DIR = os.environ.get('INDEX_SNAPSHOT_DIR', os.path.join(basedir, 'index_snapshots'))  # memory-mapped by all workers; '' disables
+    INDEX_SNAPSHOT_CHECK_INTERVAL = 5  # seconds between checks for a newer snapshot generation
+    
+    # Hybrid (BM25 + vector) search Configuration
+    HYBRID_ALPHA = 0.5  # weight of vector similarity; 1 - alpha goes to BM25
+    HYBRID_CANDIDATES = 200  # top segments taken from each index before fusing
+    
+    # Approximate search (IVF) Configuration
+    ANN_MIN_SEGMENTS = 50000  # smaller corpora are always searched exactly
+    ANN_NLIST = 0  # IVF cells; 0 = about 4 * sqrt(segments)
+    ANN_NPROBE = 16  # cells scanned per query; higher = better recall, slower
+    ANN_TRAIN_ITERATIONS = 10
+    ANN_TRAIN_POINTS_PER_CELL = 40  # k-means sample size per cell, so it grows with ANN_NLIST
+    ANN_RETRAIN_FACTOR = 4  # retrain once the corpus outgrows the training size this much
+    ANN_INDEX_PATH = os.environ.get('ANN_INDEX_PATH', os.path.join(basedir, 'ann_index.npz'))  # '' disables persistence
     
     # Transcript Segmentation
-    MAX_SEGMENT_LENGTH = 500  # characters
+    SEGMENT_MAX_TOKENS = 256  # model tokens per segment incl. special tokens; 0 = split by characters
+    SEGMENT_OVERLAP_TOKENS = 32  # tokens shared by consecutive segments
+    MAX_SEGMENT_LENGTH = 500  # characters, used when SEGMENT_MAX_TOKENS is 0
     
     # API Configuration
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*')
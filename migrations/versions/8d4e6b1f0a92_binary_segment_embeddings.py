@@ -0,0 +1,89 @@
+"""binary segment embeddings
+
+Revision ID: 8d4e6b1f0a92
+Revises: 2f1c0a7e5b3d
+Create Date: 2026-10-18 13:05:12.418230
+
+"""
+from alembic import op
+import sqlalchemy as sa
+import numpy as np
+import struct
+import json
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4e6b1f0a92'
+down_revision = '2f1c0a7e5b3d'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of the app.models binary layout (float32 only)
+EMBEDDING_HEADER = struct.Struct('<2sBxI')
+BATCH_SIZE = 5000
+
+segment = sa.table(
+    'segment',
+    sa.column('id', sa.Integer),
+    sa.column('embedding', sa.Text),
+    sa.column('embedding_bin', sa.LargeBinary),
+)
+
+
+def _encode(text):
+    vector = np.asarray(json.loads(text), dtype='<f4')
+    return EMBEDDING_HEADER.pack(b'EV', 1, vector.shape[0]) + vector.tobytes()
+
+
+def _decode(blob):
+    _, _, dimension = EMBEDDING_HEADER.unpack_from(blob)
+    vector = np.frombuffer(blob, dtype='<f4', count=dimension, offset=EMBEDDING_HEADER.size)
+    return json.dumps(vector.astype(np.float64).tolist())
+
+
+def _convert(source, target, convert):
+    """Rewrite ``source`` into ``target`` in id-ordered batches"""
+    bind = op.get_bind()
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(segment.c.id, segment.c[source])
+            .where(segment.c.id > last_id)
+            .where(segment.c[source].isnot(None))
+            .order_by(segment.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(
+            segment.update()
+            .where(segment.c.id == sa.bindparam('segment_id'))
+            .values({target: sa.bindparam('value')}),
+            [{'segment_id': row[0], 'value': convert(row[1])} for row in rows]
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    with op.batch_alter_table('segment') as batch_op:
+        batch_op.add_column(sa.Column('embedding_bin', sa.LargeBinary(), nullable=True))
+
+    _convert('embedding', 'embedding_bin', _encode)
+
+    with op.batch_alter_table('segment') as batch_op:
+        batch_op.drop_column('embedding')
+        batch_op.alter_column('embedding_bin', new_column_name='embedding',
+                              existing_type=sa.LargeBinary(), existing_nullable=True)
+
+
+def downgrade():
+    with op.batch_alter_table('segment') as batch_op:
+        batch_op.alter_column('embedding', new_column_name='embedding_bin',
+                              existing_type=sa.LargeBinary(), existing_nullable=True)
+    with op.batch_alter_table('segment') as batch_op:
+        batch_op.add_column(sa.Column('embedding', sa.Text(), nullable=True))
+
+    _convert('embedding_bin', 'embedding', _decode)
+
+    with op.batch_alter_table('segment') as batch_op:
+        batch_op.drop_column('embedding_bin')
@@ -0,0 +1,48 @@
+"""job retry delay and pending uniqueness
+
+Revision ID: e6f0b3c8d217
+Revises: a7d3e5f19c28
+Create Date: 2026-10-18 16:20:37.512904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6f0b3c8d217'
+down_revision = 'a7d3e5f19c28'
+branch_labels = None
+depends_on = None
+
+PENDING = "status IN ('queued', 'running')"
+
+
+def _fail_duplicate_pending_jobs():
+    # Keep one pending job per show (a running one, else the oldest) so the
+    # unique index can be built
+    op.execute(
+        "UPDATE job SET status = 'failed', error = 'duplicate pending job' "
+        f"WHERE {PENDING} AND EXISTS (SELECT 1 FROM job other "
+        "WHERE other.show_id = job.show_id AND other.id <> job.id "
+        "AND other.status IN ('queued', 'running') "
+        "AND (other.status = 'running' AND job.status = 'queued' "
+        "OR other.status = job.status AND other.id < job.id))"
+    )
+
+
+def upgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('run_after', sa.DateTime(), nullable=True))
+
+    _fail_duplicate_pending_jobs()
+
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.create_index('ix_job_pending_show', ['show_id'], unique=True,
+                              postgresql_where=sa.text(PENDING), sqlite_where=sa.text(PENDING))
+
+
+def downgrade():
+    with op.batch_alter_table('job', schema=None) as batch_op:
+        batch_op.drop_index('ix_job_pending_show')
+        batch_op.drop_column('run_after')
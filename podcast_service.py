@@ -1,5 +1,5 @@
 from app import create_app, db
-from app.models import Show, Episode, Segment, APIToken
+from app.models import Show, Episode, Segment, APIToken, Job
 
 app = create_app()
 
@@ -10,5 +10,6 @@ def make_shell_context():
         'Show': Show,
         'Episode': Episode,
         'Segment': Segment,
-        'APIToken': APIToken
+        'APIToken': APIToken,
+        'Job': Job
     }
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from config import Config
+from app import create_app, db
+from app.models import APIToken, Episode, Show
+
+EMBEDDING_DIMENSION = 16
+
+
+class TestConfig(Config):
+    TESTING = True
+    APP_ROLE = 'api'
+    EMBEDDING_PRELOAD = False
+    SEARCH_TEXT_QUERIES = False
+    EMBEDDING_CACHE_PATH = ''
+    EMBEDDING_CACHE_SIZE = 0
+    INDEX_SNAPSHOT_DIR = ''
+    ANN_INDEX_PATH = ''
+    SEGMENT_MAX_TOKENS = 0
+    MAX_SEGMENT_LENGTH = 200
+    QUERY_COUNT_HEADER = True
+    PROFILER_ENABLED = False
+    TOKEN_USAGE_FLUSH_INTERVAL = 3600
+    LISTENNOTES_API_KEY = 'test-key'
+    LISTENNOTES_RATE_LIMIT = 0
+    LISTENNOTES_CONNECT_TIMEOUT = 2
+    LISTENNOTES_READ_TIMEOUT = 2
+    LISTENNOTES_BACKOFF_BASE = 0.01
+    LISTENNOTES_BACKOFF_MAX = 0.5
+    INGESTION_CONCURRENCY = 2
+    INGESTION_CLAIM_BATCH = 3
+    INGESTION_PROGRESS_INTERVAL = 3600
+
+
+def fake_embeddings(texts, batch_size=None, token_ids=None):
+    """Deterministic unit vectors derived from each text's hash"""
+    vectors = np.array([
+        np.frombuffer(hashlib.sha256(text.encode('utf-8')).digest()[:EMBEDDING_DIMENSION], dtype=np.uint8)
+        for text in texts
+    ], dtype=np.float32).reshape(len(texts), EMBEDDING_DIMENSION) - 127.5
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """App on a fresh SQLite database, with stub embeddings instead of the model"""
+    from app.services import ingestion, podcast_service
+    from app.services.lexical_index import lexical_index
+    from app.services.segment_index import segment_index
+    from app.services.token_service import token_cache
+
+    monkeypatch.setattr(ingestion, 'create_embeddings', fake_embeddings)
+    monkeypatch.setattr(podcast_service, 'create_embeddings', fake_embeddings)
+    config = type('TestConfig', (TestConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+    })
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+    segment_index._reset()
+    lexical_index._reset()
+    token_cache.invalidate()
+
+
+@pytest.fixture
+def index(app):
+    """The process-wide segment index, loaded from the test database"""
+    from app.services.segment_index import segment_index
+
+    segment_index.load()
+    return segment_index
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def api_token(app):
+    token = APIToken(token='test-token', name='tests')
+    db.session.add(token)
+    db.session.commit()
+    return {'X-API-Token': token.token}
+
+
+@pytest.fixture
+def show_with_episodes(app):
+    """A show with pending episodes ``episode-0`` to ``episode-5``"""
+    show = Show(listennotes_id='show-1', title='Show 1')
+    db.session.add(show)
+    db.session.flush()
+    db.session.add_all([Episode(listennotes_id=f'episode-{i}', show_id=show.id, title=f'Episode {i}')
+                        for i in range(6)])
+    db.session.commit()
+    return show
+
+
+def episode_payloads(episode_ids, words=120):
+    """Details and word-timed transcript for each stub episode"""
+    payloads = {}
+    for n, episode_id in enumerate(episode_ids):
+        words_list = [{'word': f'{episode_id}-word{i}' + ('.' if i % 10 == 9 else ''),
+                       'start': i * 0.5, 'end': i * 0.5 + 0.4} for i in range(words)]
+        details = {'title': f'Stub {episode_id}', 'audio_length_sec': int(words * 0.5),
+                   'pub_date_ms': 1700000000000 + n * 86400000}
+        payloads[episode_id] = {'details': details, 'transcript': {'words': words_list}}
+    return payloads
+
+
+class StubListenNotes:
+    """Listen Notes stand-in serving episode payloads on a local port.
+
+    ``responses`` maps a path to a list of ``(status, headers, body)``
+    replies consumed one per request, ahead of the payloads. Every request
+    path is recorded in ``requests``.
+    """
+
+    def __init__(self, payloads=None):
+        self.payloads = payloads or {}
+        self.responses = {}
+        self.requests = []
+        self._lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, headers, body = stub.reply(self.path)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def reply(self, path):
+        with self._lock:
+            self.requests.append(path)
+            queued = self.responses.get(path)
+            if queued:
+                status, headers, body = queued.pop(0)
+                return status, headers, json.dumps(body).encode()
+        match = re.match(r'^/episodes/([^/]+)(/transcript)?$', path)
+        if match is None or match.group(1) not in self.payloads:
+            return 404, {}, b'{}'
+        payload = self.payloads[match.group(1)]
+        return 200, {}, json.dumps(payload['transcript' if match.group(2) else 'details']).encode()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def listennotes(app):
+    """A stub Listen Notes server that the app's client talks to"""
+    from app.services.podcast_service import ListenNotesAPI
+
+    stub = StubListenNotes()
+    app.config['LISTENNOTES_API_BASE_URL'] = stub.url
+    ListenNotesAPI.stats.reset()
+    yield stub
+    stub.close()
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+
+from app.services.ann_index import IVFIndex
+
+
+def unit_vectors(count, dimension=8, seed=0):
+    vectors = np.random.default_rng(seed).normal(size=(count, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    vectors = unit_vectors(200)
+    index = IVFIndex.train(vectors, 8, iterations=3)
+    index.bind(np.arange(200), index.assign(vectors))
+    index.database = 'abc123'
+    path = str(tmp_path / 'ann.npz')
+
+    index.save(path)
+    loaded = IVFIndex.load(path)
+
+    assert os.listdir(tmp_path) == ['ann.npz']
+    assert loaded.database == 'abc123'
+    assert loaded.trained_size == 200
+    assert loaded.version == index.version
+    assert list(loaded.ids) == list(range(200))
+    assert list(loaded.cells) == list(index.cells)
+    assert 5 in loaded.candidates(vectors[5], nprobe=1)
+
+
+def test_candidates_are_row_positions_including_appended_rows():
+    vectors = unit_vectors(300)
+    index = IVFIndex.train(vectors[:200], 8, iterations=3)
+    index.bind(np.arange(1000, 1200), index.assign(vectors[:200]))
+    index.append(np.arange(1200, 1300), index.assign(vectors[200:]))
+
+    assert sorted(index.candidates(vectors[0], nprobe=8)) == list(range(300))
+    for row in (3, 250):
+        cell = index.cells[row]
+        probed = index.candidates(index.centroids[cell], nprobe=1)
+        assert row in probed
+        assert (index.cells[probed] == cell).all()
+
+    index.keep(np.arange(300) % 2 == 0)
+    assert list(index.ids[:len(index)]) == list(range(1000, 1300, 2))
+    assert sorted(index.candidates(vectors[0], nprobe=8)) == list(range(150))
+
+
+def test_training_sample_grows_with_the_cell_count(monkeypatch):
+    import app.services.ann_index as ann_index
+
+    sampled = []
+    nearest = ann_index._nearest
+    monkeypatch.setattr(ann_index, '_nearest', lambda vectors, centroids: sampled.append(len(vectors))
+                        or nearest(vectors, centroids))
+    vectors = unit_vectors(2000)
+
+    IVFIndex.train(vectors, 4, iterations=1, points_per_cell=10)
+    IVFIndex.train(vectors, 16, iterations=1, points_per_cell=10)
+
+    assert sampled == [40, 160]
+
+
+def ann_config(app, tmp_path):
+    app.config.update(ANN_MIN_SEGMENTS=1, ANN_NLIST=4, ANN_TRAIN_ITERATIONS=2,
+                      ANN_INDEX_PATH=str(tmp_path / 'ann.npz'))
+    return app.config['ANN_INDEX_PATH']
+
+
+def test_requests_never_train_the_ann_index(app, index, tmp_path):
+    ann_config(app, tmp_path)
+    vectors = unit_vectors(50)
+    index.add(list(range(1, 51)), vectors, episode_id=1, show_id=1)
+
+    assert index.ensure_ann() is None
+    exact = index.search(vectors[7], threshold=-1.0, limit=5)
+    approximate = index.search_approximate(vectors[7], threshold=-1.0, limit=5)
+    assert list(approximate[0]) == list(exact[0])
+
+
+def test_approximate_search_scores_the_shared_matrix(app, index, tmp_path):
+    ann_config(app, tmp_path)
+    vectors = unit_vectors(80)
+    index.add(list(range(1, 61)), vectors[:60], episode_id=1, show_id=1)
+    ann = index.train_ann()
+    index.add(list(range(61, 81)), vectors[60:], episode_id=2, show_id=1)
+    index.remove([3, 70])
+
+    assert list(ann.ids[:len(ann)]) == list(index.all_ids())
+    exact = index.search(vectors[9], threshold=-1.0, limit=10)
+    approximate = index.search_approximate(vectors[9], threshold=-1.0, limit=10, nprobe=ann.nlist)
+    assert list(approximate[0]) == list(exact[0])
+    assert np.allclose(approximate[1], exact[1])
+
+
+def test_saved_index_is_loaded_and_reloaded_after_retraining(app, index, tmp_path):
+    path = ann_config(app, tmp_path)
+    vectors = unit_vectors(50)
+    index.add(list(range(1, 51)), vectors, episode_id=1, show_id=1)
+    trained = IVFIndex.train(vectors, 4, iterations=2)
+    trained.bind(np.arange(1, 41), trained.assign(vectors[:40]))
+    trained.database = index._database
+    trained.save(path)
+
+    ann = index.ensure_ann()
+    assert ann.version == trained.version
+    assert list(ann.ids[:len(ann)]) == list(range(1, 51))
+
+    retrained = IVFIndex.train(vectors, 4, iterations=2, seed=1)
+    retrained.database = index._database
+    retrained.save(path)
+    os.utime(path, ns=(0, 0))
+    assert index.ensure_ann().version == retrained.version
+
+
+def test_index_from_another_database_is_retrained(app, index, tmp_path):
+    path = ann_config(app, tmp_path)
+    vectors = unit_vectors(50)
+    foreign = IVFIndex.train(vectors, 4, iterations=2)
+    foreign.bind(np.arange(1000, 1050), foreign.assign(vectors))
+    foreign.database = 'another-database'
+    foreign.save(path)
+    index.add(list(range(1, 51)), vectors, episode_id=1, show_id=1)
+
+    assert index.ensure_ann() is None
+    ann = index.train_ann()
+
+    assert list(ann.ids[:len(ann)]) == list(range(1, 51))
+    assert IVFIndex.load(path).database == index._database
+    assert index.ensure_ann() is ann
@@ -0,0 +1,114 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from app.models import Episode
+from app.services.podcast_service import store_segments
+from conftest import fake_embeddings
+from test_segments import planned
+
+EMBEDDING = [0.1] * 16
+
+
+@pytest.mark.parametrize('body, error', [
+    ([{'embedding': EMBEDDING}], 'request body must be a JSON object'),
+    ({'queries': [{'embedding': EMBEDDING}], 'limit': '5'}, 'limit must be a non-negative integer'),
+    ({'queries': [{'embedding': EMBEDDING, 'threshold': 'high'}]}, 'queries[0]: threshold must be a number'),
+    ({'queries': [{'embedding': EMBEDDING}], 'alpha': 2}, 'alpha must be a number between 0 and 1'),
+    ({'queries': [{'embedding': 'abc'}]}, 'queries[0]: embedding must be a non-empty list of numbers'),
+])
+def test_batch_search_rejects_invalid_bodies(client, api_token, body, error):
+    response = client.post('/api/search/batch', json=body, headers=api_token)
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == error
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'embedding': EMBEDDING, 'limit': 2.5}, 'limit must be a non-negative integer'),
+    ({'embedding': EMBEDDING, 'limit': True}, 'limit must be a non-negative integer'),
+    ({'embedding': EMBEDDING, 'threshold': None}, 'threshold must be a number'),
+    ({'embedding': EMBEDDING, 'nprobe': 0}, 'nprobe must be a positive integer'),
+    ({'query': 'words', 'mode': 'hybrid', 'alpha': 'half'}, 'alpha must be a number between 0 and 1'),
+])
+def test_search_rejects_invalid_parameters(client, api_token, body, error):
+    response = client.post('/api/search', json=body, headers=api_token)
+
+    assert response.status_code == 400
+    assert response.get_json()['error'] == error
+
+
+def test_date_only_published_before_includes_the_whole_day(app, index, client, api_token, show_with_episodes):
+    published = {'episode-0': datetime(2024, 6, 30, 18, 45), 'episode-1': datetime(2024, 7, 1, 0, 0)}
+    for episode in Episode.query.filter(Episode.listennotes_id.in_(published)):
+        episode.published_at = published[episode.listennotes_id]
+        plan = planned(f'text of {episode.listennotes_id}')
+        store_segments(episode, plan, list(fake_embeddings([plan[0].text])))
+    db.session.commit()
+
+    response = client.post('/api/search', headers=api_token, json={
+        'embedding': [float(value) for value in fake_embeddings(['text of episode-0'])[0]],
+        'threshold': -1.0, 'limit': 10,
+        'published_after': '2024-06-30', 'published_before': '2024-06-30',
+    })
+
+    assert response.status_code == 200
+    assert [result['episode']['id'] for result in response.get_json()['results']] == ['episode-0']
+
+
+@pytest.fixture
+def stored_segments(app, index, show_with_episodes):
+    """Two segments stored for each of the show's episodes"""
+    for episode in Episode.query.order_by(Episode.id):
+        plan = planned(f'first part of {episode.listennotes_id}', f'second part of {episode.listennotes_id}')
+        store_segments(episode, plan, list(fake_embeddings([segment.text for segment in plan])))
+    return show_with_episodes
+
+
+def test_embeddings_must_match_the_index_dimension(client, api_token, stored_segments):
+    response = client.post('/api/search', json={'embedding': [0.1] * 8}, headers=api_token)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'embedding must have 16 values'
+
+    response = client.post('/api/search/batch', json={'queries': [{'embedding': EMBEDDING},
+                                                                  {'embedding': [0.1] * 8}]},
+                           headers=api_token)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'queries[1]: embedding must have 16 values'
+
+
+def test_batch_embeddings_must_match_each_other_on_an_empty_index(client, api_token, index):
+    response = client.post('/api/search/batch', json={'queries': [{'embedding': [0.1] * 8},
+                                                                  {'embedding': EMBEDDING}]},
+                           headers=api_token)
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'queries[1]: embedding must have 8 values'
+
+
+def query_count(response):
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return int(response.headers['X-Query-Count'])
+
+
+def test_listing_query_count_does_not_grow_with_rows(client, api_token, stored_segments):
+    client.get('/api/shows', headers=api_token)  # caches the token check
+
+    for url in ('/api/shows', '/api/shows/show-1/episodes', '/api/episodes/episode-0/segments'):
+        small = query_count(client.get(f'{url}?limit=1', headers=api_token))
+        large = query_count(client.get(f'{url}?limit=100', headers=api_token))
+        assert small == large, url
+        assert large <= 3, url
+
+
+def test_search_query_count_does_not_grow_with_results(client, api_token, stored_segments):
+    embedding = [float(value) for value in fake_embeddings(['first part of episode-0'])[0]]
+    body = {'embedding': embedding, 'threshold': -1.0}
+    client.post('/api/search', json=dict(body, limit=1), headers=api_token)
+
+    one = client.post('/api/search', json=dict(body, limit=1), headers=api_token)
+    many = client.post('/api/search', json=dict(body, limit=12), headers=api_token)
+    batch = client.post('/api/search/batch', json={'queries': [body] * 3, 'limit': 12}, headers=api_token)
+
+    assert len(many.get_json()['results']) == 12
+    assert query_count(one) == query_count(many) == query_count(batch)
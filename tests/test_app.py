@@ -0,0 +1,16 @@
+import pytest
+
+from app import command_role
+
+
+@pytest.mark.parametrize('args, role', [
+    (['run'], 'api'),
+    (['--app', 'podcast_service.py', 'run', '--port', '8000'], 'api'),
+    (['jobs', 'work', '--once'], 'worker'),
+    (['-A', 'podcast_service.py', 'jobs', 'work'], 'worker'),
+    (['db', 'upgrade'], 'cli'),
+    (['jobs', 'enqueue', 'work'], 'cli'),
+    ([], 'cli'),
+])
+def test_command_role(args, role):
+    assert command_role(args) == role
@@ -0,0 +1,60 @@
+import os
+
+import numpy as np
+import pytest
+from flask import current_app
+
+from conftest import TestConfig
+from app import create_app, db
+from app.models import Episode, Segment, Show
+from app.services.bulk_writer import insert_segments, supports_copy
+
+# COPY only runs against PostgreSQL with psycopg2. Point this at a scratch
+# database: tables are created if missing and every write is rolled back.
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL', '')
+
+TEXTS = ['plain', 'tab\there', 'line\nbreak', 'back\\slash', 'carriage\rreturn', 'ünïcode']
+
+
+def written_segments(episode_id):
+    """Insert TEXTS in chunks smaller than the input and read them back by returned id"""
+    vectors = np.arange(len(TEXTS) * 4, dtype=np.float32).reshape(len(TEXTS), 4)
+    ids = insert_segments([{'episode_id': episode_id, 'start_time': i, 'end_time': i + 1, 'text': text,
+                            'text_hash': f'{i:064x}', 'embedding': vectors[i]}
+                           for i, text in enumerate(TEXTS)], chunk_size=4)
+    stored = {segment.id: segment for segment in Segment.query.filter(Segment.id.in_(ids))}
+    assert [(stored[i].text, stored[i].start_time, stored[i].get_embedding().tolist()) for i in ids] == \
+        [(text, i, vectors[i].tolist()) for i, text in enumerate(TEXTS)]
+
+
+def test_insert_returns_ids_in_input_order(app, show_with_episodes):
+    written_segments(show_with_episodes.episodes[0].id)
+
+
+@pytest.fixture
+def postgres_app():
+    if not POSTGRES_URL:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+    pytest.importorskip('psycopg2')
+    config = type('PostgresConfig', (TestConfig,), {'SQLALCHEMY_DATABASE_URI': POSTGRES_URL})
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.rollback()
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.mark.parametrize('use_copy', [False, True])
+def test_postgres_write_paths_match(postgres_app, use_copy):
+    current_app.config['INGESTION_USE_COPY'] = use_copy
+    assert supports_copy()
+    show = Show(listennotes_id='bulk-writer-test', title='Bulk writer test')
+    db.session.add(show)
+    db.session.flush()
+    episode = Episode(listennotes_id='bulk-writer-test', show_id=show.id, title='Bulk writer test')
+    db.session.add(episode)
+    db.session.flush()
+
+    written_segments(episode.id)
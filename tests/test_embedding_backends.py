@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+
+from app.services import embedding_service
+
+SPECIAL_TOKENS = ['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]']
+WORDS = ('the podcast episode host guest talks about music science history politics startup '
+         'market interview story today week data model language learning climate energy').split()
+TEXTS = [' '.join(WORDS[i:i + length]) for i, length in
+         ((0, 3), (2, 17), (5, 1), (1, 9), (4, 20), (0, 2), (7, 12), (3, 5))]
+
+# Lowest cosine similarity to the baseline embeddings accepted per backend
+MIN_COSINE = {'torch': 0.99999, 'torch-int8': 0.99, 'onnx': 0.9999}
+
+
+@pytest.fixture(scope='module')
+def tiny_model(tmp_path_factory):
+    """A small random BERT and WordPiece vocabulary saved locally, so nothing is downloaded"""
+    directory = str(tmp_path_factory.mktemp('tiny-model'))
+    vocab_path = f'{directory}/vocab.txt'
+    with open(vocab_path, 'w') as f:
+        f.write('\n'.join(SPECIAL_TOKENS + WORDS) + '\n')
+    transformers.BertTokenizerFast(vocab_file=vocab_path).save_pretrained(directory)
+    torch.manual_seed(0)
+    config = transformers.BertConfig(vocab_size=len(SPECIAL_TOKENS) + len(WORDS), hidden_size=64,
+                                     num_hidden_layers=2, num_attention_heads=2, intermediate_size=128)
+    transformers.BertModel(config).save_pretrained(directory)
+    return directory
+
+
+@pytest.fixture(scope='module')
+def baseline_embeddings(tiny_model):
+    """Embeddings computed the way the service did before backends existed:
+    one text per forward pass, averaged over all of its tokens"""
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_model)
+    model = transformers.AutoModel.from_pretrained(tiny_model)
+    model.eval()
+    embeddings = []
+    for text in TEXTS:
+        inputs = tokenizer(text, padding=True, truncation=True, return_tensors='pt', max_length=512)
+        with torch.no_grad():
+            embeddings.append(model(**inputs).last_hidden_state.mean(dim=1).numpy()[0])
+    return np.array(embeddings)
+
+
+@pytest.fixture
+def use_backend(app, tiny_model, tmp_path, monkeypatch):
+    def use(name):
+        if name == 'onnx':
+            pytest.importorskip('onnxruntime')
+        app.config.update(EMBEDDING_MODEL=tiny_model, EMBEDDING_BACKEND=name,
+                          EMBEDDING_ONNX_PATH=str(tmp_path / 'model.onnx'))
+        for attribute in ('backend', 'tokenizer', 'cache', 'query_cache'):
+            monkeypatch.setattr(embedding_service, attribute, None)
+    return use
+
+
+@pytest.mark.parametrize('name', sorted(MIN_COSINE))
+def test_backend_matches_baseline_embeddings(use_backend, baseline_embeddings, name):
+    use_backend(name)
+
+    # Batches mix lengths, so padding must not change any embedding
+    embeddings = embedding_service.run_model(TEXTS, batch_size=3)
+
+    assert embeddings.shape == baseline_embeddings.shape
+    cosine = (embeddings * baseline_embeddings).sum(axis=1) / (
+        np.linalg.norm(embeddings, axis=1) * np.linalg.norm(baseline_embeddings, axis=1))
+    assert cosine.min() >= MIN_COSINE[name]
+
+
+def test_pre_tokenized_segments_match_raw_text(use_backend):
+    use_backend('torch')
+    tokenizer = embedding_service.load_tokenizer()
+    token_ids = [tokenizer(text, add_special_tokens=False)['input_ids'] for text in TEXTS]
+
+    np.testing.assert_allclose(embedding_service.run_model(TEXTS, 4, token_ids),
+                               embedding_service.run_model(TEXTS, 4), atol=1e-5)
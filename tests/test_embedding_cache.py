@@ -0,0 +1,41 @@
+import sqlite3
+
+import numpy as np
+
+from app.services.embedding_cache import EmbeddingCache
+
+
+def vector(i):
+    return np.full(4, i, dtype=np.float32)
+
+
+def test_disk_tier_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = iter(range(1000))
+    monkeypatch.setattr('app.services.embedding_cache.time.time', lambda: next(clock))
+    cache = EmbeddingCache(0, str(tmp_path / 'cache.db'), max_rows=10)
+    keys = [EmbeddingCache.key('model', f'text {i}') for i in range(15)]
+
+    cache.put_many(keys[:10], [vector(i) for i in range(10)])
+    # Reading the oldest entry makes it the most recently used
+    assert cache.get_many(keys[:1])[0][0] == 0
+    cache.put_many(keys[10:], [vector(i) for i in range(10, 15)])
+
+    cached = cache.get_many(keys)
+    kept = [i for i, embedding in enumerate(cached) if embedding is not None]
+    assert len(kept) == 9
+    assert 0 in kept and 1 not in kept
+    assert cache.stats()['evictions'] == 6
+
+
+def test_disk_tier_upgrades_files_without_access_times(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE embedding_cache (key BLOB PRIMARY KEY, embedding BLOB NOT NULL) WITHOUT ROWID')
+    conn.commit()
+    conn.close()
+
+    cache = EmbeddingCache(0, path, max_rows=5)
+    key = EmbeddingCache.key('model', 'text')
+    cache.put_many([key], [vector(1)])
+
+    assert cache.get_many([key])[0][0] == 1
@@ -0,0 +1,156 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from app.models import Episode, Segment
+from app.services import ingestion
+from app.services.ingestion import IngestionEngine
+from conftest import episode_payloads
+
+
+def run_with_timeout(app, shows, timeout=60):
+    """Run an ingestion on a thread and fail the test instead of hanging"""
+    result = {}
+
+    def target():
+        with app.app_context():
+            try:
+                result['progress'] = IngestionEngine(app).run(shows)
+            except Exception as e:
+                result['error'] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'ingestion run did not finish'
+    if 'error' in result:
+        raise result['error']
+    return result['progress']
+
+
+def statuses():
+    db.session.expire_all()
+    return {episode.listennotes_id: episode.transcript_status for episode in Episode.query}
+
+
+def ingestion_threads():
+    return [thread for thread in threading.enumerate()
+            if thread.name.startswith(('ingestion-fetch', 'ingestion-embedder'))]
+
+
+def test_pipeline_ingests_all_episodes(app, index, listennotes, show_with_episodes):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert (progress.total, progress.completed, progress.failed) == (6, 6, 0)
+    assert set(statuses().values()) == {'completed'}
+    assert Segment.query.count() == progress.segments > 0
+    assert len(index) == progress.segments
+    episode = Episode.query.filter_by(listennotes_id='episode-0').one()
+    assert episode.title == 'Stub episode-0'
+    assert episode.published_at is not None
+
+
+def test_unchanged_episodes_are_skipped(app, index, listennotes, show_with_episodes):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+    run_with_timeout(app, [show_with_episodes])
+    segments = Segment.query.count()
+
+    Episode.query.update({'transcript_status': 'pending'})
+    db.session.commit()
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert (progress.unchanged, progress.completed) == (6, 0)
+    assert Segment.query.count() == segments
+
+
+def test_fetch_failures_fail_only_their_episode(app, index, listennotes, show_with_episodes):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(5)])
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert (progress.completed, progress.failed) == (5, 1)
+    assert statuses()['episode-5'] == 'failed'
+
+
+def test_null_publish_date_is_kept(app, index, listennotes, show_with_episodes):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+    listennotes.payloads['episode-2']['details']['pub_date_ms'] = None
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert progress.completed == 6
+    assert Episode.query.filter_by(listennotes_id='episode-2').one().published_at is None
+
+
+def test_writer_failure_does_not_hang_the_run(app, index, listennotes, show_with_episodes, monkeypatch):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+    apply_details = ingestion.apply_episode_details
+
+    def failing_details(episode, details):
+        if episode.listennotes_id == 'episode-1':
+            raise TypeError('bad details')
+        apply_details(episode, details)
+
+    monkeypatch.setattr(ingestion, 'apply_episode_details', failing_details)
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert (progress.completed, progress.failed) == (5, 1)
+    assert statuses()['episode-1'] == 'failed'
+    assert ingestion_threads() == []
+
+
+def test_database_failure_releases_claimed_episodes(app, index, listennotes, show_with_episodes,
+                                                     monkeypatch):
+    # episode-3 has no payload, so its failed status is committed at once
+    listennotes.payloads = episode_payloads(['episode-0', 'episode-1', 'episode-2'])
+    app.config['INGESTION_STATUS_BATCH'] = 1
+    commit_statuses = IngestionEngine._commit_statuses
+
+    def failing_commit(self):
+        if any(db.session.get(Episode, episode_id).listennotes_id == 'episode-3' for episode_id in self._batched):
+            raise RuntimeError('database went away')
+        commit_statuses(self)
+
+    monkeypatch.setattr(IngestionEngine, '_commit_statuses', failing_commit)
+
+    with pytest.raises(RuntimeError, match='database went away'):
+        run_with_timeout(app, [show_with_episodes])
+
+    assert 'processing' not in statuses().values()
+    assert ingestion_threads() == []
+
+
+def test_stale_processing_episodes_are_reclaimed(app, index, listennotes, show_with_episodes):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+    stale = datetime.utcnow() - timedelta(minutes=app.config['JOB_TIMEOUT_MINUTES'] + 1)
+    Episode.query.filter(Episode.listennotes_id.in_(['episode-0', 'episode-1'])) \
+        .update({'transcript_status': 'processing', 'last_updated': stale}, synchronize_session=False)
+    Episode.query.filter_by(listennotes_id='episode-2') \
+        .update({'transcript_status': 'processing', 'last_updated': datetime.utcnow()})
+    db.session.commit()
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert progress.completed == 5
+    assert statuses()['episode-2'] == 'processing'
+
+
+def test_index_update_failure_keeps_stored_episodes_completed(app, index, listennotes, show_with_episodes,
+                                                              monkeypatch):
+    listennotes.payloads = episode_payloads([f'episode-{i}' for i in range(6)])
+
+    def failing_add(*args, **kwargs):
+        raise MemoryError('index full')
+
+    monkeypatch.setattr(index, 'add', failing_add)
+
+    progress = run_with_timeout(app, [show_with_episodes])
+
+    assert (progress.completed, progress.failed) == (6, 0)
+    assert set(statuses().values()) == {'completed'}
+    assert Segment.query.count() == progress.segments > 0
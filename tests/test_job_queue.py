@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models import Job
+from app.services.job_queue import PRIORITY_MANUAL, claim_job, enqueue_show_update, run_job
+
+
+def test_a_show_has_one_pending_job(app, show_with_episodes):
+    job = enqueue_show_update(show_with_episodes.id)
+
+    assert enqueue_show_update(show_with_episodes.id, PRIORITY_MANUAL).id == job.id
+    assert job.priority == PRIORITY_MANUAL
+
+    # The database rejects a second pending job from a racing process
+    db.session.add(Job(kind='update_show', show_id=show_with_episodes.id))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_failed_jobs_wait_before_retrying(app, show_with_episodes):
+    app.config['JOB_RETRY_DELAY'] = 60
+    db.session.add(Job(kind='unknown', show_id=show_with_episodes.id))
+    db.session.commit()
+
+    job = run_job(claim_job('test'))
+    assert job.status == 'queued'
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=50)
+    assert claim_job('test') is None
+
+    job.run_after = datetime.utcnow() - timedelta(seconds=1)
+    db.session.commit()
+    job = run_job(claim_job('test'))
+    assert job.attempts == 2
+    assert job.run_after > datetime.utcnow() + timedelta(seconds=110)
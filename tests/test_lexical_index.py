@@ -0,0 +1,156 @@
+import math
+
+import numpy as np
+import pytest
+
+from conftest import fake_embeddings
+from app import db
+from app.models import Episode, Segment, record_index_change
+from app.services.lexical_index import LexicalIndex, lexical_index, tokenize
+from app.services.podcast_service import store_segments
+from app.services.segment_index import SegmentIndex, segment_index
+from test_segments import planned, store_elsewhere
+
+
+def test_bm25_scores_follow_the_formula(app, show_with_episodes):
+    episode = Episode.query.first()
+    ids = store_elsewhere(episode, 'rust compiler', 'the rust compiler explained at some length', 'python')
+    lexical = LexicalIndex()
+    lexical.load()
+
+    found, scores = lexical.search('Rust, compiler!', limit=10)
+
+    assert found.tolist() == ids[:2]
+    average_length = (2 + 7 + 1) / 3
+    idf = math.log(1 + (3 - 2 + 0.5) / (2 + 0.5))
+    expected = [sum(idf * 2.2 / (1 + 1.2 * (0.25 + 0.75 * length / average_length)) for _ in range(2))
+                for length in (2, 7)]
+    assert np.allclose(scores, expected)
+    assert lexical.search('python java', limit=10)[0].tolist() == ids[2:]
+    assert lexical.search('java', limit=10)[0].tolist() == []
+
+
+def test_search_skips_removed_segments_and_honours_allowed_ids(app, show_with_episodes):
+    episode = Episode.query.first()
+    ids = store_elsewhere(episode, 'podcast about podcasts', 'another podcast', 'a third podcast')
+    lexical = LexicalIndex()
+    lexical.load()
+
+    lexical.remove([ids[0]])
+    assert sorted(lexical.search('podcast', limit=10)[0].tolist()) == ids[1:]
+    assert lexical.search('podcasts', limit=10)[0].tolist() == []
+    assert lexical.search('podcast', limit=10, allowed_ids=np.array(ids[:2]))[0].tolist() == [ids[1]]
+
+    # A reused id is indexed with its new text only
+    lexical.add([ids[0]], ['an interview'])
+    assert lexical.search('podcasts', limit=10)[0].tolist() == []
+    assert lexical.search('interview', limit=10)[0].tolist() == [ids[0]]
+    assert len(lexical) == 3
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("It's the RUST-lang 2024 show") == ['it', 's', 'the', 'rust', 'lang', '2024', 'show']
+
+
+def test_follows_segments_ingested_elsewhere_without_snapshots(app, show_with_episodes):
+    app.config['INDEX_SNAPSHOT_CHECK_INTERVAL'] = 0
+    segment_index.load()
+    episode = Episode.query.first()
+    first = store_elsewhere(episode, 'alpha words', 'beta words')
+    assert lexical_index.search('alpha', limit=10)[0].tolist() == first[:1]
+
+    second = store_elsewhere(episode, 'gamma words')
+    Segment.query.filter_by(id=first[0]).delete()
+    record_index_change()
+    db.session.commit()
+
+    assert lexical_index.search('gamma', limit=10)[0].tolist() == second
+    assert lexical_index.search('alpha', limit=10)[0].tolist() == []
+    assert sorted(lexical_index.search('words', limit=10)[0].tolist()) == first[1:] + second
+
+
+def test_follows_published_snapshot_generations(app, tmp_path, show_with_episodes):
+    app.config['INDEX_SNAPSHOT_DIR'] = str(tmp_path / 'snapshots')
+    app.config['INDEX_SNAPSHOT_CHECK_INTERVAL'] = 0
+    episode = Episode.query.first()
+    first = store_elsewhere(episode, 'alpha words')
+    segment_index.load()
+    assert lexical_index.search('words', limit=10)[0].tolist() == first
+
+    worker = SegmentIndex()
+    worker.load()
+    second = store_elsewhere(episode, 'beta words')
+    worker.add(second, fake_embeddings(['beta words']))
+    worker.remove(first)
+    Segment.query.filter_by(id=first[0]).delete()
+    db.session.commit()
+    assert worker.publish() == 2
+
+    assert lexical_index.search('words', limit=10)[0].tolist() == second
+    assert segment_index.generation == 2
+
+
+def hybrid(client, api_token, embedding_text, **body):
+    body = dict({'query': 'kubernetes', 'mode': 'hybrid', 'threshold': -1.0, 'limit': 10,
+                 'embedding': [float(value) for value in fake_embeddings([embedding_text])[0]]}, **body)
+    response = client.post('/api/search', json=body, headers=api_token)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return [(result['segment']['text'], result['episode']['id'], result['similarity'])
+            for result in response.get_json()['results']]
+
+
+@pytest.fixture
+def hybrid_segments(app, index, show_with_episodes):
+    """Keyword and vector matches spread over two episodes, one candidate per index"""
+    app.config['HYBRID_CANDIDATES'] = 1
+    first, second = Episode.query.order_by(Episode.id).limit(2)
+    for episode, texts in ((first, ('kubernetes operators explained', 'cooking pasta at home')),
+                           (second, ('kubernetes in production',))):
+        plan = planned(*texts)
+        store_segments(episode, plan, list(fake_embeddings(list(texts))))
+    db.session.commit()
+    return first, second
+
+
+def cosine(a, b):
+    return float(np.dot(*fake_embeddings([a, b])))
+
+
+def test_hybrid_ranks_a_keyword_only_match(client, api_token, hybrid_segments):
+    results = hybrid(client, api_token, 'cooking pasta at home')
+
+    texts = [text for text, _, _ in results]
+    assert texts[0] == 'cooking pasta at home'
+    keyword = next(result for result in results if 'kubernetes' in result[0])
+    assert keyword[2] == pytest.approx(0.5 * cosine(keyword[0], 'cooking pasta at home') + 0.5, abs=1e-5)
+
+
+def test_hybrid_alpha_extremes(client, api_token, hybrid_segments):
+    lexical_only = hybrid(client, api_token, 'cooking pasta at home', alpha=0)
+    vector_only = hybrid(client, api_token, 'cooking pasta at home', alpha=1)
+
+    assert lexical_only[0][0].startswith('kubernetes') and lexical_only[0][2] == pytest.approx(1.0)
+    assert all(similarity == pytest.approx(0.0) for text, _, similarity in lexical_only
+               if not text.startswith('kubernetes'))
+    assert vector_only[0][0] == 'cooking pasta at home' and vector_only[0][2] == pytest.approx(1.0)
+    for text, _, similarity in vector_only:
+        assert similarity == pytest.approx(cosine(text, 'cooking pasta at home'), abs=1e-5)
+
+
+def test_hybrid_applies_filters(client, api_token, hybrid_segments):
+    results = hybrid(client, api_token, 'kubernetes in production', alpha=0, episode_ids=['episode-0'])
+
+    assert {episode for _, episode, _ in results} == {'episode-0'}
+    assert results[0][0] == 'kubernetes operators explained'
+
+
+def test_hybrid_skips_removed_segments(client, api_token, hybrid_segments):
+    first, _ = hybrid_segments
+    plan = planned('cooking pasta at home')
+    store_segments(first, plan, [None])
+    db.session.commit()
+
+    results = hybrid(client, api_token, 'kubernetes operators explained', alpha=0)
+
+    assert 'kubernetes operators explained' not in [text for text, _, _ in results]
+    assert results[0][:2] == ('kubernetes in production', 'episode-1')
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+import requests
+
+from app.services import podcast_service
+from app.services.podcast_service import ListenNotesAPI
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Retry delays requested by the client, without actually sleeping"""
+    delays = []
+    monkeypatch.setattr(podcast_service.time, 'sleep', delays.append)
+    return delays
+
+
+def test_retries_transient_errors_until_success(app, listennotes, sleeps):
+    listennotes.responses['/episodes/ep'] = [(503, {}, {}), (500, {}, {}), (200, {}, {'title': 'ok'})]
+
+    details = ListenNotesAPI().get_episode_details('ep')
+
+    assert details == {'title': 'ok'}
+    assert listennotes.requests == ['/episodes/ep'] * 3
+    assert len(sleeps) == 2
+    assert ListenNotesAPI.stats.as_dict()['retries'] == 2
+
+
+def test_backoff_is_capped_and_jittered(app, listennotes, sleeps):
+    app.config['LISTENNOTES_MAX_RETRIES'] = 6
+    listennotes.responses['/episodes/ep'] = [(502, {}, {})] * 7
+
+    assert ListenNotesAPI().get_episode_details('ep') is None
+
+    assert len(listennotes.requests) == 7
+    base, cap = app.config['LISTENNOTES_BACKOFF_BASE'], app.config['LISTENNOTES_BACKOFF_MAX']
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= min(cap, base * 2 ** attempt)
+
+
+def test_honors_retry_after_seconds(app, listennotes, sleeps):
+    listennotes.responses['/episodes/ep'] = [(429, {'Retry-After': '0.25'}, {}), (200, {}, {'title': 'ok'})]
+
+    assert ListenNotesAPI().get_episode_details('ep') == {'title': 'ok'}
+    assert sleeps == [0.25]
+
+
+def test_honors_retry_after_date_capped_at_backoff_max(app, listennotes, sleeps):
+    retry_at = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime(time.time() + 3600))
+    listennotes.responses['/episodes/ep'] = [(429, {'Retry-After': retry_at}, {}), (200, {}, {})]
+
+    ListenNotesAPI().get_episode_details('ep')
+
+    assert sleeps == [app.config['LISTENNOTES_BACKOFF_MAX']]
+
+
+def test_client_errors_are_not_retried(app, listennotes, sleeps):
+    listennotes.responses['/episodes/ep/transcript'] = [(404, {}, {})]
+
+    assert ListenNotesAPI().get_episode_transcript('ep') is None
+    assert listennotes.requests == ['/episodes/ep/transcript']
+    assert sleeps == []
+
+
+def test_connection_errors_are_retried_then_raised(app, sleeps):
+    app.config['LISTENNOTES_API_BASE_URL'] = 'http://127.0.0.1:9'
+    app.config['LISTENNOTES_MAX_RETRIES'] = 2
+
+    with pytest.raises(requests.ConnectionError):
+        ListenNotesAPI().get_episode_details('ep')
+    assert len(sleeps) == 2
@@ -0,0 +1,289 @@
+from datetime import datetime
+import json
+import os
+
+import numpy as np
+import pytest
+
+from conftest import fake_embeddings
+from app import db
+from app.models import Episode, Segment, decode_embedding, encode_embedding, record_index_change
+from app.services.lexical_index import lexical_index
+from app.services.podcast_service import (
+    embed_new_segments, existing_segment_hashes, index_details_changed, new_segment_positions, store_segments
+)
+from app.services.index_snapshot import generation_path
+from app.services.segment_index import SegmentFilter, SegmentIndex, dequantize, quantize
+from app.services.transcript_service import TranscriptSegment
+
+
+def planned(*texts):
+    segments = []
+    for i, text in enumerate(texts):
+        segment = TranscriptSegment(text, 0, len(text))
+        segment.start_time, segment.end_time = i * 10, i * 10 + 10
+        segments.append(segment)
+    return segments
+
+
+def store(episode, plan):
+    known = existing_segment_hashes([episode.id])[episode.id]
+    embeddings = embed_new_segments(plan, known)
+    store_segments(episode, plan, embeddings)
+    return sorted(text for text, in db.session.query(Segment.text).filter_by(episode_id=episode.id))
+
+
+def test_new_positions_count_occurrences():
+    plan = planned('a', 'b', 'a', 'a')
+
+    assert new_segment_positions(plan, {}) == [0, 1, 2, 3]
+    assert new_segment_positions(plan, {plan[0].text_hash: 2}) == [1, 3]
+
+
+def test_reprocessing_with_a_repeated_stored_text(app, show_with_episodes, index):
+    episode = Episode.query.first()
+    assert store(episode, planned('intro', 'body')) == ['body', 'intro']
+
+    # The stored 'intro' is kept once; its second copy needs a new embedding
+    assert store(episode, planned('intro', 'body', 'intro')) == ['body', 'intro', 'intro']
+    assert store(episode, planned('intro', 'outro')) == ['intro', 'outro']
+    assert len(index) == 2
+
+
+def test_index_without_snapshots_follows_the_database(app, show_with_episodes, index):
+    app.config['INDEX_SNAPSHOT_CHECK_INTERVAL'] = 0
+    index.load()
+    lexical_index.load()
+    episode = Episode.query.first()
+
+    # Rows stored by another process, which never touch this one's index
+    def stored_elsewhere(*texts):
+        segments = [Segment(episode_id=episode.id, text=text) for text in texts]
+        for segment, embedding in zip(segments, fake_embeddings(list(texts))):
+            segment.set_embedding(embedding)
+        db.session.add_all(segments)
+        db.session.commit()
+        return [segment.id for segment in segments]
+
+    first = stored_elsewhere('alpha', 'beta')
+    assert index.all_ids().tolist() == first
+    lexical_index.ensure_loaded()
+    assert len(lexical_index) == 2
+
+    second = stored_elsewhere('gamma')
+    Segment.query.filter_by(id=first[0]).delete()
+    record_index_change()
+    db.session.commit()
+    assert index.all_ids().tolist() == first[1:] + second
+    lexical_index.ensure_loaded()
+    assert len(lexical_index) == 2
+
+    # A new publish time, as mark_unchanged records it, reaches the filters
+    published = datetime(2020, 5, 1)
+    episode.published_at = published
+    assert index_details_changed(episode)
+    record_index_change()
+    db.session.commit()
+    assert index.filter_ids(SegmentFilter(published_after=published)).tolist() == first[1:] + second
+
+
+def store_elsewhere(episode, *texts):
+    """Store segments the way another process would, without touching any index"""
+    segments = [Segment(episode_id=episode.id, text=text) for text in texts]
+    for segment, embedding in zip(segments, fake_embeddings(list(texts))):
+        segment.set_embedding(embedding)
+    db.session.add_all(segments)
+    db.session.commit()
+    return [segment.id for segment in segments]
+
+
+@pytest.fixture
+def snapshots(app, tmp_path):
+    """Snapshot directory shared by the SegmentIndex instances of a test"""
+    app.config['INDEX_SNAPSHOT_DIR'] = str(tmp_path / 'snapshots')
+    app.config['INDEX_SNAPSHOT_CHECK_INTERVAL'] = 0
+    return app.config['INDEX_SNAPSHOT_DIR']
+
+
+def loaded_index():
+    index = SegmentIndex()
+    index.load()
+    return index
+
+
+@pytest.mark.parametrize('precision', ['float32', 'int8'])
+def test_published_generation_reaches_other_processes(app, snapshots, show_with_episodes, precision):
+    app.config['INDEX_PRECISION'] = precision
+    episode = Episode.query.first()
+    first = store_elsewhere(episode, 'alpha', 'beta')
+    worker, reader = loaded_index(), loaded_index()
+    assert reader.generation == worker.generation == 1
+    assert reader.all_ids().tolist() == first
+
+    second = store_elsewhere(episode, 'gamma')
+    worker.add(second, fake_embeddings(['gamma']), episode.id, episode.show_id)
+    assert worker.publish() == 2
+    assert reader.all_ids().tolist() == first + second
+    assert reader.generation == 2
+    ids, _ = reader.search(fake_embeddings(['gamma'])[0], threshold=0.99)
+    assert ids.tolist() == second
+
+    # A pure append links the column files instead of copying them
+    matrix = [os.stat(os.path.join(generation_path(snapshots, generation), 'matrix.bin'))
+              for generation in (1, 2)]
+    assert matrix[0].st_ino == matrix[1].st_ino
+    assert worker.publish() is None
+
+
+def test_publish_folds_in_another_workers_generation(snapshots, show_with_episodes):
+    first_episode, second_episode = Episode.query.order_by(Episode.id).limit(2)
+    kept = store_elsewhere(first_episode, 'alpha', 'beta')
+    worker_a, worker_b = loaded_index(), loaded_index()
+
+    from_a = store_elsewhere(first_episode, 'gamma')
+    worker_a.add(from_a, fake_embeddings(['gamma']))
+    assert worker_a.publish() == 2
+
+    # Worker B still maps generation 1 and never saw worker A's segment
+    from_b = store_elsewhere(second_episode, 'delta')
+    Segment.query.filter_by(id=kept[0]).delete()
+    second_episode.published_at = datetime(2021, 3, 4)
+    record_index_change()
+    db.session.commit()
+    worker_b.add(from_b, fake_embeddings(['delta']))
+    worker_b.remove([kept[0]])
+    worker_b.update_episode(second_episode.id, second_episode.show_id, second_episode.published_at)
+    assert worker_b.publish() == 3
+
+    reader = loaded_index()
+    assert reader.generation == 3
+    assert reader.all_ids().tolist() == kept[1:] + from_a + from_b
+    assert reader.filter_ids(SegmentFilter(published_after=datetime(2021, 1, 1))).tolist() == from_b
+
+
+def test_generations_from_another_database_or_precision_are_rebuilt(app, snapshots, show_with_episodes):
+    ids = store_elsewhere(Episode.query.first(), 'alpha', 'beta')
+    loaded_index()
+    meta_path = os.path.join(generation_path(snapshots, 1), 'meta.json')
+    with open(meta_path) as f:
+        meta = json.load(f)
+    with open(meta_path, 'w') as f:
+        json.dump(dict(meta, database='elsewhere'), f)
+
+    index = loaded_index()
+    assert index.generation == 2
+    assert index.all_ids().tolist() == ids
+
+    app.config['INDEX_PRECISION'] = 'int8'
+    index = loaded_index()
+    assert index.generation == 3
+    assert index.all_ids().tolist() == ids
+    with open(os.path.join(generation_path(snapshots, 3), 'meta.json')) as f:
+        assert json.load(f)['precision'] == 'int8'
+
+
+def reference_top_k(texts, query, threshold, limit):
+    """Brute-force float64 ranking of ``texts`` (as stored by store_elsewhere)"""
+    vectors = fake_embeddings(texts).astype(np.float64)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    query = np.asarray(query, dtype=np.float64) / np.linalg.norm(query)
+    scores = vectors @ query
+    order = [i for i in np.argsort(-scores, kind='stable') if scores[i] >= threshold][:limit]
+    return order, scores[order]
+
+
+@pytest.fixture
+def corpus(app, show_with_episodes):
+    """300 stored segments and ten queries near some of them"""
+    texts = [f'segment number {i}' for i in range(300)]
+    ids = store_elsewhere(Episode.query.first(), *texts)
+    rng = np.random.default_rng(0)
+    queries = fake_embeddings(texts[:10]) + 0.3 * rng.standard_normal((10, 16)).astype(np.float32)
+    return texts, ids, queries
+
+
+def test_exact_search_matches_a_float64_reference(corpus):
+    texts, ids, queries = corpus
+    index = loaded_index()
+
+    for query, (threshold, limit) in zip(queries, [(-1.0, 10), (0.2, 300), (0.5, 5)] * 4):
+        rows, scores = reference_top_k(texts, query, threshold, limit)
+        found, similarities = index.search(query, threshold, limit)
+        assert found.tolist() == [ids[row] for row in rows]
+        assert np.allclose(similarities, scores, atol=1e-5)
+
+    thresholds, limits = [-1.0] * len(queries), [7] * len(queries)
+    for query, (found, similarities) in zip(queries, index.search_batch(queries, thresholds, limits)):
+        rows, scores = reference_top_k(texts, query, -1.0, 7)
+        assert found.tolist() == [ids[row] for row in rows]
+        assert np.allclose(similarities, scores, atol=1e-5)
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float16])
+def test_embedding_encoding_round_trip(dtype):
+    vector = np.random.default_rng(1).standard_normal(384).astype(np.float32)
+
+    encoded = encode_embedding(vector, dtype)
+    decoded = decode_embedding(encoded)
+
+    assert len(encoded) == 8 + 384 * np.dtype(dtype).itemsize
+    assert decoded.dtype == dtype and not decoded.flags.writeable
+    assert np.array_equal(decoded, vector.astype(dtype))
+
+
+def test_decode_embedding_reads_legacy_json_and_rejects_unknown_formats():
+    assert np.array_equal(decode_embedding('[0.5, -1.0]'), np.array([0.5, -1.0], dtype=np.float32))
+    assert decode_embedding(None) is None and decode_embedding(b'') is None
+    with pytest.raises(ValueError):
+        decode_embedding(b'XX\x01\x00\x02\x00\x00\x00' + bytes(8))
+
+
+def test_segment_embedding_survives_the_database(app, show_with_episodes):
+    vector = fake_embeddings(['stored'])[0]
+    segment = Segment(episode_id=Episode.query.first().id, text='stored')
+    segment.set_embedding(vector)
+    db.session.add(segment)
+    db.session.commit()
+    db.session.expire_all()
+
+    assert np.array_equal(db.session.get(Segment, segment.id).get_embedding(), vector)
+
+
+@pytest.mark.parametrize('precision', ['float16', 'int8'])
+def test_low_precision_search_matches_the_reference(app, corpus, precision):
+    texts, ids, queries = corpus
+    app.config['INDEX_PRECISION'] = precision
+
+    # Rescoring with the stored float32 embeddings restores the exact ranking
+    index = loaded_index()
+    for query in queries:
+        rows, scores = reference_top_k(texts, query, 0.1, 10)
+        found, similarities = index.search(query, threshold=0.1, limit=10)
+        assert found.tolist() == [ids[row] for row in rows]
+        assert np.allclose(similarities, scores, atol=1e-5)
+    batch = index.search_batch(queries, [0.1] * len(queries), [10] * len(queries))
+    assert [found.tolist() for found, _ in batch] == [index.search(query, 0.1, 10)[0].tolist()
+                                                      for query in queries]
+
+    # Without it scores are only off by the quantization error
+    app.config['INDEX_RESCORE_FACTOR'] = 0
+    index = loaded_index()
+    tolerance = 2e-3 if precision == 'float16' else 2e-2
+    for query in queries:
+        rows, scores = reference_top_k(texts, query, -1.0, 300)
+        found, similarities = index.search(query, threshold=-1.0, limit=300)
+        by_id = dict(zip([ids[row] for row in rows], scores))
+        assert np.allclose(similarities, [by_id[segment_id] for segment_id in found.tolist()], atol=tolerance)
+        assert found[0] == ids[rows[0]]
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float16', 'int8'])
+def test_quantize_round_trip(precision):
+    vectors = fake_embeddings([f'text {i}' for i in range(50)])
+
+    matrix, scales = quantize(vectors, precision)
+
+    assert matrix.dtype == precision
+    assert (scales is None) == (precision != 'int8')
+    error = np.abs(dequantize(matrix, scales) - vectors).max()
+    assert error <= {'float32': 0, 'float16': 1e-3, 'int8': 1 / 127}[precision]
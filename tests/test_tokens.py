@@ -0,0 +1,114 @@
+import pytest
+
+from app import create_app, db
+from app.models import APIToken
+from app.services.token_service import UsageRecorder, token_cache
+from conftest import TestConfig
+
+
+def search(client, token):
+    return client.post('/api/search', json={'embedding': [0.1] * 16}, headers={'X-API-Token': token})
+
+
+def test_deactivating_from_the_dashboard_revokes_at_once(client, api_token):
+    assert search(client, 'test-token').status_code == 200
+    token = APIToken.query.filter_by(token='test-token').one()
+
+    client.get(f'/tokens/{token.id}/toggle')
+
+    assert search(client, 'test-token').status_code == 401
+    client.get(f'/tokens/{token.id}/toggle')
+    assert search(client, 'test-token').status_code == 200
+
+
+def test_other_processes_see_revocation_when_the_entry_expires(app, client, api_token):
+    assert search(client, 'test-token').status_code == 200
+
+    # Deactivated by another process, which can't invalidate this cache
+    APIToken.query.filter_by(token='test-token').update({'is_active': False})
+    db.session.commit()
+    assert search(client, 'test-token').status_code == 200
+
+    app.config['TOKEN_CACHE_TTL'] = 0
+    token_cache.invalidate()
+    assert search(client, 'test-token').status_code == 401
+    assert search(client, 'test-token').status_code == 401
+
+
+def test_unknown_tokens_are_cached_until_invalidated(client, app):
+    assert search(client, 'new-token').status_code == 401
+    db.session.add(APIToken(token='new-token', name='late'))
+    db.session.commit()
+    assert search(client, 'new-token').status_code == 401
+
+    token_cache.invalidate('new-token')
+    assert search(client, 'new-token').status_code == 200
+
+
+@pytest.fixture
+def recorder(app):
+    recorder = UsageRecorder()
+    yield recorder
+    recorder._stop.set()
+
+
+def usage(token_id):
+    db.session.expire_all()
+    token = db.session.get(APIToken, token_id)
+    return token.requests_count, token.last_used
+
+
+def test_usage_is_written_in_one_batch(app, api_token, recorder):
+    token_id = APIToken.query.one().id
+    other = APIToken(token='other-token', name='other')
+    db.session.add(other)
+    db.session.commit()
+
+    for _ in range(3):
+        recorder.record(token_id)
+    recorder.record(other.id)
+    assert usage(token_id) == (0, None)
+
+    statements = []
+    db.event.listen(db.engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+    assert recorder.flush() == 2
+    assert len([statement for statement in statements if statement.startswith('UPDATE')]) == 1
+    assert usage(token_id)[0] == 3
+    assert usage(other.id)[0] == 1
+    assert usage(token_id)[1] is not None
+    assert recorder.flush() == 0
+
+
+def test_failed_flush_keeps_counts_for_the_next_one(app, api_token, recorder, monkeypatch):
+    token_id = APIToken.query.one().id
+    recorder.record(token_id)
+
+    def failing(*args, **kwargs):
+        raise RuntimeError('database unavailable')
+    with monkeypatch.context() as patch:
+        patch.setattr(db.session, 'execute', failing)
+        assert recorder.flush() == 0
+
+    recorder.record(token_id)
+    assert recorder.flush() == 1
+    assert usage(token_id)[0] == 2
+
+
+def test_usage_goes_to_the_app_it_was_recorded_in(app, api_token, recorder, tmp_path):
+    token_id = APIToken.query.one().id
+    recorder.record(token_id)
+
+    config = type('OtherConfig', (TestConfig,), {'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'other.db'}"})
+    other = create_app(config)
+    with other.app_context():
+        db.create_all()
+        db.session.add(APIToken(token='other-token', name='other'))
+        db.session.commit()
+        recorder.record(token_id)
+        assert usage(token_id)[0] == 0
+        assert recorder.flush() == 1
+        assert usage(token_id)[0] == 1
+        db.session.remove()
+        db.engine.dispose()
+
+    assert usage(token_id)[0] == 1
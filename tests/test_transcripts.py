@@ -0,0 +1,203 @@
+import math
+import re
+
+import pytest
+
+from app.services.transcript_service import (
+    TranscriptSegment, assign_times, parse_captions, parse_cue_time, parse_transcript,
+    segment_by_characters, segment_by_tokens
+)
+
+SRT = """1
+00:00:01,000 --> 00:00:03,500
+Welcome to <i>the</i> show.
+
+2
+00:00:04,000 --> 00:00:06,250
+Today we talk
+about databases.
+
+3
+01:02:03,4 --> 01:02:05,000
+Much later.
+"""
+
+VTT = """WEBVTT
+Kind: captions
+
+NOTE a comment block
+with no timing
+
+intro
+00:01.500 --> 00:03.000 align:start position:10%
+<v Host>Hello there</v>
+
+00:00:03.000 --> 00:00:04.750
+General Kenobi.
+"""
+
+
+class WordTokenizer:
+    """Stand-in fast tokenizer: one token per word or punctuation mark,
+    plus two special tokens around each input"""
+
+    def __init__(self):
+        self.vocabulary = {}
+
+    def __call__(self, text, add_special_tokens=True, return_offsets_mapping=False, verbose=True):
+        matches = list(re.finditer(r"\w+|[^\w\s]", text))
+        ids = [self.vocabulary.setdefault(match.group(), len(self.vocabulary)) for match in matches]
+        return {'input_ids': ids, 'offset_mapping': [match.span() for match in matches]}
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+
+@pytest.fixture
+def tokenizer():
+    return WordTokenizer()
+
+
+def sentence_text(first, last):
+    """Sentences ``first`` to ``last`` of five words and a full stop, six tokens each"""
+    return ' '.join(f's{i}a s{i}b s{i}c s{i}d s{i}e.' for i in range(first, last + 1))
+
+
+def sentences(count):
+    return sentence_text(0, count - 1)
+
+
+def test_token_windows_fit_the_budget_and_end_on_sentences(tokenizer):
+    text = sentences(10)
+
+    segments = list(segment_by_tokens(text, tokenizer, max_tokens=16))
+
+    # 14 tokens fit besides the special ones; two whole sentences are 12
+    assert [segment.text for segment in segments] == [sentence_text(i, i + 1) for i in range(0, 10, 2)]
+    for segment in segments:
+        assert len(segment.token_ids) <= 14
+        assert text[segment.char_start:segment.char_end] == segment.text
+        assert segment.token_ids == tokenizer(segment.text)['input_ids']
+
+
+def test_token_windows_without_sentence_ends_are_cut_at_the_budget(tokenizer):
+    text = ' '.join(f'w{i}' for i in range(25))
+
+    segments = list(segment_by_tokens(text, tokenizer, max_tokens=12))
+
+    assert [len(segment.token_ids) for segment in segments] == [10, 10, 5]
+    assert ' '.join(segment.text for segment in segments) == text
+
+
+def test_overlap_starts_on_a_sentence_boundary_when_possible(tokenizer):
+    text = sentences(5)
+
+    segments = list(segment_by_tokens(text, tokenizer, max_tokens=16, overlap=6))
+
+    assert [segment.text for segment in segments] == [sentence_text(i, i + 1) for i in range(4)]
+
+
+def test_overlap_shares_at_most_the_requested_tokens(tokenizer):
+    text = sentences(5)
+    tokens = tokenizer(text)['input_ids']
+
+    segments = list(segment_by_tokens(text, tokenizer, max_tokens=16, overlap=4))
+
+    assert segments[0].text == sentence_text(0, 1)
+    assert segments[1].text.startswith('s1c s1d s1e. s2a')
+    for previous, segment in zip(segments, segments[1:]):
+        shared = text[segment.char_start:previous.char_end]
+        assert 0 < len(tokenizer(shared)['input_ids']) <= 4
+    # Together the windows cover every token
+    covered = []
+    for segment in segments:
+        start = len(tokenizer(text[:segment.char_start])['input_ids'])
+        covered.extend(range(start, start + len(segment.token_ids)))
+    assert sorted(set(covered)) == list(range(len(tokens)))
+
+
+def test_overlap_is_capped_at_half_the_budget(tokenizer):
+    text = ' '.join(f'w{i}' for i in range(30))
+
+    segments = list(segment_by_tokens(text, tokenizer, max_tokens=12, overlap=50))
+
+    # Budget 10, overlap 5: each window starts five tokens after the last
+    assert [segment.text.split()[0] for segment in segments] == ['w0', 'w5', 'w10', 'w15', 'w20']
+
+
+def test_parse_srt_captions():
+    assert parse_captions(SRT) == [
+        ('Welcome to the show.', 1.0, 3.5),
+        ('Today we talk about databases.', 4.0, 6.25),
+        ('Much later.', 3723.4, 3725.0),
+    ]
+
+
+def test_parse_webvtt_captions():
+    assert parse_captions(VTT) == [
+        ('Hello there', 1.5, 3.0),
+        ('General Kenobi.', 3.0, 4.75),
+    ]
+
+
+@pytest.mark.parametrize('value, seconds', [
+    ('00:00:01,000', 1.0), ('00:01.5', 1.5), ('1:02:03.04', 3723.04), (' 10:00.250 ', 600.25),
+])
+def test_parse_cue_time(value, seconds):
+    assert parse_cue_time(value) == pytest.approx(seconds)
+
+
+def test_parse_cue_time_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_cue_time('soon')
+
+
+def test_caption_transcripts_record_cue_offsets():
+    parsed = parse_transcript({'transcript': VTT})
+
+    assert parsed.text == 'Hello there General Kenobi.'
+    assert parsed.cues == [(0, 11, 1.5, 3.0), (12, 27, 3.0, 4.75)]
+
+
+def word_transcript():
+    words = [('Hello', 0.0, 0.5), ('and', 0.6, 0.8), ('welcome.', 0.9, 1.4),
+             ('Today', 5.0, 5.4), ('we', 5.5, 5.6), ('talk', 5.7, 6.0), ('shop.', 6.1, 9.8)]
+    return parse_transcript({'words': [{'word': word, 'start': start, 'end': end}
+                                       for word, start, end in words]})
+
+
+def test_assign_times_follows_word_timings():
+    parsed = word_transcript()
+    segments = list(segment_by_characters(parsed.text, max_length=19))
+
+    assign_times(segments, parsed, duration=None)
+
+    assert [(segment.text, segment.start_time, segment.end_time) for segment in segments] == [
+        ('Hello and welcome.', 0, 2),
+        ('Today we talk', 5, 6),
+        ('shop.', 6, 10),
+    ]
+
+
+def test_assign_times_interpolates_inside_a_cue_and_snaps_gaps_forward():
+    parsed = parse_transcript({'transcript': SRT})
+    text = parsed.text
+    # Starts in the gap after the first cue, ends inside the second
+    middle = text.index('talk')
+    segment = TranscriptSegment(text[len('Welcome to the show.'):middle], len('Welcome to the show.'), middle)
+
+    assign_times([segment], parsed, duration=None)
+
+    cue_start, cue_end = text.index('Today'), text.index('Much') - 1
+    expected_end = 4.0 + 2.25 * (middle - cue_start) / (cue_end - cue_start)
+    assert segment.start_time == 4  # the second cue's start
+    assert segment.end_time == math.ceil(expected_end)
+
+
+def test_assign_times_without_cues_is_proportional_to_position():
+    parsed = parse_transcript({'transcript': 'x' * 100})
+    segments = [TranscriptSegment('x' * 40, 0, 40), TranscriptSegment('x' * 60, 40, 100)]
+
+    assign_times(segments, parsed, duration=250)
+
+    assert [(segment.start_time, segment.end_time) for segment in segments] == [(0, 100), (100, 250)]